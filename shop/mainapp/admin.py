@@ -1,11 +1,18 @@
 from django.contrib import admin
 
+from specs.admin import ProductFeaturesInline
+
 from .models import *
 
 
+class ProductAdmin(admin.ModelAdmin):
+    inlines = [ProductFeaturesInline]
+
+
 admin.site.register(Category)
 admin.site.register(Cart)
 admin.site.register(CartProduct)
 admin.site.register(Customer)
 admin.site.register(Order)
-admin.site.register(Product)
+admin.site.register(Product, ProductAdmin)
+admin.site.register(OrderProduct)
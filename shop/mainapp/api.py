@@ -0,0 +1,191 @@
+from django.core.files.storage import default_storage
+from django.http import JsonResponse
+from django.views.generic import View
+
+from .models import Category, Product
+from .pagination import InvalidCursor, keyset_paginate
+
+
+API_PAGE_SIZE = 24
+API_MAX_PAGE_SIZE = 100
+FIELDS_PARAM = 'fields'
+CURSOR_PARAM = 'cursor'
+
+# API field: column passed to .values(). Only the requested columns are
+# selected, and the category join is made only when asked for.
+CATEGORY_FIELDS = {
+    'id': 'id',
+    'name': 'name',
+    'slug': 'slug',
+    'updated_at': 'updated_at',
+}
+PRODUCT_FIELDS = {
+    'id': 'id',
+    'title': 'title',
+    'slug': 'slug',
+    'category': 'category__slug',
+    'price': 'price',
+    'image': 'image',
+    'description': 'description',
+    'features': 'features',
+    'updated_at': 'updated_at',
+}
+PRODUCT_SORTS = {
+    'price_asc': ('price', 'id'),
+    'price_desc': ('-price', '-id'),
+    'new': ('-id',),
+}
+
+
+def image_url(name):
+    return default_storage.url(name) if name else None
+
+
+CONVERTERS = {
+    'image': image_url,
+}
+
+
+class ApiError(Exception):
+
+    def __init__(self, errors, status=400):
+        super().__init__(errors)
+        self.errors = errors
+        self.status = status
+
+
+class ApiView(View):
+    """
+    Read-only JSON endpoint over .values() rows. ?fields=a,b limits the
+    payload to the listed fields.
+    """
+    fields = {}
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        except ApiError as error:
+            return JsonResponse({'errors': error.errors}, status=error.status)
+
+    def http_method_not_allowed(self, request, *args, **kwargs):
+        response = JsonResponse(
+            {'errors': {'method': [f'{request.method} is not allowed']}},
+            status=405,
+        )
+        response['Allow'] = ', '.join(self._allowed_methods())
+        return response
+
+    def get_fields(self):
+        value = self.request.GET.get(FIELDS_PARAM)
+        if not value:
+            return list(self.fields)
+        fields = list(dict.fromkeys(
+            name.strip() for name in value.split(',') if name.strip()
+        ))
+        unknown = [name for name in fields if name not in self.fields]
+        if unknown:
+            raise ApiError({
+                FIELDS_PARAM: [f'Unknown field "{name}"' for name in unknown],
+            })
+        return fields
+
+    def columns(self, fields, *extra):
+        return list(dict.fromkeys(
+            [*(self.fields[name] for name in fields), *extra]
+        ))
+
+    def serialize(self, row, fields):
+        data = {}
+        for name in fields:
+            value = row[self.fields[name]]
+            converter = CONVERTERS.get(name)
+            data[name] = converter(value) if converter else value
+        return data
+
+    def get_limit(self):
+        value = self.request.GET.get('limit')
+        if value is None:
+            return API_PAGE_SIZE
+        try:
+            limit = int(value)
+        except ValueError:
+            limit = 0
+        if not 1 <= limit <= API_MAX_PAGE_SIZE:
+            raise ApiError({'limit': [
+                f'Expected a number from 1 to {API_MAX_PAGE_SIZE}',
+            ]})
+        return limit
+
+    def paginate(self, queryset, ordering, fields):
+        try:
+            page = keyset_paginate(
+                queryset.values(*self.columns(fields, *(
+                    field.lstrip('-') for field in ordering
+                ))),
+                ordering,
+                self.request.GET.get(CURSOR_PARAM),
+                self.get_limit(),
+                strict=True,
+            )
+        except InvalidCursor:
+            raise ApiError({CURSOR_PARAM: ['Invalid cursor']})
+        next_url = None
+        if page.has_next():
+            params = self.request.GET.copy()
+            params[CURSOR_PARAM] = page.next_cursor
+            next_url = self.request.build_absolute_uri(
+                f'{self.request.path}?{params.urlencode()}'
+            )
+        return JsonResponse({
+            'results': [self.serialize(row, fields) for row in page],
+            'next': next_url,
+        })
+
+
+class CategoryListApiView(ApiView):
+    fields = CATEGORY_FIELDS
+
+    def get(self, request, *args, **kwargs):
+        return self.paginate(
+            Category.objects.all(),
+            ('id',),
+            self.get_fields(),
+        )
+
+
+class ProductListApiView(ApiView):
+    """
+    Products ordered by ?sort= (price_asc, price_desc or new), optionally
+    limited to ?category=<slug>. Pages are keyset based, so a deep page
+    costs the same as the first one.
+    """
+    fields = PRODUCT_FIELDS
+
+    def get(self, request, *args, **kwargs):
+        sort = request.GET.get('sort', 'price_asc')
+        if sort not in PRODUCT_SORTS:
+            raise ApiError({'sort': [
+                f'Expected one of: {", ".join(PRODUCT_SORTS)}',
+            ]})
+        queryset = Product.objects.all()
+        category = request.GET.get('category')
+        if category:
+            queryset = queryset.filter(category__slug=category)
+        return self.paginate(
+            queryset,
+            PRODUCT_SORTS[sort],
+            self.get_fields(),
+        )
+
+
+class ProductDetailApiView(ApiView):
+    fields = PRODUCT_FIELDS
+
+    def get(self, request, *args, **kwargs):
+        fields = self.get_fields()
+        row = Product.objects.filter(slug=kwargs['slug']).values(
+            *self.columns(fields)
+        ).first()
+        if row is None:
+            raise ApiError({'slug': ['Product not found']}, status=404)
+        return JsonResponse(self.serialize(row, fields))
@@ -0,0 +1,49 @@
+import functools
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections, connection
+
+from .views import BaseView, CategoryDetailView, ProductDetailView, SearchView
+
+
+def render_view(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    # Render here rather than back on the event loop's thread, where
+    # lazy context (cart, navigation) would hit the database again.
+    if callable(getattr(response, 'render', None)):
+        response.render()
+    return response
+
+
+def render_view_in_worker(view, request, *args, **kwargs):
+    try:
+        return render_view(view, request, *args, **kwargs)
+    finally:
+        # The request_finished handler runs in another thread, so the
+        # worker closes the connection it opened itself.
+        close_old_connections()
+
+
+def async_view(view):
+    """
+    Wraps a read-only sync view in a coroutine that runs it in a worker
+    thread, so under ASGI slow pages do not hold up other requests and
+    several pages render at once. Django 3.2 has no async ORM, so the
+    queries themselves stay sync.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            # An in-memory database (the test one) exists only in the
+            # connection of the request's own thread.
+            run = sync_to_async(render_view)
+        else:
+            run = sync_to_async(render_view_in_worker, thread_sensitive=False)
+        return await run(view, request, *args, **kwargs)
+    return wrapper
+
+
+base = async_view(BaseView.as_view())
+product_detail = async_view(ProductDetailView.as_view())
+category_detail = async_view(CategoryDetailView.as_view())
+search = async_view(SearchView.as_view())
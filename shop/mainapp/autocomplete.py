@@ -0,0 +1,229 @@
+import bisect
+import re
+import threading
+import time
+
+from django.db import transaction
+from django.urls import reverse
+
+from .models import Category, Product
+from .utils import bump_cache_version, get_cache_version
+
+
+AUTOCOMPLETE_VERSION_KEY = 'autocomplete'
+AUTOCOMPLETE_LIMIT = 10
+# Seconds between checks of the shared version, so a keystroke is served
+# from memory alone and changes made by other processes show up within
+# this delay.
+AUTOCOMPLETE_CHECK_INTERVAL = 5
+# Titles are also matched from their following words, up to this many.
+MAX_WORD_STARTS = 6
+# kind: (model, label field, detail url name)
+KINDS = {
+    'category': (Category, 'name', 'category_detail'),
+    'product': (Product, 'title', 'product_detail'),
+}
+
+
+NON_WORD = re.compile(r'\W+')
+
+
+def normalize(text):
+    return NON_WORD.sub(' ', text.casefold().replace('ё', 'е')).strip()
+
+
+class PrefixIndex:
+    """
+    Sorted array of "<key>\\0<kind>:<pk>" strings searched with bisect.
+    Every title is stored once per word it starts with, so "macb" finds
+    "Apple MacBook". Plain strings sort several times faster than tuples.
+    A published index is never changed, so it is searched without
+    locking; add() and remove() are applied to a copy().
+    """
+
+    def __init__(self, items=()):
+        self.keys = []
+        self.items = {}
+        for kind, pk, label, slug in items:
+            ref = f'{kind}:{pk}'
+            self.items[ref] = (kind, pk, label, slug)
+            self.keys.extend(
+                f'{key}\0{ref}' for key in self.word_starts(label)
+            )
+        self.keys.sort()
+
+    @classmethod
+    def build(cls):
+        items = []
+        for kind, (model, field, _) in KINDS.items():
+            items.extend(
+                (kind, pk, label, slug)
+                for pk, label, slug in model.objects.values_list(
+                    'pk', field, 'slug',
+                ).iterator()
+            )
+        return cls(items)
+
+    def copy(self):
+        index = type(self)()
+        index.keys = self.keys.copy()
+        index.items = self.items.copy()
+        return index
+
+    def word_starts(self, label):
+        text = normalize(label)
+        if not text:
+            return set()
+        starts = [0]
+        position = text.find(' ')
+        while position != -1 and len(starts) < MAX_WORD_STARTS:
+            starts.append(position + 1)
+            position = text.find(' ', position + 1)
+        return {text[start:] for start in starts}
+
+    def add(self, kind, pk, label, slug):
+        self.remove(kind, pk)
+        ref = f'{kind}:{pk}'
+        self.items[ref] = (kind, pk, label, slug)
+        for key in self.word_starts(label):
+            bisect.insort(self.keys, f'{key}\0{ref}')
+
+    def remove(self, kind, pk):
+        ref = f'{kind}:{pk}'
+        item = self.items.pop(ref, None)
+        if item is None:
+            return
+        for key in self.word_starts(item[2]):
+            entry = f'{key}\0{ref}'
+            position = bisect.bisect_left(self.keys, entry)
+            if self.keys[position:position + 1] == [entry]:
+                del self.keys[position]
+
+    def search(self, prefix, limit=AUTOCOMPLETE_LIMIT):
+        """Returns up to `limit` (kind, pk, label, slug) matches."""
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        found = {}
+        position = bisect.bisect_left(self.keys, prefix)
+        while position < len(self.keys) and len(found) < limit:
+            entry = self.keys[position]
+            if not entry.startswith(prefix):
+                break
+            ref = entry[entry.index('\0') + 1:]
+            found.setdefault(ref, self.items[ref])
+            position += 1
+        return list(found.values())
+
+
+# (index, shared version it was built for, time.monotonic() of the last
+# version check), replaced as a whole so readers always see a consistent
+# snapshot.
+_state = (None, None, 0)
+# Held while building or updating. Only the first build waits on it;
+# later refreshes are skipped while another thread is at it.
+_build_lock = threading.Lock()
+
+
+def refresh_autocomplete_index():
+    global _state
+    index, version, checked_at = _state
+    if index is not None and (
+        time.monotonic() - checked_at < AUTOCOMPLETE_CHECK_INTERVAL
+    ):
+        # Another thread refreshed while this one waited.
+        return index
+    current = get_cache_version(AUTOCOMPLETE_VERSION_KEY)
+    if index is None or version != current:
+        index = PrefixIndex.build()
+    _state = (index, current, time.monotonic())
+    return index
+
+
+def get_autocomplete_index():
+    """
+    Returns the process-wide index, built on first use. At most every
+    AUTOCOMPLETE_CHECK_INTERVAL seconds one request checks the shared
+    version and rebuilds if a change was made elsewhere; others keep
+    being served from the current index meanwhile.
+    """
+    index, version, checked_at = _state
+    if index is not None and (
+        time.monotonic() - checked_at < AUTOCOMPLETE_CHECK_INTERVAL
+    ):
+        return index
+    if not _build_lock.acquire(blocking=index is None):
+        return index
+    try:
+        return refresh_autocomplete_index()
+    finally:
+        _build_lock.release()
+
+
+def autocomplete(prefix, limit=AUTOCOMPLETE_LIMIT):
+    matches = get_autocomplete_index().search(prefix, limit)
+    return [
+        {
+            'type': kind,
+            'title': label,
+            'url': reverse(KINDS[kind][2], kwargs={'slug': slug}),
+        }
+        for kind, pk, label, slug in matches
+    ]
+
+
+def invalidate_autocomplete():
+    """
+    Makes every process rebuild its index, this one on the next lookup.
+    """
+    global _state
+    bump_cache_version(AUTOCOMPLETE_VERSION_KEY)
+    with _build_lock:
+        index, version, checked_at = _state
+        _state = (index, version, float('-inf'))
+
+
+def update_autocomplete(kind, pk, label=None, slug=None):
+    """
+    Applies one change to a copy of the local index and publishes it,
+    removing the item when `label` is None. Other processes see the
+    version bump and rebuild. Saves that leave the label and slug as
+    the up to date local index has them, e.g. price edits, are ignored
+    so they cost no rebuild anywhere.
+    """
+    global _state
+    previous = get_cache_version(AUTOCOMPLETE_VERSION_KEY)
+    index, version, checked_at = _state
+    if index is not None and version == previous:
+        item = index.items.get(f'{kind}:{pk}')
+        indexed = item[2:] if item else None
+        if indexed == (None if label is None else (label, slug)):
+            return
+    bump_cache_version(AUTOCOMPLETE_VERSION_KEY)
+    current = get_cache_version(AUTOCOMPLETE_VERSION_KEY)
+    with _build_lock:
+        index, version, checked_at = _state
+        if index is None or version != previous or current != previous + 1:
+            # Missed another change too; rebuild on the next lookup.
+            _state = (index, version, float('-inf'))
+            return
+        index = index.copy()
+        if label is None:
+            index.remove(kind, pk)
+        else:
+            index.add(kind, pk, label, slug)
+        _state = (index, current, time.monotonic())
+
+
+def schedule_autocomplete_update(instance, deleted=False):
+    """
+    Queues a saved or deleted Product or Category for the index. Runs
+    after commit, so a rolled back change never reaches the index.
+    """
+    for kind, (model, field, _) in KINDS.items():
+        if isinstance(instance, model):
+            break
+    pk = instance.pk
+    label = None if deleted else getattr(instance, field)
+    slug = instance.slug
+    transaction.on_commit(lambda: update_autocomplete(kind, pk, label, slug))
@@ -0,0 +1,7 @@
+from django.utils.functional import SimpleLazyObject
+
+from .utils import get_category_navigation
+
+
+def categories(request):
+    return {'categories': SimpleLazyObject(get_category_navigation)}
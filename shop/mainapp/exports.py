@@ -0,0 +1,128 @@
+import csv
+import json
+import tempfile
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import F
+
+from .models import Order, OrderProduct
+from .utils import chunked
+
+
+EXPORT_FORMATS = ('csv', 'jsonl')
+# Exports larger than this are spooled to a temporary file on disk.
+EXPORT_SPOOL_SIZE = 8 * 1024 * 1024
+ORDER_FIELDS = (
+    'created_at',
+    'status',
+    'buying_type',
+    'order_data',
+    'first_name',
+    'last_name',
+    'phone',
+    'address',
+    'total_products',
+    'final_price',
+    'customer_id',
+)
+ORDER_ALIASES = {
+    'order_id': F('pk'),
+    'customer_username': F('customer__user__username'),
+    'customer_email': F('customer__user__email'),
+}
+ORDER_COLUMNS = ('order_id', *ORDER_FIELDS, 'customer_username',
+                 'customer_email')
+LINE_FIELDS = ('product_id', 'title', 'price', 'qty')
+LINE_ALIASES = {
+    'line_final_price': F('final_price'),
+}
+LINE_COLUMNS = (*LINE_FIELDS, 'line_final_price')
+
+
+def filter_orders(date_from=None, date_to=None, statuses=None):
+    orders = Order.objects.order_by('pk')
+    if date_from:
+        orders = orders.filter(created_at__date__gte=date_from)
+    if date_to:
+        orders = orders.filter(created_at__date__lte=date_to)
+    if statuses:
+        orders = orders.filter(status__in=statuses)
+    return orders
+
+
+def iter_orders(orders, chunk_size=2000):
+    """
+    Yields (order, lines) pairs as plain dicts. Orders are read with a
+    chunked cursor and the lines of each chunk with one more query, so
+    memory stays flat however many orders match.
+    """
+    rows = orders.values(*ORDER_FIELDS, **ORDER_ALIASES).iterator(
+        chunk_size=chunk_size,
+    )
+    for chunk in chunked(rows, chunk_size):
+        lines = defaultdict(list)
+        order_products = OrderProduct.objects.filter(
+            order_id__in=[order['order_id'] for order in chunk],
+        ).order_by('pk').values('order_id', *LINE_FIELDS, **LINE_ALIASES)
+        for line in order_products:
+            lines[line['order_id']].append(
+                {column: line[column] for column in LINE_COLUMNS}
+            )
+        for order in chunk:
+            yield (
+                {column: order[column] for column in ORDER_COLUMNS},
+                lines[order['order_id']],
+            )
+
+
+class Echo:
+    """File-like object that hands back what csv.writer writes."""
+
+    def write(self, value):
+        return value
+
+
+def export_csv(orders):
+    """One row per order line; orders without lines get a single row."""
+    writer = csv.writer(Echo())
+    yield writer.writerow([*ORDER_COLUMNS, *LINE_COLUMNS])
+    empty = [''] * len(LINE_COLUMNS)
+    for order, lines in orders:
+        values = list(order.values())
+        for line in lines or [None]:
+            yield writer.writerow(
+                values + (list(line.values()) if line else empty)
+            )
+
+
+def export_jsonl(orders):
+    for order, lines in orders:
+        yield json.dumps(
+            {**order, 'lines': lines},
+            cls=DjangoJSONEncoder,
+            ensure_ascii=False,
+        ) + '\n'
+
+
+EXPORTERS = {
+    'csv': export_csv,
+    'jsonl': export_jsonl,
+}
+
+
+def export_orders(orders, export_format, chunk_size=2000):
+    return EXPORTERS[export_format](iter_orders(orders, chunk_size))
+
+
+def spool_export(orders, export_format, chunk_size=2000):
+    """
+    Writes the whole export to a temporary file and returns it rewound.
+    All queries run here, so the response that streams the file does no
+    database work, which the ASGI handler would do on the event loop.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_SIZE)
+    for part in export_orders(orders, export_format, chunk_size):
+        spool.write(part.encode())
+    spool.seek(0)
+    return spool
@@ -1,6 +1,7 @@
 from django import forms
 from django.contrib.auth.models import User
 
+from .exports import EXPORT_FORMATS
 from .models import Order
 
 
@@ -113,3 +114,27 @@ class RegistrationForm(forms.ModelForm):
             'email',
             'address',
         ]
+
+
+class OrderExportForm(forms.Form):
+    date_from = forms.DateField(required=False, label='С даты')
+    date_to = forms.DateField(required=False, label='По дату')
+    status = forms.MultipleChoiceField(
+        choices=Order.STATUS_CHOICES,
+        required=False,
+        label='Статус заказа',
+    )
+    format = forms.ChoiceField(
+        choices=[(name, name) for name in EXPORT_FORMATS],
+        required=False,
+        label='Формат',
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        date_from = cleaned_data.get('date_from')
+        date_to = cleaned_data.get('date_to')
+        if date_from and date_to and date_from > date_to:
+            raise forms.ValidationError('Начальная дата позже конечной')
+        cleaned_data['format'] = cleaned_data.get('format') or 'csv'
+        return cleaned_data
@@ -0,0 +1,147 @@
+import hashlib
+import io
+import json
+import posixpath
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, UnidentifiedImageError
+
+from .utils import bump_cache_version
+
+
+# Variants are never wider than the original; the original itself stays
+# the widest candidate of the srcset.
+IMAGE_WIDTHS = (200, 400, 800)
+IMAGE_VARIANTS_DIR = 'thumbs'
+IMAGE_VARIANTS_KEY = 'image_variants:{}'
+# Bumped whenever variants appear, for pages that embed many images.
+IMAGE_VARIANTS_VERSION_KEY = 'image_variants'
+# How long a missing manifest is remembered before storage is checked
+# again, so images backfilled later show up without a cache clear.
+MISSING_VARIANTS_TIMEOUT = 300
+SAVE_OPTIONS = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 80, 'method': 4},
+}
+EXTENSIONS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp'}
+
+
+def variant_name(name, width, extension):
+    stem = posixpath.splitext(name)[0]
+    return posixpath.join(IMAGE_VARIANTS_DIR, f'{stem}-{width}.{extension}')
+
+
+def manifest_name(name):
+    stem = posixpath.splitext(name)[0]
+    return posixpath.join(IMAGE_VARIANTS_DIR, f'{stem}.json')
+
+
+def cache_key(name):
+    digest = hashlib.md5(name.encode()).hexdigest()
+    return IMAGE_VARIANTS_KEY.format(digest)
+
+
+def save_file(storage, name, content):
+    # Storage.save() would pick a new name instead of overwriting.
+    if storage.exists(name):
+        storage.delete(name)
+    storage.save(name, ContentFile(content))
+
+
+def encode(image, image_format):
+    if image_format == 'JPEG' and image.mode != 'RGB':
+        image = image.convert('RGB')
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **SAVE_OPTIONS[image_format])
+    return buffer.getvalue()
+
+
+def generate_image_variants(name, force=False, storage=default_storage):
+    """
+    Writes downscaled copies of the image `name` in its own format (JPEG
+    for anything but PNG and WebP) and in WebP, plus a JSON manifest the
+    template tag reads. Returns the manifest, or None when the file is
+    missing or not an image. Existing variants are kept unless `force`.
+    Safe to run in a worker process.
+    """
+    manifest_path = manifest_name(name)
+    if not force and storage.exists(manifest_path):
+        with storage.open(manifest_path) as manifest:
+            return json.load(manifest)
+    try:
+        with storage.open(name) as original:
+            image = Image.open(original)
+            image.load()
+    except (OSError, UnidentifiedImageError):
+        return None
+    image_format = image.format if image.format in SAVE_OPTIONS else 'JPEG'
+    extension = EXTENSIONS[image_format]
+    width, height = image.size
+    widths = [size for size in IMAGE_WIDTHS if size < width]
+    for size in widths:
+        resized = image.resize(
+            (size, max(1, round(height * size / width))),
+            Image.LANCZOS,
+        )
+        save_file(storage, variant_name(name, size, extension),
+                  encode(resized, image_format))
+        save_file(storage, variant_name(name, size, 'webp'),
+                  encode(resized, 'WEBP'))
+    save_file(storage, variant_name(name, width, 'webp'),
+              encode(image, 'WEBP'))
+    manifest = {'width': width, 'widths': widths, 'extension': extension}
+    save_file(storage, manifest_path, json.dumps(manifest).encode())
+    return manifest
+
+
+def cache_image_variants(name, manifest):
+    """Publishes the result of generate_image_variants()."""
+    if manifest:
+        cache.set(cache_key(name), manifest, None)
+        bump_cache_version(IMAGE_VARIANTS_VERSION_KEY)
+    else:
+        cache.set(cache_key(name), {}, MISSING_VARIANTS_TIMEOUT)
+
+
+def get_image_variants(name):
+    """
+    Returns the manifest of `name`, or None if it has no variants yet.
+    Read from the cache; storage is only opened on a miss.
+    """
+    key = cache_key(name)
+    manifest = cache.get(key)
+    if manifest is None:
+        path = manifest_name(name)
+        if default_storage.exists(path):
+            with default_storage.open(path) as manifest_file:
+                manifest = json.load(manifest_file)
+            cache.set(key, manifest, None)
+        else:
+            manifest = {}
+            cache.set(key, manifest, MISSING_VARIANTS_TIMEOUT)
+    return manifest or None
+
+
+def image_srcsets(image):
+    """
+    Returns (srcset, webp srcset) for an ImageField file, or None when
+    no variants were generated for it.
+    """
+    manifest = get_image_variants(image.name)
+    if manifest is None:
+        return None
+    url = default_storage.url
+    srcset = [
+        f'{url(variant_name(image.name, width, manifest["extension"]))} '
+        f'{width}w'
+        for width in manifest['widths']
+    ]
+    srcset.append(f'{image.url} {manifest["width"]}w')
+    webp = [
+        f'{url(variant_name(image.name, width, "webp"))} {width}w'
+        for width in [*manifest['widths'], manifest['width']]
+    ]
+    return ', '.join(srcset), ', '.join(webp)
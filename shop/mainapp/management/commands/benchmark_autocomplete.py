@@ -0,0 +1,60 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from mainapp.autocomplete import PrefixIndex
+
+
+WORDS = (
+    'apple', 'samsung', 'xiaomi', 'lenovo', 'asus', 'macbook', 'galaxy',
+    'redmi', 'thinkpad', 'zenbook', 'pro', 'air', 'ultra', 'mini', 'max',
+    'ноутбук', 'смартфон', 'планшет', 'чехол', 'зарядка', 'наушники',
+    'черный', 'белый', 'серый', '128гб', '256гб', '512гб', '16гб',
+)
+
+
+def synthetic_titles(count, rng):
+    for pk in range(1, count + 1):
+        words = rng.choices(WORDS, k=rng.randint(2, 6))
+        yield 'product', pk, f'{" ".join(words)} {pk}', f'product-{pk}'
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures autocomplete lookup latency on an in-memory index of '
+        'synthetic titles. Does not touch the database.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--titles', type=int, default=100000)
+        parser.add_argument('--lookups', type=int, default=20000)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        index = PrefixIndex(synthetic_titles(options['titles'], rng))
+        self.stdout.write(
+            f'Indexed {options["titles"]} titles '
+            f'({len(index.keys)} keys) '
+            f'in {time.perf_counter() - started:.2f}s'
+        )
+        prefixes = [
+            rng.choice(WORDS)[:rng.randint(1, 5)]
+            for _ in range(options['lookups'])
+        ]
+        latencies = []
+        for prefix in prefixes:
+            started = time.perf_counter()
+            index.search(prefix)
+            latencies.append((time.perf_counter() - started) * 1e6)
+        percentiles = statistics.quantiles(latencies, n=100)
+        self.stdout.write(
+            f'{len(latencies)} lookups: '
+            f'p50 {percentiles[49]:.1f}us, '
+            f'p95 {percentiles[94]:.1f}us, '
+            f'p99 {percentiles[98]:.1f}us, '
+            f'max {max(latencies):.1f}us'
+        )
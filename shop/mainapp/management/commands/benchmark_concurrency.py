@@ -0,0 +1,208 @@
+import asyncio
+import io
+import os
+import statistics
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.models import Category, Product
+
+
+MODES = ('wsgi', 'asgi')
+HOST = 'localhost'
+
+
+def wsgi_environ(path):
+    url = urlsplit(path)
+    return {
+        'REQUEST_METHOD': 'GET',
+        'PATH_INFO': url.path,
+        'QUERY_STRING': url.query,
+        'SERVER_NAME': HOST,
+        'SERVER_PORT': '80',
+        'HTTP_HOST': HOST,
+        'SERVER_PROTOCOL': 'HTTP/1.1',
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+
+
+def asgi_scope(path):
+    url = urlsplit(path)
+    return {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': url.path,
+        'query_string': url.query.encode(),
+        'headers': [(b'host', HOST.encode())],
+        'client': ('127.0.0.1', 0),
+        'server': (HOST, 80),
+    }
+
+
+def run_wsgi(paths, threads, concurrency):
+    """
+    `concurrency` clients share a server of `threads` worker threads, as
+    with gunicorn --threads; requests beyond that queue for a free one.
+    """
+    handler = WSGIHandler()
+
+    def serve(path):
+        status = []
+        body = handler(
+            wsgi_environ(path),
+            lambda code, headers, exc_info=None: status.append(code),
+        )
+        try:
+            b''.join(body)
+        finally:
+            body.close()
+        return status[0].startswith('200')
+
+    with ThreadPoolExecutor(max_workers=threads) as server:
+
+        def fetch(path):
+            started = time.perf_counter()
+            ok = server.submit(serve, path).result()
+            return ok, time.perf_counter() - started
+
+        # Warm up the per-process indexes and caches first.
+        for path in set(paths):
+            fetch(path)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as clients:
+            results = list(clients.map(fetch, paths))
+        return results, time.perf_counter() - started
+
+
+def run_asgi(paths, concurrency):
+    handler = ASGIHandler()
+
+    async def fetch(path, clients):
+        async with clients:
+            started = time.perf_counter()
+            messages = []
+
+            async def receive():
+                return {'type': 'http.request', 'body': b''}
+
+            async def send(message):
+                messages.append(message)
+
+            await handler(asgi_scope(path), receive, send)
+            return (
+                messages[0]['status'] == 200,
+                time.perf_counter() - started,
+            )
+
+    async def main():
+        clients = asyncio.Semaphore(concurrency)
+        for path in set(paths):
+            await fetch(path, clients)
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(fetch(path, clients) for path in paths)
+        )
+        return results, time.perf_counter() - started
+
+    return asyncio.run(main())
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the throughput of the catalog pages served by the WSGI '
+        'handler with sync views and by the ASGI handler with async views '
+        'under the same number of concurrent requests. Each mode runs in '
+        'its own process against the configured database; seed it first.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400)
+        parser.add_argument('--concurrency', type=int, default=32,
+                            help='Requests in flight.')
+        parser.add_argument('--threads', type=int, default=4,
+                            help='Worker threads of the WSGI server.')
+        parser.add_argument('--path', action='append', dest='paths',
+                            help='Page to request, repeatable. Defaults '
+                                 'to the home, a category, a product and '
+                                 'a search page.')
+        parser.add_argument('--mode', choices=MODES,
+                            help='Run one mode in this process.')
+
+    def handle(self, *args, **options):
+        if options['mode'] is None:
+            for mode in MODES:
+                self.run_process(mode, options)
+            return
+        if (options['mode'] == 'asgi') != settings.ASYNC_CATALOG_VIEWS:
+            raise CommandError(
+                'Set SHOP_ASYNC_VIEWS=1 for asgi and unset it for wsgi.'
+            )
+        paths = options['paths'] or self.default_paths()
+        paths = [
+            paths[i % len(paths)] for i in range(options['requests'])
+        ]
+        if options['mode'] == 'wsgi':
+            results, elapsed = run_wsgi(
+                paths, options['threads'], options['concurrency'],
+            )
+        else:
+            results, elapsed = run_asgi(paths, options['concurrency'])
+        latencies = [latency * 1000 for _, latency in results]
+        percentiles = statistics.quantiles(latencies, n=100)
+        failed = sum(1 for ok, _ in results if not ok)
+        self.stdout.write(
+            f'{options["mode"]}: {len(results) / elapsed:.0f} req/s, '
+            f'p50 {percentiles[49]:.0f}ms, p95 {percentiles[94]:.0f}ms, '
+            f'{failed} failed'
+        )
+
+    def run_process(self, mode, options):
+        env = dict(os.environ)
+        env.pop('SHOP_ASYNC_VIEWS', None)
+        if mode == 'asgi':
+            env['SHOP_ASYNC_VIEWS'] = '1'
+        env.setdefault('DJANGO_SETTINGS_MODULE', 'shop.settings')
+        command = [
+            sys.executable, '-m', 'django', 'benchmark_concurrency',
+            '--mode', mode,
+            '--requests', str(options['requests']),
+            '--concurrency', str(options['concurrency']),
+            '--threads', str(options['threads']),
+        ]
+        for path in options['paths'] or ():
+            command += ['--path', path]
+        result = subprocess.run(
+            command, env=env, capture_output=True, text=True,
+        )
+        if result.returncode:
+            raise CommandError(result.stderr.strip())
+        self.stdout.write(result.stdout.strip())
+
+    def default_paths(self):
+        category = Category.objects.order_by('pk').first()
+        product = Product.objects.order_by('pk').first()
+        if category is None or product is None:
+            raise CommandError('The catalog is empty, run seed_shop first.')
+        return [
+            '/',
+            category.get_absolute_url(),
+            product.get_absolute_url(),
+            '/search/?' + urlencode({'q': product.title.split()[0]}),
+        ]
@@ -0,0 +1,131 @@
+import os
+import random
+import sqlite3
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.test import override_settings
+
+
+# profile: (pragmas, keep the connection open between requests)
+PROFILES = {
+    'default': ({}, False),
+    'production': (settings.SQLITE_PRODUCTION_PRAGMAS, True),
+}
+
+
+def create_database(path, rows):
+    with sqlite3.connect(path) as db:
+        db.execute(
+            'CREATE TABLE bench ('
+            'id INTEGER PRIMARY KEY, value INTEGER, payload TEXT)'
+        )
+        db.executemany(
+            'INSERT INTO bench (value, payload) VALUES (?, ?)',
+            ((i, 'x' * 200) for i in range(rows)),
+        )
+
+
+def init_worker(pragmas):
+    django.setup()
+    # Each worker is its own process, so the override stays local.
+    override_settings(SQLITE_PRAGMAS=pragmas).enable()
+
+
+def run_worker(path, persistent, seconds, rows, write_ratio, seed):
+    """
+    Plays requests against `path` for `seconds`: a point read and a
+    range read, or, with probability `write_ratio`, an UPDATE. Returns
+    (reads, writes, failed).
+    """
+    rng = random.Random(seed)
+    database = DatabaseWrapper(
+        {**connection.settings_dict, 'NAME': path},
+        alias='benchmark',
+    )
+    reads = writes = failed = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pk = rng.randint(1, rows)
+        write = rng.random() < write_ratio
+        try:
+            with database.cursor() as cursor:
+                if write:
+                    cursor.execute(
+                        'UPDATE bench SET value = value + 1 WHERE id = %s',
+                        [pk],
+                    )
+                else:
+                    cursor.execute(
+                        'SELECT value, payload FROM bench WHERE id = %s',
+                        [pk],
+                    )
+                    cursor.fetchall()
+                    cursor.execute(
+                        'SELECT count(*), sum(value) FROM bench '
+                        'WHERE id BETWEEN %s AND %s',
+                        [pk, pk + 100],
+                    )
+                    cursor.fetchall()
+        except OperationalError:
+            failed += 1
+        else:
+            if write:
+                writes += 1
+            else:
+                reads += 1
+        if not persistent:
+            database.close()
+    database.close()
+    return reads, writes, failed
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures SQLite read and write throughput with parallel worker '
+        'processes, with the default settings and with the production '
+        'profile (WAL, pragmas, persistent connections). Runs on a '
+        'scratch database, not the configured one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=8)
+        parser.add_argument('--seconds', type=float, default=5)
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--write-ratio', type=float, default=0.1)
+        parser.add_argument('--profile', action='append',
+                            choices=sorted(PROFILES), dest='profiles',
+                            help='Defaults to all profiles.')
+
+    def handle(self, *args, **options):
+        for profile in options['profiles'] or PROFILES:
+            pragmas, persistent = PROFILES[profile]
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'benchmark.sqlite3')
+                create_database(path, options['rows'])
+                with ProcessPoolExecutor(
+                    max_workers=options['workers'],
+                    initializer=init_worker,
+                    initargs=(pragmas,),
+                ) as executor:
+                    results = list(executor.map(
+                        run_worker,
+                        *zip(*(
+                            (path, persistent, options['seconds'],
+                             options['rows'], options['write_ratio'], seed)
+                            for seed in range(options['workers'])
+                        )),
+                    ))
+            reads, writes, failed = map(sum, zip(*results))
+            seconds = options['seconds']
+            self.stdout.write(
+                f'{profile}: {reads / seconds:.0f} reads/s, '
+                f'{writes / seconds:.0f} writes/s, '
+                f'{failed} failed with {options["workers"]} workers'
+            )
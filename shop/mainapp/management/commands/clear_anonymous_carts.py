@@ -0,0 +1,39 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from mainapp.models import Cart
+
+
+class Command(BaseCommand):
+    help = (
+        'Removes guest carts that were not changed for '
+        'ANONYMOUS_CART_AGE seconds. Run it periodically, '
+        'like clearsessions.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        expired = timezone.now() - datetime.timedelta(
+            seconds=settings.ANONYMOUS_CART_AGE
+        )
+        carts = Cart.objects.filter(
+            for_anonymous_user=True,
+            in_order=False,
+            updated_at__lt=expired,
+        )
+        removed = 0
+        while True:
+            pks = list(
+                carts.values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not pks:
+                break
+            Cart.objects.filter(pk__in=pks).delete()
+            removed += len(pks)
+        if options['verbosity']:
+            self.stdout.write(f'Removed {removed} guest carts')
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from mainapp.exports import EXPORT_FORMATS, export_orders, filter_orders
+from mainapp.form import OrderExportForm
+from mainapp.models import Order
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams orders with their lines and customer to CSV or JSONL. '
+        'Memory use does not depend on the number of orders.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=EXPORT_FORMATS,
+                            default='csv')
+        parser.add_argument('--from', dest='date_from',
+                            help='First creation date, YYYY-MM-DD.')
+        parser.add_argument('--to', dest='date_to',
+                            help='Last creation date, YYYY-MM-DD.')
+        parser.add_argument('--status', action='append',
+                            choices=[code for code, _ in Order.STATUS_CHOICES],
+                            help='May be given several times.')
+        parser.add_argument('--output', default='-',
+                            help='File to write, "-" for stdout.')
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        form = OrderExportForm({
+            'date_from': options['date_from'],
+            'date_to': options['date_to'],
+            'status': options['status'] or [],
+            'format': options['format'],
+        })
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        orders = filter_orders(
+            form.cleaned_data['date_from'],
+            form.cleaned_data['date_to'],
+            form.cleaned_data['status'],
+        )
+        chunks = export_orders(
+            orders,
+            form.cleaned_data['format'],
+            options['chunk_size'],
+        )
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+            return
+        with open(options['output'], 'w', encoding='utf-8',
+                  newline='') as output:
+            for chunk in chunks:
+                output.write(chunk)
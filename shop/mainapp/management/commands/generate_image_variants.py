@@ -0,0 +1,51 @@
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+
+from mainapp.images import cache_image_variants, generate_image_variants
+from mainapp.models import OrderProduct, Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Generates the resized and WebP variants of every product and '
+        'order line image in a pool of worker processes.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                            help='Worker processes, defaults to CPU count.')
+        parser.add_argument('--force', action='store_true',
+                            help='Regenerate images that have variants.')
+
+    def handle(self, *args, **options):
+        names = set(Product.objects.values_list('image', flat=True))
+        names.update(OrderProduct.objects.values_list('image', flat=True))
+        names = sorted(name for name in names if name)
+        started = time.perf_counter()
+        failed = 0
+        # Image decoding is CPU bound, so threads would share one core.
+        with ProcessPoolExecutor(
+            max_workers=max(1, options['workers']),
+            initializer=django.setup,
+        ) as executor:
+            results = executor.map(
+                generate_image_variants,
+                names,
+                itertools.repeat(options['force']),
+                chunksize=8,
+            )
+            for name, manifest in zip(names, results):
+                if manifest is None:
+                    failed += 1
+                    self.stderr.write(f'Cannot read image "{name}"')
+                cache_image_variants(name, manifest)
+        if options['verbosity']:
+            self.stdout.write(
+                f'Processed {len(names)} images, {failed} failed, '
+                f'in {time.perf_counter() - started:.1f}s'
+            )
@@ -0,0 +1,382 @@
+import collections
+import csv
+import json
+import os
+import sys
+import time
+from decimal import Decimal, InvalidOperation
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.core.validators import validate_unicode_slug
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+from django.utils.text import slugify
+
+from mainapp.autocomplete import invalidate_autocomplete
+from mainapp.models import Category, Product
+from mainapp.utils import (
+    chunked,
+    invalidate_category_navigation,
+    invalidate_product_detail,
+    update_many,
+)
+from specs.facets import invalidate_facet_index
+from specs.models import CategoryFeature, ProductFeatures
+from specs.utils import invalidate_product_spec, refresh_feature_documents
+from specs.validation import validate_product_features
+
+
+FEATURE_PREFIX = 'feature:'
+PRODUCT_FIELDS = ('title', 'description', 'image', 'price')
+MAX_PRICE = Decimal('9999999.99')
+SLUG_MAX_LENGTH = Product._meta.get_field('slug').max_length
+
+
+class RowError(Exception):
+    pass
+
+
+def read_csv(stream):
+    """
+    Feature values come from "feature:<feature_filter_name>" columns;
+    empty cells are treated as missing.
+    """
+    for row in csv.DictReader(stream):
+        record = {'features': {}}
+        for key, value in row.items():
+            if not isinstance(key, str) or not isinstance(value, str):
+                continue
+            value = value.strip()
+            if not value:
+                continue
+            if key.startswith(FEATURE_PREFIX):
+                record['features'][key[len(FEATURE_PREFIX):]] = value
+            else:
+                record[key] = value
+        yield record
+
+
+def read_jsonl(stream):
+    """
+    One object per line, features as {"feature_filter_name": value}.
+    """
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as error:
+            yield RowError(f'invalid JSON: {error}')
+            continue
+        if not isinstance(record, dict):
+            yield RowError('expected a JSON object')
+            continue
+        yield record
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+}
+
+
+def clean_record(record):
+    slug = str(record.get('slug') or '').strip()
+    if not slug:
+        raise RowError('slug is required')
+    try:
+        validate_unicode_slug(slug)
+    except ValidationError:
+        raise RowError(f'invalid slug "{slug}"')
+    if len(slug) > SLUG_MAX_LENGTH:
+        raise RowError(
+            f'slug is longer than {SLUG_MAX_LENGTH} characters'
+        )
+    fields = {}
+    for field in PRODUCT_FIELDS:
+        value = record.get(field)
+        if value is not None and str(value).strip():
+            fields[field] = str(value).strip()
+    if len(fields.get('title', '')) > 255:
+        raise RowError('title is longer than 255 characters')
+    if 'price' in fields:
+        try:
+            price = Decimal(fields['price']).quantize(Decimal('0.01'))
+        except InvalidOperation:
+            raise RowError(f'invalid price "{fields["price"]}"')
+        if not price.is_finite():
+            raise RowError(f'invalid price "{fields["price"]}"')
+        if not 0 <= price <= MAX_PRICE:
+            raise RowError(f'price {price} is out of range')
+        fields['price'] = price
+    features = record.get('features') or {}
+    if not isinstance(features, dict):
+        raise RowError('features must be an object')
+    return {
+        'slug': slug,
+        'category': str(record.get('category') or '').strip(),
+        'category_slug': str(record.get('category_slug') or '').strip(),
+        'fields': fields,
+        'features': {
+            str(name): str(value) for name, value in features.items()
+            if value is not None and str(value).strip()
+        },
+    }
+
+
+class Command(BaseCommand):
+    help = (
+        'Streams products from a CSV or JSONL file and upserts them by '
+        'slug together with their feature values. Missing categories '
+        'are created; invalid rows are reported and skipped.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file, "-" for stdin.')
+        parser.add_argument('--format', choices=sorted(READERS),
+                            help='Defaults to the file extension.')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Rows per transaction.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format']
+        if file_format is None:
+            file_format = os.path.splitext(path)[1].lstrip('.').lower()
+            if file_format not in READERS:
+                raise CommandError('Cannot detect the format, use --format.')
+        self.verbosity = options['verbosity']
+        self.counts = collections.Counter()
+        self.categories = {}
+        self.features = {}
+        self.touched_categories = set()
+        started = time.perf_counter()
+        if path == '-':
+            stream = sys.stdin
+        else:
+            try:
+                stream = open(path, encoding='utf-8-sig', newline='')
+            except OSError as error:
+                raise CommandError(error)
+        try:
+            rows = enumerate(READERS[file_format](stream), 1)
+            for chunk in chunked(rows, options['batch_size']):
+                self.import_chunk(chunk)
+                if self.verbosity > 1:
+                    self.report(started)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+        # Bulk writes send no signals, so drop the caches they maintain.
+        invalidate_category_navigation()
+        invalidate_autocomplete()
+        for category_id in self.touched_categories:
+            invalidate_facet_index(category_id)
+        if self.verbosity:
+            self.report(started)
+
+    def report(self, started):
+        elapsed = time.perf_counter() - started
+        rows = sum(self.counts.values())
+        self.stdout.write(
+            f'{rows} rows: {self.counts["created"]} created, '
+            f'{self.counts["updated"]} updated, '
+            f'{self.counts["failed"]} failed '
+            f'({rows / elapsed if elapsed else 0:.0f} rows/s)'
+        )
+
+    def fail(self, number, message):
+        self.counts['failed'] += 1
+        self.stderr.write(f'Row {number}: {message}')
+
+    def import_chunk(self, chunk):
+        records = {}
+        for number, record in chunk:
+            try:
+                if isinstance(record, RowError):
+                    raise record
+                cleaned = clean_record(record)
+                cleaned['category_id'] = self.get_category(cleaned)
+            except RowError as error:
+                self.fail(number, error)
+                continue
+            if cleaned['slug'] in records:
+                self.fail(records[cleaned['slug']][0], 'superseded by row '
+                          f'{number} with the same slug')
+            records[cleaned['slug']] = (number, cleaned)
+        if not records:
+            return
+        try:
+            with transaction.atomic():
+                written = self.write(records)
+        except DatabaseError as error:
+            for number, _ in records.values():
+                self.fail(number, f'database error: {error}')
+            return
+        for product in written:
+            invalidate_product_spec(product.pk)
+            invalidate_product_detail(product.pk)
+
+    def get_category(self, record):
+        key = record['category_slug'] or record['category']
+        if not key:
+            return None
+        if key not in self.categories:
+            if record['category_slug']:
+                lookup = {'slug': record['category_slug']}
+            else:
+                lookup = {'name': record['category']}
+            category = Category.objects.filter(**lookup).first()
+            if category is None:
+                category = self.create_category(record)
+            self.categories[key] = category.pk
+        return self.categories[key]
+
+    def create_category(self, record):
+        name = record['category'] or record['category_slug']
+        slug = record['category_slug'] or slugify(name, allow_unicode=True)
+        if not slug:
+            raise RowError(f'cannot build a slug for category "{name}"')
+        if len(slug) > SLUG_MAX_LENGTH:
+            raise RowError(
+                f'category slug is longer than {SLUG_MAX_LENGTH} characters'
+            )
+        if Category.objects.filter(slug=slug).exists():
+            raise RowError(f'category slug "{slug}" is taken')
+        return Category.objects.create(name=name, slug=slug)
+
+    def get_features(self, category_id):
+        if category_id not in self.features:
+            self.features[category_id] = {
+                feature.feature_filter_name: feature
+                for feature in CategoryFeature.objects.filter(
+                    category_id=category_id,
+                )
+            }
+        return self.features[category_id]
+
+    def write(self, records):
+        """
+        Upserts one chunk of cleaned records and returns the written
+        products. Rows rejected here are reported and dropped from
+        `records`.
+        """
+        existing = {
+            product.slug: product
+            for product in Product.objects.filter(
+                slug__in=records,
+            ).defer('features')
+        }
+        products = {}
+        feature_rows = []
+        for slug, (number, record) in list(records.items()):
+            product = existing.get(slug)
+            try:
+                product = self.build_product(product, record)
+                rows = self.build_feature_rows(product, record)
+            except RowError as error:
+                self.fail(number, error)
+                del records[slug]
+                continue
+            products[slug] = product
+            feature_rows.extend((slug, row) for row in rows)
+        errors = validate_product_features(row for _, row in feature_rows)
+        rejected = collections.defaultdict(list)
+        for position, message in errors.items():
+            rejected[feature_rows[position][0]].append(message)
+        for slug, messages in rejected.items():
+            self.fail(records.pop(slug)[0], '; '.join(messages))
+            del products[slug]
+        feature_rows = [
+            (slug, row) for slug, row in feature_rows if slug in products
+        ]
+        created = [
+            product for product in products.values() if product.pk is None
+        ]
+        updated = [
+            product for product in products.values()
+            if product.pk is not None
+        ]
+        Product.objects.bulk_create(created)
+        # SQLite does not return primary keys from bulk_create.
+        pks = dict(Product.objects.filter(
+            slug__in=[product.slug for product in created],
+        ).values_list('slug', 'pk'))
+        for product in created:
+            product.pk = pks[product.slug]
+        now = timezone.now()
+        for product in updated:
+            product.updated_at = now
+        update_many(
+            Product,
+            updated,
+            ['category', *PRODUCT_FIELDS, 'updated_at'],
+        )
+        self.write_features(
+            [(products[slug].pk, row) for slug, row in feature_rows]
+        )
+        refresh_feature_documents(
+            [product.pk for product in products.values()]
+        )
+        self.counts['created'] += len(created)
+        self.counts['updated'] += len(updated)
+        return list(products.values())
+
+    def build_product(self, product, record):
+        if product is None:
+            if record['category_id'] is None:
+                raise RowError('category is required for new products')
+            for field in ('title', 'image'):
+                if field not in record['fields']:
+                    raise RowError(f'{field} is required for new products')
+            product = Product(slug=record['slug'])
+        else:
+            self.touched_categories.add(product.category_id)
+        if record['category_id'] is not None:
+            product.category_id = record['category_id']
+        for field, value in record['fields'].items():
+            setattr(product, field, value)
+        self.touched_categories.add(product.category_id)
+        return product
+
+    def build_feature_rows(self, product, record):
+        features = self.get_features(product.category_id)
+        unknown = sorted(set(record['features']) - set(features))
+        if unknown:
+            raise RowError(f'unknown features: {", ".join(unknown)}')
+        return [
+            ProductFeatures(
+                product=product,
+                feature=features[name],
+                value=value,
+            )
+            for name, value in record['features'].items()
+        ]
+
+    def write_features(self, rows):
+        """
+        Updates the values of features a product already has and adds
+        the others; features missing from the input are kept.
+        """
+        current = collections.defaultdict(list)
+        for pk, product_id, feature_id in ProductFeatures.objects.filter(
+            product_id__in={product_id for product_id, _ in rows},
+        ).values_list('pk', 'product_id', 'feature_id'):
+            current[product_id, feature_id].append(pk)
+        created = []
+        updated = []
+        for product_id, row in rows:
+            pks = current.get((product_id, row.feature_id))
+            if pks:
+                updated.extend(
+                    ProductFeatures(pk=pk, value=row.value) for pk in pks
+                )
+            else:
+                created.append(ProductFeatures(
+                    product_id=product_id,
+                    feature_id=row.feature_id,
+                    value=row.value,
+                ))
+        ProductFeatures.objects.bulk_create(created)
+        update_many(ProductFeatures, updated, ['value'])
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Sum
+
+from mainapp.models import Cart
+
+
+class Command(BaseCommand):
+    help = (
+        'Compares the stored total_products and final_price of carts '
+        'with their lines and optionally repairs them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Overwrite wrong totals.')
+        parser.add_argument('--all', action='store_true',
+                            help='Check ordered carts as well.')
+
+    def handle(self, *args, **options):
+        carts = Cart.objects.annotate(
+            lines=Count('products'),
+            lines_price=Sum('products__final_price'),
+        ).only('total_products', 'final_price').order_by('pk')
+        if not options['all']:
+            carts = carts.filter(in_order=False)
+        broken = 0
+        for cart in carts.iterator():
+            lines_price = (cart.lines_price or 0)
+            if (cart.total_products == cart.lines
+                    and cart.final_price == lines_price):
+                continue
+            broken += 1
+            self.stdout.write(
+                f'Cart {cart.pk}: stored {cart.total_products} / '
+                f'{cart.final_price}, actual {cart.lines} / {lines_price}'
+            )
+            if options['fix']:
+                Cart.objects.filter(pk=cart.pk).update(
+                    total_products=cart.lines,
+                    final_price=lines_price,
+                )
+        if broken and not options['fix']:
+            raise CommandError(f'{broken} carts have wrong totals')
+        if options['verbosity']:
+            self.stdout.write(f'Checked carts, {broken} with wrong totals')
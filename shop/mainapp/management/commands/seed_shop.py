@@ -0,0 +1,336 @@
+import collections
+import datetime
+import itertools
+import random
+import time
+from array import array
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+
+from mainapp.autocomplete import invalidate_autocomplete
+from mainapp.models import (
+    Cart,
+    CartProduct,
+    Category,
+    Customer,
+    Order,
+    OrderProduct,
+    Product,
+)
+from mainapp.search import rebuild_search_index
+from mainapp.utils import chunked, invalidate_category_navigation
+from specs.facets import invalidate_facet_index
+from specs.models import CategoryFeature, FeatureValidator, ProductFeatures
+
+
+ORDER_STATUS_WEIGHTS = (
+    (Order.STATUS_NEW, 10),
+    (Order.STATUS_IN_PROGRESS, 15),
+    (Order.STATUS_READY, 10),
+    (Order.STATUS_COMPLETED, 65),
+)
+BUYING_TYPE_WEIGHTS = (
+    (Order.BUYING_TYPE_SELF, 60),
+    (Order.BUYING_TYPE_DELIVERY, 40),
+)
+OPEN_CART_SHARE = 0.3
+MAX_PRICE = 9999999
+
+
+def next_pk(model):
+    return (model.objects.aggregate(models.Max('pk'))['pk__max'] or 0) + 1
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills the database with a deterministic synthetic catalog, '
+        'customers, carts and orders for load and benchmark work.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--features', type=int, default=5,
+                            help='Features per category.')
+        parser.add_argument('--values', type=int, default=8,
+                            help='Allowed values per feature.')
+        parser.add_argument('--customers', type=int, default=1000)
+        parser.add_argument('--orders', type=int, default=5000)
+        parser.add_argument('--password', default='seed-password',
+                            help='Password of every generated user.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.verbosity = options['verbosity']
+        self.counts = collections.Counter()
+        started = time.perf_counter()
+        self.seed_categories(
+            options['categories'],
+            options['features'],
+            options['values'],
+        )
+        self.seed_products(options['products'])
+        self.seed_customers(options['customers'], options['password'])
+        self.seed_carts_and_orders(options['orders'])
+        self.reset_sequences()
+        rebuild_search_index()
+        # bulk_create sends no signals, so drop the caches they maintain.
+        invalidate_category_navigation()
+        invalidate_autocomplete()
+        for category_pk in self.category_pks:
+            invalidate_facet_index(category_pk)
+        for label, count in self.counts.items():
+            self.log(f'{label}: {count}')
+        self.log(f'Done in {time.perf_counter() - started:.1f}s')
+
+    def log(self, message):
+        if self.verbosity:
+            self.stdout.write(message)
+
+    def write(self, model, objects):
+        for batch in chunked(objects, self.batch_size):
+            with transaction.atomic():
+                model.objects.bulk_create(batch, batch_size=self.batch_size)
+            self.counts[model._meta.label] += len(batch)
+
+    def seed_categories(self, count, features, values):
+        first_pk = next_pk(Category)
+        self.category_pks = list(range(first_pk, first_pk + count))
+        self.write(Category, (
+            Category(pk=pk, name=f'Категория {pk}', slug=f'category-{pk}')
+            for pk in self.category_pks
+        ))
+        # Category sizes follow a Zipf-like distribution.
+        weights = [1 / (rank + 1) ** 0.8 for rank in range(count)]
+        self.rng.shuffle(weights)
+        self.category_weights = list(itertools.accumulate(weights))
+
+        first_pk = next_pk(CategoryFeature)
+        self.category_features = {}
+        feature_rows = []
+        for category_pk in self.category_pks:
+            for i in range(features):
+                pk = first_pk + len(feature_rows)
+                feature_rows.append(CategoryFeature(
+                    pk=pk,
+                    category_id=category_pk,
+                    feature_name=f'Характеристика {i + 1}',
+                    feature_filter_name=f'feature_{i + 1}',
+                    unit=self.rng.choice((None, 'шт', 'ГБ', 'мм', 'мАч')),
+                ))
+                self.category_features.setdefault(category_pk, []).append(
+                    feature_rows[-1]
+                )
+        self.write(CategoryFeature, feature_rows)
+        self.feature_values = [f'Значение {i + 1}' for i in range(values)]
+        self.write(FeatureValidator, (
+            FeatureValidator(
+                category_id=feature.category_id,
+                feature_key_id=feature.pk,
+                valid_feature_value=value,
+            )
+            for feature in feature_rows
+            for value in self.feature_values
+        ))
+
+    def seed_products(self, count):
+        first_pk = next_pk(Product)
+        self.product_first_pk = first_pk
+        self.product_prices = array('q')
+        pks = range(first_pk, first_pk + count)
+        for chunk in chunked(pks, self.batch_size):
+            products = []
+            features = []
+            for pk in chunk:
+                category_pk = self.rng.choices(
+                    self.category_pks,
+                    cum_weights=self.category_weights,
+                )[0]
+                price = min(int(self.rng.lognormvariate(8, 1)) + 99, MAX_PRICE)
+                self.product_prices.append(price)
+                document = []
+                for feature in self.category_features[category_pk]:
+                    value = self.rng.choice(self.feature_values)
+                    document.append({
+                        'name': feature.feature_name,
+                        'value': value,
+                        'unit': feature.unit,
+                    })
+                    features.append(ProductFeatures(
+                        product_id=pk,
+                        feature_id=feature.pk,
+                        value=value,
+                    ))
+                products.append(Product(
+                    pk=pk,
+                    category_id=category_pk,
+                    title=f'Товар {pk}',
+                    slug=f'product-{pk}',
+                    image='macbook_pro.jpg',
+                    description=f'Описание товара {pk}',
+                    price=Decimal(price),
+                    features=document,
+                ))
+            with transaction.atomic():
+                self.write(Product, products)
+                self.write(ProductFeatures, features)
+
+    def seed_customers(self, count, password):
+        # Hashing once keeps user creation cheap.
+        password = make_password(password)
+        first_user_pk = next_pk(User)
+        first_customer_pk = next_pk(Customer)
+        self.customer_pks = list(
+            range(first_customer_pk, first_customer_pk + count)
+        )
+        self.write(User, (
+            User(
+                pk=first_user_pk + i,
+                username=f'seed-{first_user_pk + i}',
+                first_name=f'Имя {i}',
+                last_name=f'Фамилия {i}',
+                password=password,
+            )
+            for i in range(count)
+        ))
+        self.write(Customer, (
+            Customer(
+                pk=pk,
+                user_id=first_user_pk + i,
+                phone=f'8999{self.rng.randrange(10 ** 7):07d}',
+                address=f'Адрес {i}',
+            )
+            for i, pk in enumerate(self.customer_pks)
+        ))
+
+    def random_product(self):
+        # Popular products are picked much more often than the long tail.
+        offset = int(len(self.product_prices) * self.rng.random() ** 3)
+        return self.product_first_pk + offset
+
+    def seed_carts_and_orders(self, order_count):
+        if not self.customer_pks or not self.product_prices:
+            return
+        cart_pk = next_pk(Cart)
+        cart_product_pk = next_pk(CartProduct)
+        order_pk = next_pk(Order)
+        cart_count = 0
+        order_customers = self.rng.choices(
+            self.customer_pks,
+            weights=[1 / (rank + 1) for rank in range(len(self.customer_pks))],
+            k=order_count,
+        )
+        open_carts = self.rng.sample(
+            self.customer_pks,
+            int(len(self.customer_pks) * OPEN_CART_SHARE),
+        )
+        statuses, status_weights = zip(*ORDER_STATUS_WEIGHTS)
+        buying_types, buying_type_weights = zip(*BUYING_TYPE_WEIGHTS)
+        today = datetime.date.today()
+
+        owners = itertools.chain(order_customers, open_carts)
+        for chunk in chunked(owners, self.batch_size):
+            carts = []
+            cart_products = []
+            cart_links = []
+            orders = []
+            order_products = []
+            order_links = []
+            for customer_pk in chunk:
+                in_order = cart_count < order_count
+                lines = min(int(self.rng.expovariate(0.5)) + 1, 10)
+                product_pks = {self.random_product() for _ in range(lines)}
+                total = 0
+                for product_pk in product_pks:
+                    qty = self.rng.choices((1, 2, 3), weights=(80, 15, 5))[0]
+                    offset = product_pk - self.product_first_pk
+                    price = self.product_prices[offset]
+                    total += qty * price
+                    cart_products.append(CartProduct(
+                        pk=cart_product_pk,
+                        user_id=customer_pk,
+                        cart_id=cart_pk,
+                        product_id=product_pk,
+                        qty=qty,
+                        final_price=Decimal(qty * price),
+                    ))
+                    cart_links.append(Cart.products.through(
+                        cart_id=cart_pk,
+                        cartproduct_id=cart_product_pk,
+                    ))
+                    cart_product_pk += 1
+                    if in_order:
+                        order_products.append(OrderProduct(
+                            order_id=order_pk,
+                            product_id=product_pk,
+                            title=f'Товар {product_pk}',
+                            image='macbook_pro.jpg',
+                            price=Decimal(price),
+                            qty=qty,
+                            final_price=Decimal(qty * price),
+                        ))
+                carts.append(Cart(
+                    pk=cart_pk,
+                    owner_id=customer_pk,
+                    total_products=len(product_pks),
+                    final_price=Decimal(total),
+                    in_order=in_order,
+                ))
+                if in_order:
+                    orders.append(Order(
+                        pk=order_pk,
+                        customer_id=customer_pk,
+                        first_name='Имя',
+                        last_name='Фамилия',
+                        phone='89990000000',
+                        cart_id=cart_pk,
+                        address='Адрес',
+                        status=self.rng.choices(statuses, status_weights)[0],
+                        buying_type=self.rng.choices(
+                            buying_types,
+                            buying_type_weights,
+                        )[0],
+                        order_data=today + datetime.timedelta(
+                            days=self.rng.randrange(-365, 14)
+                        ),
+                        total_products=len(product_pks),
+                        final_price=Decimal(total),
+                    ))
+                    order_links.append(Customer.orders.through(
+                        customer_id=customer_pk,
+                        order_id=order_pk,
+                    ))
+                    order_pk += 1
+                cart_pk += 1
+                cart_count += 1
+            with transaction.atomic():
+                self.write(Cart, carts)
+                self.write(CartProduct, cart_products)
+                self.write(Cart.products.through, cart_links)
+                self.write(Order, orders)
+                self.write(OrderProduct, order_products)
+                self.write(Customer.orders.through, order_links)
+
+    def reset_sequences(self):
+        sql = connection.ops.sequence_reset_sql(no_style(), [
+            User,
+            Category,
+            CategoryFeature,
+            Product,
+            Customer,
+            Cart,
+            CartProduct,
+            Order,
+            OrderProduct,
+        ])
+        with connection.cursor() as cursor:
+            for statement in sql:
+                cursor.execute(statement)
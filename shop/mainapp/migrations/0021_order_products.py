@@ -0,0 +1,66 @@
+# Generated by Django 3.2.25 on 2026-10-18 07:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def snapshot_orders(apps, schema_editor):
+    Order = apps.get_model('mainapp', 'Order')
+    OrderProduct = apps.get_model('mainapp', 'OrderProduct')
+    CartProduct = apps.get_model('mainapp', 'CartProduct')
+    orders = Order.objects.exclude(cart=None).only('pk', 'cart_id')
+    for order in orders.iterator():
+        lines = CartProduct.objects.filter(
+            cart_id=order.cart_id,
+        ).select_related('product')
+        order_products = [
+            OrderProduct(
+                order_id=order.pk,
+                product_id=line.product_id,
+                title=line.product.title,
+                image=line.product.image.name,
+                price=line.product.price,
+                qty=line.qty,
+                final_price=line.final_price,
+            )
+            for line in lines
+        ]
+        OrderProduct.objects.bulk_create(order_products)
+        Order.objects.filter(pk=order.pk).update(
+            total_products=len(order_products),
+            final_price=sum(line.final_price for line in order_products),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0020_anonymous_carts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='final_price',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=9, verbose_name='Общая цена'),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='total_products',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='OrderProduct',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('title', models.CharField(max_length=255, verbose_name='Наименование')),
+                ('image', models.ImageField(blank=True, upload_to='', verbose_name='Изображение')),
+                ('price', models.DecimalField(decimal_places=2, default=0, max_digits=9, verbose_name='Цена')),
+                ('qty', models.PositiveIntegerField(default=1)),
+                ('final_price', models.DecimalField(decimal_places=2, default=0, max_digits=9, verbose_name='Общая цена')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_products', to='mainapp.order', verbose_name='Заказ')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='mainapp.product', verbose_name='Товар')),
+            ],
+        ),
+        migrations.RunPython(snapshot_orders, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 3.2.25 on 2026-10-18 09:00
+
+import itertools
+
+from django.db import migrations, models
+
+
+def build_feature_documents(apps, schema_editor):
+    Product = apps.get_model('mainapp', 'Product')
+    ProductFeatures = apps.get_model('specs', 'ProductFeatures')
+    rows = ProductFeatures.objects.order_by(
+        'product_id', 'feature_id', 'pk',
+    ).values_list(
+        'product_id', 'feature__feature_name', 'value', 'feature__unit',
+    )
+    products = []
+    for product_id, features in itertools.groupby(
+        rows.iterator(), key=lambda row: row[0],
+    ):
+        products.append(Product(pk=product_id, features=[
+            {'name': name, 'value': value, 'unit': unit}
+            for _, name, value, unit in features
+        ]))
+        if len(products) == 1000:
+            Product.objects.bulk_update(products, ['features'])
+            products = []
+    Product.objects.bulk_update(products, ['features'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0022_product_price_idx'),
+        ('specs', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='features',
+            field=models.JSONField(blank=True, default=list, editable=False, verbose_name='Характеристики'),
+        ),
+        migrations.RunPython(build_feature_documents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 3.2.25 on 2026-10-18 10:00
+
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute(
+        'CREATE VIRTUAL TABLE mainapp_product_search USING fts5('
+        "title, description, features, tokenize='unicode61 remove_diacritics 2')"
+    )
+    schema_editor.execute(
+        'INSERT INTO mainapp_product_search '
+        '(rowid, title, description, features) '
+        "SELECT p.id, p.title, coalesce(p.description, ''), coalesce(("
+        "SELECT group_concat(json_extract(f.value, '$.value'), ' ') "
+        "FROM json_each(p.features) AS f), '') "
+        'FROM mainapp_product AS p'
+    )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    schema_editor.execute('DROP TABLE IF EXISTS mainapp_product_search')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0023_product_features'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
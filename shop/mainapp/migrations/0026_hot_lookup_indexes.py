@@ -0,0 +1,67 @@
+# Generated by Django 3.2.25 on 2026-10-18 12:00
+
+from django.db import migrations, models
+
+
+def merge_duplicate_cart_lines(apps, schema_editor):
+    """
+    Folds repeated (cart, product) lines into the oldest one before the
+    unique constraint is added, then recounts the affected carts.
+    """
+    Cart = apps.get_model('mainapp', 'Cart')
+    CartProduct = apps.get_model('mainapp', 'CartProduct')
+    duplicates = CartProduct.objects.values('cart_id', 'product_id').annotate(
+        lines=models.Count('id'),
+    ).filter(lines__gt=1)
+    cart_ids = set()
+    for duplicate in duplicates:
+        lines = list(CartProduct.objects.filter(
+            cart_id=duplicate['cart_id'],
+            product_id=duplicate['product_id'],
+        ).select_related('product').order_by('pk'))
+        kept = lines[0]
+        kept.qty = sum(line.qty for line in lines)
+        kept.final_price = kept.qty * kept.product.price
+        kept.save(update_fields=['qty', 'final_price'])
+        CartProduct.objects.filter(
+            pk__in=[line.pk for line in lines[1:]],
+        ).delete()
+        cart_ids.add(duplicate['cart_id'])
+    for cart in Cart.objects.filter(pk__in=cart_ids):
+        totals = CartProduct.objects.filter(cart=cart).aggregate(
+            models.Sum('final_price'),
+            models.Count('id'),
+        )
+        cart.total_products = totals['id__count']
+        cart.final_price = totals['final_price__sum'] or 0
+        cart.save(update_fields=['total_products', 'final_price'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mainapp', '0025_catalog_updated_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_cart_lines,
+            migrations.RunPython.noop,
+        ),
+        migrations.AddConstraint(
+            model_name='cartproduct',
+            constraint=models.UniqueConstraint(fields=('cart', 'product'), name='cartproduct_cart_product_uniq'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(in_order=False), fields=['owner'], name='cart_owner_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='cart',
+            index=models.Index(condition=models.Q(('for_anonymous_user', True), ('in_order', False)), fields=['updated_at'], name='cart_guest_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer', 'created_at', 'id'], name='order_customer_created_idx'),
+        ),
+    ]
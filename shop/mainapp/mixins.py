@@ -1,24 +1,101 @@
+import hashlib
+
+from django.utils.functional import SimpleLazyObject
+from django.views.decorators.http import condition
 from django.views.generic import View
 
 from .models import Cart, Customer
+from .utils import (
+    get_category_navigation,
+    get_or_create_customer,
+    get_pinned_cart,
+    pin_cart,
+)
 
 
 class CartMixin(View):
 
     def dispatch(self, request, *args, **kwargs):
-        if request.user.is_authenticated:
-            customer = Customer.objects.filter(user=request.user).first()
-            if not customer:
-                customer = Customer.objects.create(
-                    user=request.user
-                )
-            cart = Cart.objects.filter(owner=customer, in_order=False).first()
-            if not cart:
-                cart = Cart.objects.create(owner=customer)
-        else:
-            cart = Cart.objects.filter(for_anonymous_user=True).first()
-            if not cart:
-                cart = Cart.objects.create(for_anonymous_user=True)
-        self.cart = cart
+        self.customer = SimpleLazyObject(self.get_customer)
+        self.cart = SimpleLazyObject(self.get_cart)
         return super().dispatch(request, *args, **kwargs)
 
+    def get_customer(self):
+        user = self.request.user
+        if not user.is_authenticated:
+            return None
+        pinned = get_pinned_cart(self.request.session, user)
+        if pinned.get('customer'):
+            customer = Customer.objects.filter(pk=pinned['customer']).first()
+            if customer:
+                return customer
+        return get_or_create_customer(user)
+
+    def get_cart(self):
+        request = self.request
+        pinned = get_pinned_cart(request.session, request.user)
+        if pinned.get('cart'):
+            cart = Cart.objects.filter(pk=pinned['cart'], in_order=False).first()
+            if cart:
+                return cart
+        if not request.user.is_authenticated:
+            # Guests get a cart of their own on the first add to cart.
+            return None
+        owner_id = pinned.get('customer') or self.customer.pk
+        cart = Cart.objects.filter(owner_id=owner_id, in_order=False).first()
+        if not cart:
+            cart = Cart.objects.create(owner=self.customer)
+        pin_cart(request.session, request.user, cart)
+        return cart
+
+    def get_or_create_cart(self):
+        if not self.cart:
+            self.cart = Cart.objects.create(for_anonymous_user=True)
+            pin_cart(self.request.session, self.request.user, self.cart)
+        return self.cart
+
+
+class ConditionalGetMixin:
+    """
+    Answers GET with 304 Not Modified when the page would not change,
+    without rendering it. Views return the state their content depends
+    on from get_etag_parts(); the visitor's cart, the navigation and the
+    query string are added here. Use together with CartMixin and
+    SingleObjectMixin.
+
+    Only an ETag is sent: the pages also depend on navigation counts and
+    image variants, which no timestamp describes, so a Last-Modified
+    date could validate a stale page.
+    """
+
+    def get_object(self, queryset=None):
+        # Computing the validators already loads the object.
+        if queryset is None and getattr(self, 'object', None) is not None:
+            return self.object
+        return super().get_object(queryset)
+
+    def get_etag_parts(self):
+        return []
+
+    def get_etag(self):
+        user = self.request.user
+        cart = self.cart
+        parts = [
+            *self.get_etag_parts(),
+            user.pk,
+            user.get_username(),
+            (cart.pk, cart.total_products) if cart else None,
+            [
+                (category.pk, category.name, category.product_count)
+                for category in get_category_navigation()
+            ],
+            self.request.GET.urlencode(),
+        ]
+        return hashlib.md5(repr(parts).encode()).hexdigest()
+
+    def get(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        get = condition(
+            etag_func=lambda request, *args, **kwargs: self.get_etag(),
+        )(super().get)
+        return get(request, *args, **kwargs)
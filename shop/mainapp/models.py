@@ -9,6 +9,10 @@ User = get_user_model()
 class Category(models.Model):
     name = models.CharField(max_length=255, verbose_name='Имя категории')
     slug = models.SlugField(unique=True)
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
 
     def __str__(self):
         return self.name
@@ -38,10 +42,32 @@ class Product(models.Model):
         default=0,
         verbose_name='Цена',
     )
+    features = models.JSONField(
+        default=list,
+        blank=True,
+        editable=False,
+        verbose_name='Характеристики',
+    )
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения',
+        auto_now=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['price', 'id'], name='product_price_idx'),
+        ]
 
     def __str__(self):
         return self.title
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Lets signal handlers tell whether a save moved the product.
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        return instance
+
     def get_model_name(self):
         return self.__class__.__name__.lower()
 
@@ -59,6 +85,8 @@ class CartProduct(models.Model):
         'Customer',
         verbose_name='Покупатель',
         on_delete=models.CASCADE,
+        null=True,
+        blank=True,
     )
     cart = models.ForeignKey(
         'Cart',
@@ -79,6 +107,16 @@ class CartProduct(models.Model):
         verbose_name='Общая цена',
     )
 
+    class Meta:
+        constraints = [
+            # A cart holds one line per product; also keeps concurrent
+            # get_or_create() calls from adding a second one.
+            models.UniqueConstraint(
+                fields=['cart', 'product'],
+                name='cartproduct_cart_product_uniq',
+            ),
+        ]
+
     def __str__(self):
         return 'Продукт: {} (for cart)'.format(self.product.title)
 
@@ -108,6 +146,27 @@ class Cart(models.Model):
     )
     in_order = models.BooleanField(default=False)
     for_anonymous_user = models.BooleanField(default=False)
+    updated_at = models.DateTimeField(
+        verbose_name='Дата изменения корзины',
+        auto_now=True,
+    )
+
+    class Meta:
+        # Django compiles in_order=False to NOT in_order, which a plain
+        # composite index cannot match; partial indexes over the open
+        # carts can.
+        indexes = [
+            models.Index(
+                fields=['owner'],
+                condition=models.Q(in_order=False),
+                name='cart_owner_open_idx',
+            ),
+            models.Index(
+                fields=['updated_at'],
+                condition=models.Q(for_anonymous_user=True, in_order=False),
+                name='cart_guest_updated_idx',
+            ),
+        ]
 
     def __str__(self):
         return str(self.id)
@@ -212,6 +271,55 @@ class Order(models.Model):
         verbose_name='Дата получения заказа',
         default=timezone.now()
     )
+    total_products = models.PositiveIntegerField(default=0)
+    final_price = models.DecimalField(
+        max_digits=9,
+        decimal_places=2,
+        default=0,
+        verbose_name='Общая цена',
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['customer', 'created_at', 'id'],
+                name='order_customer_created_idx',
+            ),
+        ]
 
     def __str__(self):
         return str(self.id)
+
+
+class OrderProduct(models.Model):
+    order = models.ForeignKey(
+        Order,
+        verbose_name='Заказ',
+        on_delete=models.CASCADE,
+        related_name='related_products',
+    )
+    product = models.ForeignKey(
+        Product,
+        verbose_name='Товар',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+    )
+    title = models.CharField(max_length=255, verbose_name='Наименование')
+    image = models.ImageField(verbose_name='Изображение', blank=True)
+    price = models.DecimalField(
+        max_digits=9,
+        decimal_places=2,
+        default=0,
+        verbose_name='Цена',
+    )
+    qty = models.PositiveIntegerField(default=1)
+    final_price = models.DecimalField(
+        max_digits=9,
+        decimal_places=2,
+        default=0,
+        verbose_name='Общая цена',
+    )
+
+    def __str__(self):
+        return 'Продукт: {} (for order)'.format(self.title)
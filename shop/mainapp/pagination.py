@@ -0,0 +1,135 @@
+import base64
+import binascii
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.backends.base.operations import BaseDatabaseOperations
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+
+    def __init__(self, object_list, next_cursor):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+
+def encode_cursor(values):
+    data = json.dumps([str(value) for value in values])
+    return base64.urlsafe_b64encode(data.encode()).decode()
+
+
+def cursor_value(field, raw):
+    """
+    Converts a decoded cursor value for `field`, rejecting anything the
+    database could not compare against the column.
+    """
+    if isinstance(raw, bool) or not isinstance(raw, (str, int)):
+        raise InvalidCursor(raw)
+    try:
+        value = field.to_python(raw)
+        field.run_validators(value)
+    except (ValidationError, TypeError, ValueError, OverflowError):
+        raise InvalidCursor(raw)
+    # SQLite reports no integer ranges, so check the column type's own.
+    bounds = BaseDatabaseOperations.integer_field_ranges.get(
+        field.get_internal_type()
+    )
+    if bounds and not bounds[0] <= value <= bounds[1]:
+        raise InvalidCursor(raw)
+    return value
+
+
+def decode_cursor(cursor, fields):
+    """
+    Returns the values of `cursor` converted for the model `fields` of
+    the ordering. Raises InvalidCursor for anything encode_cursor() would
+    not have produced.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise InvalidCursor(cursor)
+    return [cursor_value(field, raw) for field, raw in zip(fields, values)]
+
+
+def ordering_fields(model, ordering):
+    opts = model._meta
+    return [
+        opts.pk if name == 'pk' else opts.get_field(name)
+        for name in (field.lstrip('-') for field in ordering)
+    ]
+
+
+def keyset_filter(ordering, values):
+    """
+    Builds the condition selecting rows strictly after `values` for the
+    given ordering, e.g. for ('price', 'pk'):
+    price >= v0 AND (price > v0 OR (price = v0 AND pk > v1)).
+    The redundant leading bound lets the database seek the index
+    instead of scanning it from the start.
+    """
+    condition = Q()
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        equal = {
+            previous.lstrip('-'): value
+            for previous, value in zip(ordering[:i], values)
+        }
+        condition |= Q(**equal, **{f'{name}__{lookup}': values[i]})
+    first = ordering[0]
+    lookup = 'lte' if first.startswith('-') else 'gte'
+    return Q(**{f'{first.lstrip("-")}__{lookup}': values[0]}) & condition
+
+
+def keyset_paginate(queryset, ordering, cursor=None, per_page=24,
+                    strict=False):
+    """
+    Returns the page of `queryset` that follows `cursor`. The ordering
+    must end with a unique field so that every row has a distinct key,
+    then deep pages cost the same index range scan as the first one.
+    Works on .values() querysets too, as long as they select the
+    ordering fields. An invalid cursor shows the first page, or raises
+    InvalidCursor if `strict`.
+    """
+    queryset = queryset.order_by(*ordering)
+    if cursor:
+        try:
+            values = decode_cursor(
+                cursor, ordering_fields(queryset.model, ordering),
+            )
+        except InvalidCursor:
+            if strict:
+                raise
+        else:
+            queryset = queryset.filter(keyset_filter(ordering, values))
+    object_list = list(queryset[:per_page + 1])
+    next_cursor = None
+    if len(object_list) > per_page:
+        object_list = object_list[:per_page]
+        last = object_list[-1]
+        if not isinstance(last, dict):
+            last = {
+                field.lstrip('-'): getattr(last, field.lstrip('-'))
+                for field in ordering
+            }
+        next_cursor = encode_cursor(
+            last[field.lstrip('-')] for field in ordering
+        )
+    return KeysetPage(object_list, next_cursor)
@@ -0,0 +1,128 @@
+import re
+
+from django.db import connection
+
+from .models import Product
+
+
+SEARCH_TABLE = 'mainapp_product_search'
+# bm25() weights of the title, description and features columns.
+SEARCH_WEIGHTS = (10.0, 1.0, 3.0)
+MAX_SEARCH_TERMS = 10
+
+INDEX_SQL = (
+    f'INSERT INTO {SEARCH_TABLE} (rowid, title, description, features) '
+    'SELECT p.id, p.title, coalesce(p.description, \'\'), coalesce(('
+    "SELECT group_concat(json_extract(f.value, '$.value'), ' ') "
+    'FROM json_each(p.features) AS f), \'\') '
+    f'FROM {Product._meta.db_table} AS p'
+)
+
+
+def search_enabled():
+    return connection.vendor == 'sqlite'
+
+
+def build_match(query):
+    """
+    Turns user input into an FTS5 query: every word must match as a
+    prefix, so partial input finds results while typing.
+    """
+    terms = re.findall(r'\w+', query.lower())[:MAX_SEARCH_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def in_clause(ids):
+    return ', '.join(['%s'] * len(ids))
+
+
+def index_products(product_ids):
+    product_ids = list(product_ids)
+    if not product_ids or not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN '
+            f'({in_clause(product_ids)})',
+            product_ids,
+        )
+        cursor.execute(
+            f'{INDEX_SQL} WHERE p.id IN ({in_clause(product_ids)})',
+            product_ids,
+        )
+
+
+def remove_products(product_ids):
+    product_ids = list(product_ids)
+    if not product_ids or not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {SEARCH_TABLE} WHERE rowid IN '
+            f'({in_clause(product_ids)})',
+            product_ids,
+        )
+
+
+def rebuild_search_index():
+    if not search_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+        cursor.execute(INDEX_SQL)
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"
+        )
+
+
+class SearchResult:
+    """
+    Product ids matching an FTS5 query, best matches first. Sliced and
+    counted lazily so that Paginator runs one query for each.
+    """
+
+    def __init__(self, match):
+        self.match = match
+
+    def count(self):
+        if not self.match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT count(*) FROM {SEARCH_TABLE} '
+                f'WHERE {SEARCH_TABLE} MATCH %s',
+                [self.match],
+            )
+            return cursor.fetchone()[0]
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            raise TypeError('SearchResult supports slicing only.')
+        if not self.match or item.stop is None:
+            return []
+        start = item.start or 0
+        weights = ', '.join(str(weight) for weight in SEARCH_WEIGHTS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {SEARCH_TABLE} '
+                f'WHERE {SEARCH_TABLE} MATCH %s '
+                f'ORDER BY bm25({SEARCH_TABLE}, {weights}), rowid '
+                'LIMIT %s OFFSET %s',
+                [self.match, item.stop - start, start],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+
+def search_products(query):
+    """
+    Returns a sliceable, countable sequence of matching product ids.
+    Falls back to a title scan on databases without FTS5.
+    """
+    if not search_enabled():
+        return Product.objects.filter(
+            title__icontains=query.strip(),
+        ).order_by('pk').values_list('pk', flat=True)
+    return SearchResult(build_match(query))
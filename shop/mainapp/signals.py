@@ -0,0 +1,113 @@
+from django.conf import settings
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .autocomplete import schedule_autocomplete_update
+from .images import cache_image_variants, generate_image_variants
+from .models import Cart, Category, Product
+from .search import index_products, remove_products
+from .utils import (
+    CART_SESSION_KEY,
+    get_or_create_customer,
+    get_or_create_open_cart,
+    invalidate_category_navigation,
+    invalidate_product_detail,
+    merge_carts,
+    pin_cart,
+    set_sqlite_pragmas,
+)
+
+
+@receiver(user_logged_in)
+def merge_anonymous_cart(sender, request, user, **kwargs):
+    if request is None or not hasattr(request, 'session'):
+        return
+    pinned = request.session.get(CART_SESSION_KEY) or {}
+    if pinned.get('user') is not None or not pinned.get('cart'):
+        return
+    anonymous_cart = Cart.objects.filter(
+        pk=pinned['cart'],
+        for_anonymous_user=True,
+        in_order=False,
+    ).first()
+    del request.session[CART_SESSION_KEY]
+    if not anonymous_cart:
+        return
+    cart = get_or_create_open_cart(get_or_create_customer(user))
+    merge_carts(anonymous_cart, cart)
+    pin_cart(request.session, user, cart)
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+def reset_category_navigation(sender, **kwargs):
+    invalidate_category_navigation()
+
+
+@receiver(post_save, sender=Product)
+def reset_category_navigation_counts(sender, instance, created, **kwargs):
+    # The navigation only shows product counts, so edits that keep the
+    # product in its category leave it (and every page's ETag) alone.
+    loaded = getattr(instance, '_loaded_category_id', None)
+    if created or loaded != instance.category_id:
+        invalidate_category_navigation()
+    instance._loaded_category_id = instance.category_id
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def reset_product_detail(sender, instance, **kwargs):
+    invalidate_product_detail(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+def index_product(sender, instance, **kwargs):
+    index_products([instance.pk])
+
+
+@receiver(post_delete, sender=Product)
+def unindex_product(sender, instance, **kwargs):
+    remove_products([instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Product)
+def autocomplete_saved(sender, instance, **kwargs):
+    schedule_autocomplete_update(instance)
+
+
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Product)
+def autocomplete_deleted(sender, instance, **kwargs):
+    schedule_autocomplete_update(instance, deleted=True)
+
+
+@receiver(pre_save, sender=Product)
+def detect_image_upload(sender, instance, **kwargs):
+    # The upload is written to storage during save(), so remember here
+    # whether this save brings a new file.
+    instance._image_uploaded = bool(
+        instance.image and not instance.image._committed
+    )
+
+
+@receiver(post_save, sender=Product)
+def generate_product_image_variants(sender, instance, **kwargs):
+    if not getattr(instance, '_image_uploaded', False):
+        return
+    name = instance.image.name
+
+    def generate():
+        cache_image_variants(name, generate_image_variants(name, force=True))
+
+    transaction.on_commit(generate)
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor == 'sqlite' and settings.SQLITE_PRAGMAS:
+        set_sqlite_pragmas(connection.connection, settings.SQLITE_PRAGMAS)
@@ -0,0 +1,35 @@
+from django import template
+from django.utils.html import format_html
+
+from ..images import image_srcsets
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def responsive_image(image, sizes='100vw', css_class='', alt='', lazy=True):
+    """
+    Renders an <img> for an ImageField file with a srcset of its
+    pre-generated variants and a WebP <source>, so the browser downloads
+    the smallest copy that fills `sizes`. Images without variants fall
+    back to the original.
+    """
+    if not image:
+        return ''
+    loading = 'lazy' if lazy else 'eager'
+    srcsets = image_srcsets(image)
+    if srcsets is None:
+        return format_html(
+            '<img src="{}" class="{}" alt="{}" loading="{}">',
+            image.url, css_class, alt, loading,
+        )
+    srcset, webp_srcset = srcsets
+    return format_html(
+        '<picture>'
+        '<source type="image/webp" srcset="{}" sizes="{}">'
+        '<img src="{}" srcset="{}" sizes="{}" class="{}" alt="{}" '
+        'loading="{}" decoding="async">'
+        '</picture>',
+        webp_srcset, sizes, image.url, srcset, sizes, css_class, alt, loading,
+    )
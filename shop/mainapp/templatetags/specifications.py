@@ -0,0 +1,35 @@
+from django import template
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from specs.utils import PRODUCT_SPEC_KEY, PRODUCT_SPEC_VERSION_KEY
+
+from ..utils import get_cache_version
+
+
+register = template.Library()
+
+
+@register.simple_tag
+def product_spec(product):
+    """
+    Renders the characteristics table of any product from its
+    Product.features document, so even a cache miss costs no query. The
+    fragment is cached per product together with the version of its
+    category's feature definitions, so renaming a feature invalidates
+    all of them.
+    """
+    version = get_cache_version(
+        PRODUCT_SPEC_VERSION_KEY.format(product.category_id)
+    )
+    key = PRODUCT_SPEC_KEY.format(product.pk)
+    cached = cache.get(key)
+    if cached is not None and cached[0] == version:
+        return mark_safe(cached[1])
+    html = render_to_string(
+        'product_spec.html',
+        {'features': product.features},
+    )
+    cache.set(key, (version, str(html)), None)
+    return mark_safe(html)
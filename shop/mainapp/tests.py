@@ -1,3 +1,2001 @@
-from django.test import TestCase
+import base64
+import csv
+import datetime
+import io
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+from decimal import Decimal
+from unittest import mock, skipUnless
+from urllib.parse import urlencode
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.asgi import ASGIHandler
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, models, transaction
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.template import Context, Template
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from PIL import Image
+
+from specs.facets import invalidate_facet_index
+from specs.models import CategoryFeature, FeatureValidator, ProductFeatures
+
+from . import async_views, urls
+from .autocomplete import (
+    AUTOCOMPLETE_CHECK_INTERVAL,
+    AUTOCOMPLETE_VERSION_KEY,
+    PrefixIndex,
+    _build_lock,
+    autocomplete,
+    invalidate_autocomplete,
+)
+from .images import IMAGE_VARIANTS_DIR, cache_key
+from .models import (
+    Cart,
+    CartProduct,
+    Category,
+    Customer,
+    Order,
+    OrderProduct,
+    Product,
+)
+from .pagination import encode_cursor
+from .search import rebuild_search_index
+from .utils import (
+    CART_SESSION_KEY,
+    CATEGORY_NAVIGATION_KEY,
+    MAX_CART_QTY,
+    bump_cache_version,
+    create_order_products,
+    get_cache_version,
+    get_cart_items,
+    invalidate_category_navigation,
+)
+from .views import BaseView, ProfileView
+
+
+BENCHMARK_BASELINE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'benchmarks.json',
+)
+BENCHMARK_UPDATE = os.environ.get('BENCHMARK_UPDATE') == '1'
+# Wall-clock budgets depend on the machine, so they only run on request.
+BENCHMARK_TIMES = os.environ.get('BENCHMARK_TIMES') == '1'
+BENCHMARK_RUNS = int(os.environ.get('BENCHMARK_RUNS', 5))
+BENCHMARK_TIME_FACTOR = float(os.environ.get('BENCHMARK_TIME_FACTOR', 3))
+BENCHMARK_TIME_SLACK_MS = float(os.environ.get('BENCHMARK_TIME_SLACK_MS', 25))
+
+CATALOG_CATEGORIES = 10
+CATALOG_PRODUCTS_PER_CATEGORY = 50
+CART_LINES = 10
+CUSTOMER_ORDERS = 10
+ORDER_LINES = 5
+
+
+def forge_cursor(values):
+    # encode_cursor() stringifies every value; a client can send anything.
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+class RouteProfiler:
+    """
+    Counts and times SQL queries and measures time spent in the outermost
+    Template._render call, excluding queries issued while rendering.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0
+        self.render_seconds = 0
+        self.render_depth = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        # Savepoints only exist because TestCase wraps every test in
+        # a transaction, outside of tests atomic() issues no statements.
+        if sql.startswith(('SAVEPOINT', 'RELEASE SAVEPOINT')):
+            return execute(sql, params, many, context)
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.queries += 1
+            self.db_seconds += elapsed
+            if self.render_depth:
+                self.render_seconds -= elapsed
+
+    def wrap_render(self, render):
+        profiler = self
+
+        def profiled_render(template, context):
+            profiler.render_depth += 1
+            started = time.perf_counter()
+            try:
+                return render(template, context)
+            finally:
+                profiler.render_depth -= 1
+                if not profiler.render_depth:
+                    elapsed = time.perf_counter() - started
+                    profiler.render_seconds += elapsed
+        return profiled_render
+
+    @contextmanager
+    def profile(self):
+        render = self.wrap_render(Template._render)
+        with mock.patch.object(Template, '_render', render), \
+                connection.execute_wrapper(self):
+            yield self
+
+
+class RouteBenchmarkTests(TestCase):
+    """
+    Hits every named route of mainapp against a synthetic catalog and
+    compares query count, DB time and render time with benchmarks.json.
+
+    Query counts are always checked; DB and render times only with
+    BENCHMARK_TIMES=1. Run with BENCHMARK_UPDATE=1 to rewrite the
+    committed baseline.
+    """
+
+    results = {}
+
+    @classmethod
+    def setUpTestData(cls):
+        Category.objects.bulk_create([
+            Category(name=f'Категория {i}', slug=f'category-{i}')
+            for i in range(CATALOG_CATEGORIES)
+        ])
+        categories = list(Category.objects.order_by('pk'))
+        Product.objects.bulk_create([
+            Product(
+                category=category,
+                title=f'Товар {category.pk}-{i}',
+                slug=f'product-{category.pk}-{i}',
+                image='macbook_pro.jpg',
+                description='Описание товара ' * 20,
+                price=Decimal(100 + i),
+            )
+            for category in categories
+            for i in range(CATALOG_PRODUCTS_PER_CATEGORY)
+        ])
+        invalidate_category_navigation()
+        for category in categories:
+            invalidate_facet_index(category.pk)
+        rebuild_search_index()
+        cls.category = categories[0]
+        cls.products = list(Product.objects.order_by('pk'))
+        cls.user = User.objects.create_user(
+            username='benchmark',
+            password='benchmark-password',
+        )
+        cls.customer = Customer.objects.create(user=cls.user)
+        cls.staff = User.objects.create_user(
+            username='benchmark-staff',
+            password='benchmark-password',
+            is_staff=True,
+        )
+        for i in range(CUSTOMER_ORDERS):
+            cart = cls.fill_cart(
+                cls.products[i * ORDER_LINES:(i + 1) * ORDER_LINES],
+                in_order=True,
+            )
+            items = get_cart_items(cart)
+            order = Order.objects.create(
+                customer=cls.customer,
+                first_name='Имя',
+                last_name='Фамилия',
+                phone='89990000000',
+                cart=cart,
+                total_products=cart.total_products,
+                final_price=cart.final_price,
+            )
+            create_order_products(order, items)
+            cls.customer.orders.add(order)
+        cls.cart = cls.fill_cart(cls.products[-CART_LINES:])
+
+    @classmethod
+    def fill_cart(cls, products, in_order=False):
+        cart = Cart.objects.create(
+            owner=cls.customer,
+            in_order=in_order,
+            total_products=len(products),
+            final_price=sum(product.price for product in products),
+        )
+        CartProduct.objects.bulk_create([
+            CartProduct(
+                user=cls.customer,
+                cart=cart,
+                product=product,
+                final_price=product.price,
+            )
+            for product in products
+        ])
+        cart.products.add(*CartProduct.objects.filter(cart=cart))
+        return cart
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if BENCHMARK_UPDATE and cls.results:
+            # A filtered run only measures some routes; keep the others.
+            baseline = cls.load_baseline()
+            baseline.update(cls.results)
+            with open(BENCHMARK_BASELINE, 'w', encoding='utf-8') as f:
+                json.dump(baseline, f, indent=4, sort_keys=True)
+                f.write('\n')
+
+    @classmethod
+    def load_baseline(cls):
+        if not os.path.exists(BENCHMARK_BASELINE):
+            return {}
+        with open(BENCHMARK_BASELINE, encoding='utf-8') as f:
+            return json.load(f)
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def measure(self, method, url, data=None, prepare=None):
+        queries = []
+        db_times = []
+        render_times = []
+        request = getattr(self.client, method)
+        prepare = prepare or (lambda: None)
+        # The first request warms up template and URL resolver caches.
+        prepare()
+        request(url, data)
+        for _ in range(BENCHMARK_RUNS):
+            prepare()
+            with RouteProfiler().profile() as profiler:
+                response = request(url, data)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertLess(response.status_code, 400, url)
+            queries.append(profiler.queries)
+            db_times.append(profiler.db_seconds * 1000)
+            render_times.append(profiler.render_seconds * 1000)
+        return {
+            'queries': max(queries),
+            'db_ms': round(statistics.median(db_times), 3),
+            'render_ms': round(statistics.median(render_times), 3),
+        }
+
+    def assertWithinBudget(self, route, method, url, data=None, prepare=None):
+        result = self.measure(method, url, data, prepare)
+        self.results[route] = result
+        if BENCHMARK_UPDATE:
+            return
+        budget = self.load_baseline().get(route)
+        if budget is None:
+            self.fail(
+                f'No baseline for route "{route}", '
+                f'run the suite with BENCHMARK_UPDATE=1'
+            )
+        self.assertLessEqual(
+            result['queries'],
+            budget['queries'],
+            f'{route}: query budget exceeded',
+        )
+        if not BENCHMARK_TIMES:
+            return
+        for key in ('db_ms', 'render_ms'):
+            limit = budget[key] * BENCHMARK_TIME_FACTOR
+            limit += BENCHMARK_TIME_SLACK_MS
+            self.assertLessEqual(
+                result[key],
+                limit,
+                f'{route}: {key} budget exceeded',
+            )
+
+    def test_every_route_is_benchmarked(self):
+        baseline = self.load_baseline()
+        for pattern in urls.urlpatterns:
+            with self.subTest(route=pattern.name):
+                self.assertTrue(
+                    hasattr(self, f'test_{pattern.name}'),
+                    f'No benchmark for route "{pattern.name}"',
+                )
+                if not BENCHMARK_UPDATE:
+                    self.assertTrue(
+                        pattern.name in baseline,
+                        f'No baseline for route "{pattern.name}"',
+                    )
+
+    def test_base(self):
+        self.assertWithinBudget('base', 'get', reverse('base'))
+
+    def test_product_detail(self):
+        url = reverse('product_detail', kwargs={'slug': self.products[0].slug})
+        self.assertWithinBudget('product_detail', 'get', url)
+
+    def test_category_detail(self):
+        url = reverse('category_detail', kwargs={'slug': self.category.slug})
+        self.assertWithinBudget('category_detail', 'get', url)
+
+    def test_search(self):
+        url = reverse('search') + '?q=товар'
+        self.assertWithinBudget('search', 'get', url)
+
+    def test_autocomplete(self):
+        url = reverse('autocomplete') + '?q=товар'
+        self.assertWithinBudget('autocomplete', 'get', url)
+
+    def test_api_products(self):
+        url = reverse('api_products') + '?' + urlencode({
+            'category': self.category.slug,
+            'limit': 50,
+        })
+        self.assertWithinBudget('api_products', 'get', url)
+
+    def test_api_categories(self):
+        url = reverse('api_categories')
+        self.assertWithinBudget('api_categories', 'get', url)
+
+    def test_api_product(self):
+        url = reverse('api_product', kwargs={'slug': self.products[0].slug})
+        self.assertWithinBudget('api_product', 'get', url)
+
+    def test_cart(self):
+        self.assertWithinBudget('cart', 'get', reverse('cart'))
+
+    def test_add_to_cart(self):
+        url = reverse('add_to_cart', kwargs={'slug': self.products[0].slug})
+        self.assertWithinBudget('add_to_cart', 'get', url)
+
+    def test_delete_from_cart(self):
+        product = self.products[-1]
+        url = reverse('delete_from_cart', kwargs={'slug': product.slug})
+        add_url = reverse('add_to_cart', kwargs={'slug': product.slug})
+        self.assertWithinBudget(
+            'delete_from_cart',
+            'get',
+            url,
+            prepare=lambda: self.client.get(add_url),
+        )
+
+    def test_change_qty(self):
+        url = reverse('change_qty', kwargs={'slug': self.products[-1].slug})
+        self.assertWithinBudget('change_qty', 'post', url, {'qty': 3})
+
+    def test_update_cart(self):
+        data = {
+            f'qty-{product.slug}': 2 for product in self.products[-CART_LINES:]
+        }
+        self.assertWithinBudget(
+            'update_cart',
+            'post',
+            reverse('update_cart'),
+            data,
+            prepare=lambda: CartProduct.objects.filter(cart=self.cart).update(
+                qty=1,
+            ),
+        )
+
+    def test_checkout(self):
+        self.assertWithinBudget('checkout', 'get', reverse('checkout'))
+
+    def test_make_order(self):
+        data = {
+            'first_name': 'Имя',
+            'last_name': 'Фамилия',
+            'phone': '89990000000',
+            'address': 'Адрес',
+            'buying_type': Order.BUYING_TYPE_DELIVERY,
+            'order_data': '2030-01-01',
+            'comment': '',
+        }
+        self.assertWithinBudget('make_order', 'post', reverse('make_order'), data)
+
+    def test_login(self):
+        self.assertWithinBudget('login', 'get', reverse('login'))
+
+    def test_logout(self):
+        self.assertWithinBudget(
+            'logout',
+            'get',
+            reverse('logout'),
+            prepare=lambda: self.client.force_login(self.user),
+        )
+
+    def test_registration(self):
+        self.assertWithinBudget('registration', 'get', reverse('registration'))
+
+    def test_profile(self):
+        self.assertWithinBudget('profile', 'get', reverse('profile'))
+
+    def test_export_orders(self):
+        self.client.force_login(self.staff)
+        self.assertWithinBudget(
+            'export_orders',
+            'get',
+            reverse('export_orders'),
+            {'format': 'jsonl'},
+        )
+
+
+class SeedShopCommandTests(TestCase):
+
+    def seed(self):
+        with transaction.atomic():
+            call_command(
+                'seed_shop',
+                categories=3,
+                products=50,
+                customers=5,
+                orders=10,
+                batch_size=7,
+                verbosity=0,
+            )
+            snapshot = (
+                list(Product.objects.values_list('category_id', 'price')),
+                list(ProductFeatures.objects.values_list('feature_id', 'value')),
+                list(CartProduct.objects.values_list('product_id', 'qty')),
+                list(Order.objects.values_list('customer_id', 'status')),
+            )
+            transaction.set_rollback(True)
+        return snapshot
+
+    def test_seed_is_deterministic(self):
+        self.assertEqual(self.seed(), self.seed())
+
+    def test_seed_creates_consistent_carts(self):
+        call_command('seed_shop', products=50, customers=5, orders=10,
+                     verbosity=0)
+        self.assertEqual(Product.objects.count(), 50)
+        self.assertEqual(Order.objects.count(), 10)
+        self.assertEqual(Cart.objects.filter(in_order=False).count(), 1)
+        for cart in Cart.objects.all():
+            lines = cart.products.aggregate(
+                models.Sum('final_price'),
+                models.Count('id'),
+            )
+            self.assertEqual(cart.total_products, lines['id__count'])
+            self.assertEqual(cart.final_price, lines['final_price__sum'])
+
+
+class ImportProductsCommandTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(
+            name='Ноутбуки',
+            slug='notebooks',
+        )
+        cls.ram = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Оперативная память',
+            feature_filter_name='ram',
+        )
+        FeatureValidator.objects.create(
+            category=cls.category,
+            feature_key=cls.ram,
+            valid_feature_value='16',
+        )
+        Product.objects.create(
+            category=cls.category,
+            title='Старое название',
+            slug='notebook-1',
+            image='macbook_pro.jpg',
+            price=Decimal(100),
+        )
+
+    def run_import(self, content, suffix='.csv', **options):
+        with tempfile.NamedTemporaryFile(
+            'w', suffix=suffix, encoding='utf-8', delete=False,
+        ) as f:
+            f.write(content)
+        self.addCleanup(os.remove, f.name)
+        stdout, stderr = io.StringIO(), io.StringIO()
+        call_command(
+            'import_products', f.name,
+            stdout=stdout, stderr=stderr, **options,
+        )
+        return stdout.getvalue(), stderr.getvalue()
+
+    def test_csv_upserts_products_and_features(self):
+        stdout, stderr = self.run_import(
+            'slug,title,category,price,image,feature:ram\n'
+            'notebook-1,Ноутбук 1,Ноутбуки,150.5,,16\n'
+            'phone-1,Телефон 1,Смартфоны,99,phone.jpg,\n'
+        )
+        self.assertEqual(stderr, '')
+        self.assertIn('1 created, 1 updated, 0 failed', stdout)
+        notebook = Product.objects.get(slug='notebook-1')
+        self.assertEqual(notebook.title, 'Ноутбук 1')
+        self.assertEqual(notebook.price, Decimal('150.50'))
+        self.assertEqual(notebook.image.name, 'macbook_pro.jpg')
+        self.assertEqual(notebook.features, [
+            {'name': 'Оперативная память', 'value': '16', 'unit': None},
+        ])
+        phone = Product.objects.select_related('category').get(slug='phone-1')
+        self.assertEqual(phone.category.name, 'Смартфоны')
+        self.run_import('slug,feature:ram\nnotebook-1,16\n')
+        self.assertEqual(
+            ProductFeatures.objects.filter(product=notebook).count(),
+            1,
+        )
+
+    def test_bad_rows_are_reported(self):
+        stdout, stderr = self.run_import(
+            '{"slug": "notebook-2", "title": "Ноутбук 2", '
+            '"category": "Ноутбуки", "image": "a.jpg", "price": "abc"}\n'
+            'not json\n'
+            '{"slug": "notebook-3", "title": "Ноутбук 3", '
+            '"category": "Ноутбуки", "image": "a.jpg", '
+            '"features": {"ram": "4"}}\n'
+            '{"slug": "notebook-4", "title": "Ноутбук 4", '
+            '"category": "Ноутбуки", "image": "a.jpg", '
+            '"features": {"gpu": "RTX"}}\n'
+            '{"slug": "notebook-5", "category": "Ноутбуки"}\n'
+            '{"slug": "notebook-6", "title": "Ноутбук 6", '
+            '"category": "Ноутбуки", "image": "a.jpg", '
+            '"features": {"ram": "16"}}\n'
+            '{"slug": "notebook-7", "price": "NaN"}\n'
+            '{"slug": "notebook-8", "price": "sNaN"}\n'
+            '{"slug": "notebook-9", "price": "Infinity"}\n'
+            '{"slug": "notebook-' + 'x' * 50 + '", "title": "Ноутбук"}\n',
+            suffix='.jsonl',
+        )
+        self.assertIn('1 created, 0 updated, 9 failed', stdout)
+        errors = dict(error.split(': ', 1) for error in stderr.splitlines())
+        self.assertEqual(
+            sorted(errors, key=lambda row: int(row.split()[1])),
+            [f'Row {i}' for i in (1, 2, 3, 4, 5, 7, 8, 9, 10)],
+        )
+        self.assertIn('«4»', errors['Row 3'])
+        self.assertIn('gpu', errors['Row 4'])
+        self.assertIn('title', errors['Row 5'])
+        for row in ('Row 7', 'Row 8', 'Row 9'):
+            self.assertIn('invalid price', errors[row])
+        self.assertIn('slug is longer than 50', errors['Row 10'])
+        self.assertEqual(
+            list(Product.objects.filter(
+                slug__startswith='notebook-',
+            ).order_by('slug').values_list('slug', flat=True)),
+            ['notebook-1', 'notebook-6'],
+        )
+
+    def test_queries_do_not_grow_with_rows(self):
+        def rows(start, count):
+            return 'slug,title,category,image,feature:ram\n' + ''.join(
+                f'item-{i},Товар {i},Ноутбуки,a.jpg,16\n'
+                for i in range(start, start + count)
+            )
+
+        # Warms up the validator index.
+        self.run_import(rows(0, 1))
+        with CaptureQueriesContext(connection) as small:
+            self.run_import(rows(10, 5))
+        with CaptureQueriesContext(connection) as large:
+            self.run_import(rows(100, 100))
+        self.assertEqual(len(large.captured_queries),
+                         len(small.captured_queries))
+        self.assertEqual(
+            ProductFeatures.objects.filter(value='16').count(),
+            106,
+        )
+
+
+class CartMixinTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='buyer', password='x')
+        category = Category.objects.create(name='Категория', slug='category')
+        cls.product = Product.objects.create(
+            category=category,
+            title='Товар',
+            slug='product',
+            image='macbook_pro.jpg',
+            price=Decimal(100),
+        )
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def pinned(self):
+        return self.client.session.get(CART_SESSION_KEY, {})
+
+    def test_cart_is_pinned_in_session(self):
+        self.client.get(reverse('cart'))
+        cart = Cart.objects.get(owner__user=self.user, in_order=False)
+        self.assertEqual(self.pinned(), {
+            'user': self.user.pk,
+            'customer': cart.owner_id,
+            'cart': cart.pk,
+        })
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(reverse('cart'))
+        tables = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotIn('mainapp_customer', tables)
+
+    def test_pin_for_other_user_is_ignored(self):
+        session = self.client.session
+        other_cart = Cart.objects.create(for_anonymous_user=True)
+        session[CART_SESSION_KEY] = {'user': None, 'cart': other_cart.pk}
+        session.save()
+        self.client.get(reverse('cart'))
+        self.assertNotEqual(self.pinned()['cart'], other_cart.pk)
+
+    def test_order_unpins_cart(self):
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product'}))
+        cart_id = self.pinned()['cart']
+        self.client.post(reverse('make_order'), {
+            'first_name': 'Имя',
+            'last_name': 'Фамилия',
+            'phone': '89990000000',
+            'buying_type': Order.BUYING_TYPE_SELF,
+            'order_data': '2030-01-01',
+        })
+        self.assertNotIn('cart', self.pinned())
+        self.assertTrue(Cart.objects.get(pk=cart_id).in_order)
+        self.client.get(reverse('cart'))
+        self.assertNotEqual(self.pinned()['cart'], cart_id)
+
+
+class AnonymousCartTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        cls.products = [
+            Product.objects.create(
+                category=category,
+                title=f'Товар {i}',
+                slug=f'product-{i}',
+                image='macbook_pro.jpg',
+                price=Decimal(100),
+            )
+            for i in range(3)
+        ]
+        cls.user = User.objects.create_user(username='buyer', password='x')
+
+    def add_to_cart(self, client, product):
+        client.get(reverse('add_to_cart', kwargs={'slug': product.slug}))
+
+    def test_guest_cart_is_created_on_first_add(self):
+        self.client.get(reverse('base'))
+        self.client.get(reverse('cart'))
+        self.assertFalse(Cart.objects.exists())
+        self.add_to_cart(self.client, self.products[0])
+        cart = Cart.objects.get()
+        self.assertTrue(cart.for_anonymous_user)
+        self.assertEqual(cart.total_products, 1)
+
+    def test_guests_do_not_share_carts(self):
+        other = self.client_class()
+        self.add_to_cart(self.client, self.products[0])
+        self.add_to_cart(other, self.products[1])
+        self.assertEqual(Cart.objects.count(), 2)
+        for cart in Cart.objects.all():
+            self.assertEqual(cart.products.count(), 1)
+
+    def test_guest_cart_is_merged_on_login(self):
+        customer = Customer.objects.create(user=self.user)
+        cart = Cart.objects.create(owner=customer)
+        line = CartProduct.objects.create(
+            user=customer,
+            cart=cart,
+            product=self.products[0],
+        )
+        cart.products.add(line)
+        self.add_to_cart(self.client, self.products[0])
+        self.add_to_cart(self.client, self.products[1])
+        self.client.post(reverse('login'), {
+            'username': 'buyer',
+            'password': 'x',
+        })
+        self.assertEqual(Cart.objects.get(), cart)
+        cart.refresh_from_db()
+        self.assertEqual(cart.total_products, 2)
+        self.assertEqual(cart.final_price, Decimal(300))
+        self.assertEqual(
+            sorted(cart.products.values_list('product__slug', 'qty')),
+            [('product-0', 2), ('product-1', 1)],
+        )
+        self.assertFalse(
+            CartProduct.objects.exclude(cart=cart, user=customer).exists()
+        )
+        self.assertEqual(
+            self.client.session[CART_SESSION_KEY]['cart'],
+            cart.pk,
+        )
+
+    def test_expired_guest_carts_are_removed(self):
+        self.add_to_cart(self.client, self.products[0])
+        stale = Cart.objects.get()
+        fresh = Cart.objects.create(for_anonymous_user=True)
+        Cart.objects.filter(pk=stale.pk).update(
+            updated_at=timezone.now() - datetime.timedelta(days=30)
+        )
+        call_command('clear_anonymous_carts', verbosity=0)
+        self.assertEqual(list(Cart.objects.all()), [fresh])
+        self.assertFalse(CartProduct.objects.exists())
+
+
+class CartTotalsTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        for i, price in enumerate((100, 250)):
+            Product.objects.create(
+                category=category,
+                title=f'Товар {i}',
+                slug=f'product-{i}',
+                image='macbook_pro.jpg',
+                price=Decimal(price),
+            )
+        cls.user = User.objects.create_user(username='buyer', password='x')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assertTotals(self, total_products, final_price):
+        cart = Cart.objects.get(owner__user=self.user, in_order=False)
+        self.assertEqual(cart.total_products, total_products)
+        self.assertEqual(cart.final_price, Decimal(final_price))
+        call_command('reconcile_carts', verbosity=0)
+
+    def test_cart_mutations_update_totals(self):
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product-0'}))
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product-1'}))
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product-1'}))
+        self.assertTotals(2, 350)
+        self.client.post(
+            reverse('change_qty', kwargs={'slug': 'product-1'}),
+            {'qty': 3},
+        )
+        self.assertTotals(2, 850)
+        self.client.get(
+            reverse('delete_from_cart', kwargs={'slug': 'product-0'})
+        )
+        self.assertTotals(1, 750)
+
+    def update_cart(self, *operations):
+        return self.client.post(
+            reverse('update_cart'),
+            {'operations': list(operations)},
+            content_type='application/json',
+        )
+
+    def test_batch_update(self):
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product-0'}))
+        response = self.update_cart(
+            {'op': 'set', 'slug': 'product-0', 'qty': 4},
+            {'op': 'add', 'slug': 'product-1', 'qty': 1},
+            {'op': 'add', 'slug': 'product-1', 'qty': 2},
+        )
+        self.assertEqual(response.json()['total_products'], 2)
+        self.assertEqual(response.json()['final_price'], '1150.00')
+        self.assertTotals(2, 1150)
+        response = self.update_cart(
+            {'op': 'remove', 'slug': 'product-0'},
+            {'op': 'set', 'slug': 'product-1', 'qty': 1},
+        )
+        self.assertEqual(response.json()['lines'], [
+            {'slug': 'product-1', 'qty': 1, 'final_price': '250.00'},
+        ])
+        self.assertTotals(1, 250)
+
+    def test_batch_update_is_rejected_as_a_whole(self):
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product-0'}))
+        response = self.update_cart(
+            {'op': 'set', 'slug': 'product-0', 'qty': 4},
+            {'op': 'set', 'slug': 'missing', 'qty': 1},
+            {'op': 'drop', 'slug': 'product-0'},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 2)
+        self.assertTotals(1, 100)
+
+    def test_batch_update_rejects_malformed_values(self):
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product-0'}))
+        response = self.update_cart(
+            {'op': 'set', 'slug': {'a': 1}, 'qty': 1},
+            {'op': 'set', 'slug': ['product-0'], 'qty': 1},
+            {'op': 'set', 'slug': 'product-0', 'qty': float('inf')},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            'Операция 1: неверный товар',
+            'Операция 2: неверный товар',
+            'Операция 3: неверное кол-во',
+        ])
+        self.assertTotals(1, 100)
+
+    def test_batch_update_rejects_oversized_qty(self):
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product-0'}))
+        response = self.update_cart(
+            {'op': 'set', 'slug': 'product-0', 'qty': 100000000},
+            {'op': 'set', 'slug': 'product-1', 'qty': 10 ** 30},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            'Операция 1: неверное кол-во',
+            'Операция 2: неверное кол-во',
+        ])
+        # Each add fits, the resulting line does not.
+        response = self.update_cart(
+            {'op': 'add', 'slug': 'product-0', 'qty': MAX_CART_QTY},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['errors'], [
+            'Операция 1: неверное кол-во',
+        ])
+        self.assertTotals(1, 100)
+
+    def test_batch_update_rejects_oversized_total(self):
+        category = Category.objects.get()
+        for slug in ('expensive-0', 'expensive-1'):
+            Product.objects.create(
+                category=category,
+                title=slug,
+                slug=slug,
+                image='macbook_pro.jpg',
+                price=Decimal(6000000),
+            )
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product-0'}))
+        response = self.update_cart(
+            {'op': 'set', 'slug': 'expensive-0', 'qty': 1},
+            {'op': 'set', 'slug': 'expensive-1', 'qty': 1},
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json()['errors'],
+            ['Сумма корзины слишком велика'],
+        )
+        self.assertTotals(1, 100)
+
+    def test_cart_form_update(self):
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product-0'}))
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product-1'}))
+        response = self.client.post(reverse('update_cart'), {
+            'qty-product-0': 2,
+            'qty-product-1': 0,
+        })
+        self.assertRedirects(response, '/cart/')
+        self.assertTotals(1, 200)
+
+    def test_reconcile_carts_repairs_drift(self):
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'product-0'}))
+        Cart.objects.update(total_products=5, final_price=1)
+        with self.assertRaises(CommandError):
+            call_command('reconcile_carts', stdout=io.StringIO())
+        call_command('reconcile_carts', fix=True, stdout=io.StringIO())
+        self.assertTotals(1, 100)
+
+
+class CartReadTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        Product.objects.bulk_create([
+            Product(
+                category=category,
+                title=f'Товар {i}',
+                slug=f'product-{i}',
+                image='macbook_pro.jpg',
+                price=Decimal(100),
+            )
+            for i in range(20)
+        ])
+        cls.user = User.objects.create_user(username='buyer', password='x')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def count_queries(self, url_name, lines):
+        self.client.post(
+            reverse('update_cart'),
+            {'operations': [
+                {'op': 'set', 'slug': f'product-{i}', 'qty': 1}
+                for i in range(lines)
+            ]},
+            content_type='application/json',
+        )
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(len(response.context['cart_items']), lines)
+        return len(context.captured_queries)
+
+    def test_cart_queries_do_not_grow_with_cart(self):
+        self.assertEqual(
+            self.count_queries('cart', 1),
+            self.count_queries('cart', 20),
+        )
+
+    def test_checkout_queries_do_not_grow_with_cart(self):
+        self.assertEqual(
+            self.count_queries('checkout', 1),
+            self.count_queries('checkout', 20),
+        )
+
+    def test_badge_uses_cart_counter(self):
+        self.count_queries('cart', 3)
+        response = self.client.get(reverse('login'))
+        self.assertContains(
+            response,
+            '<span class="badge badge-pill badge-danger">3</span>',
+            html=True,
+        )
+
+
+class OrderHistoryTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        cls.product = Product.objects.create(
+            category=category,
+            title='Товар',
+            slug='product',
+            image='macbook_pro.jpg',
+            price=Decimal(100),
+        )
+        cls.user = User.objects.create_user(username='buyer', password='x')
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def make_order(self, qty=1):
+        self.client.post(
+            reverse('update_cart'),
+            {'operations': [{'op': 'set', 'slug': 'product', 'qty': qty}]},
+            content_type='application/json',
+        )
+        self.client.post(reverse('make_order'), {
+            'first_name': 'Имя',
+            'last_name': 'Фамилия',
+            'phone': '89990000000',
+            'buying_type': Order.BUYING_TYPE_SELF,
+            'order_data': '2030-01-01',
+        })
+
+    def test_order_lines_are_snapshotted(self):
+        self.make_order(qty=2)
+        Product.objects.update(title='Новое имя', price=Decimal(500))
+        order = Order.objects.get()
+        self.assertEqual(order.total_products, 1)
+        self.assertEqual(order.final_price, Decimal(200))
+        self.assertEqual(
+            list(order.related_products.values_list(
+                'title', 'price', 'qty', 'final_price', 'image',
+            )),
+            [('Товар', Decimal(100), 2, Decimal(200), 'macbook_pro.jpg')],
+        )
+        response = self.client.get(reverse('profile'))
+        self.assertContains(response, 'Товар (2)')
+
+    def test_profile_queries_do_not_grow_with_orders(self):
+        self.make_order()
+        with CaptureQueriesContext(connection) as one_order:
+            self.client.get(reverse('profile'))
+        for _ in range(5):
+            self.make_order()
+        with CaptureQueriesContext(connection) as many_orders:
+            self.client.get(reverse('profile'))
+        self.assertEqual(
+            len(one_order.captured_queries),
+            len(many_orders.captured_queries),
+        )
+
+    def test_profile_is_paginated(self):
+        for _ in range(ProfileView.paginate_by + 1):
+            self.make_order()
+        response = self.client.get(reverse('profile'))
+        self.assertEqual(len(response.context['orders']), ProfileView.paginate_by)
+        response = self.client.get(reverse('profile'), {'page': 2})
+        self.assertEqual(len(response.context['orders']), 1)
+
+
+class OrderExportTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        product = Product.objects.create(
+            category=category,
+            title='Товар',
+            slug='product',
+            image='macbook_pro.jpg',
+            price=Decimal(100),
+        )
+        user = User.objects.create_user(
+            username='buyer',
+            email='buyer@example.org',
+        )
+        customer = Customer.objects.create(user=user)
+        statuses = (Order.STATUS_NEW, Order.STATUS_COMPLETED,
+                    Order.STATUS_COMPLETED, Order.STATUS_NEW, Order.STATUS_NEW)
+        for i, status in enumerate(statuses):
+            order = Order.objects.create(
+                customer=customer,
+                first_name='Имя',
+                last_name='Фамилия',
+                phone='89990000000',
+                status=status,
+                buying_type=Order.BUYING_TYPE_DELIVERY,
+                total_products=i,
+                final_price=Decimal(100 * i),
+            )
+            OrderProduct.objects.bulk_create([
+                OrderProduct(
+                    order=order,
+                    product=product,
+                    title='Товар',
+                    price=Decimal(100),
+                    final_price=Decimal(100),
+                )
+                for _ in range(i)
+            ])
+        cls.staff = User.objects.create_user(username='ops', is_staff=True)
+
+    def export(self, **options):
+        stdout = io.StringIO()
+        call_command('export_orders', stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_csv_has_a_row_per_line(self):
+        rows = list(csv.DictReader(io.StringIO(self.export())))
+        # The first order has no lines and still gets a row.
+        self.assertEqual(len(rows), 1 + 0 + 1 + 2 + 3 + 4)
+        self.assertEqual(rows[0]['line_final_price'], '')
+        self.assertEqual(rows[-1]['customer_username'], 'buyer')
+        self.assertEqual(rows[-1]['buying_type'], Order.BUYING_TYPE_DELIVERY)
+        self.assertEqual(rows[-1]['title'], 'Товар')
+
+    def test_jsonl_filters(self):
+        orders = [
+            json.loads(line)
+            for line in self.export(
+                format='jsonl',
+                status=[Order.STATUS_COMPLETED],
+            ).splitlines()
+        ]
+        self.assertEqual(
+            [len(order['lines']) for order in orders],
+            [1, 2],
+        )
+        today = timezone.localdate()
+        self.assertEqual(self.export(
+            format='jsonl',
+            date_to=str(today - datetime.timedelta(days=1)),
+        ), '')
+        with self.assertRaises(CommandError):
+            self.export(date_from=str(today), date_to='2000-01-01')
+
+    def test_lines_are_read_per_chunk(self):
+        with CaptureQueriesContext(connection) as context:
+            self.export(chunk_size=2)
+        line_queries = [
+            query for query in context.captured_queries
+            if 'mainapp_orderproduct' in query['sql']
+        ]
+        self.assertEqual(len(line_queries), 3)
+
+    def test_endpoint_is_staff_only(self):
+        url = reverse('export_orders')
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.force_login(self.staff)
+        response = self.client.get(url, {'format': 'jsonl'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        body = b''.join(response.streaming_content).decode()
+        self.assertEqual(len(body.splitlines()), 5)
+        response = self.client.get(url, {'status': 'lost'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_endpoint_under_asgi(self):
+        self.client.force_login(self.staff)
+        messages = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b''}
+
+        async def send(message):
+            messages.append(message)
+
+        url = reverse('export_orders')
+        async_to_sync(ASGIHandler())(
+            {
+                'type': 'http',
+                'method': 'GET',
+                'path': url,
+                'query_string': b'format=jsonl',
+                'headers': [(b'host', b'testserver'), (b'cookie', '; '.join(
+                    f'{name}={morsel.value}'
+                    for name, morsel in self.client.cookies.items()
+                ).encode())],
+            },
+            receive,
+            send,
+        )
+        self.assertEqual(messages[0]['status'], 200)
+        body = b''.join(message.get('body', b'') for message in messages[1:])
+        self.assertEqual(len(body.decode().splitlines()), 5)
+
+
+class CatalogListingTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Категория', slug='category')
+        Product.objects.bulk_create([
+            Product(
+                category=category,
+                title=f'Товар {i}',
+                slug=f'product-{i}',
+                image='macbook_pro.jpg',
+                price=Decimal(i % 7 * 10 + 0.5),
+            )
+            for i in range(60)
+        ])
+
+    def walk(self, sort):
+        seen = []
+        params = {'sort': sort}
+        while True:
+            response = self.client.get(reverse('base'), params)
+            page = response.context['products']
+            self.assertLessEqual(len(page), BaseView.paginate_by)
+            seen.extend(page)
+            if not page.has_next():
+                return seen
+            params['after'] = page.next_cursor
+
+    def test_pages_cover_catalog_in_order(self):
+        for sort, ordering in BaseView.orderings.items():
+            with self.subTest(sort=sort):
+                self.assertEqual(
+                    [product.pk for product in self.walk(sort)],
+                    list(Product.objects.order_by(*ordering).values_list(
+                        'pk', flat=True,
+                    )),
+                )
+
+    def test_invalid_cursor_shows_first_page(self):
+        response = self.client.get(reverse('base'), {'after': 'broken'})
+        self.assertEqual(
+            [product.pk for product in response.context['products']],
+            list(Product.objects.order_by('-pk').values_list(
+                'pk', flat=True,
+            )[:BaseView.paginate_by]),
+        )
+
+    def test_forged_cursor_shows_first_page(self):
+        response = self.client.get(reverse('base'), {
+            'sort': 'price_asc',
+            'after': encode_cursor(['cheap', 'first']),
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(response.context['products']),
+            BaseView.paginate_by,
+        )
+
+    def test_out_of_range_or_nested_cursor_shows_first_page(self):
+        cursors = [
+            ('new', [10 ** 30]),
+            ('new', [True]),
+            ('price_asc', ['1', {'a': 1}]),
+            ('price_asc', [['1'], '1']),
+            ('price_asc', ['NaN', '1']),
+            ('price_desc', ['1' * 40, '1']),
+        ]
+        for sort, values in cursors:
+            with self.subTest(sort=sort, values=values):
+                response = self.client.get(reverse('base'), {
+                    'sort': sort,
+                    'after': forge_cursor(values),
+                })
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    [product.pk for product in response.context['products']],
+                    list(Product.objects.order_by(
+                        *BaseView.orderings[sort]
+                    ).values_list('pk', flat=True)[:BaseView.paginate_by]),
+                )
+
+    def test_listing_defers_description(self):
+        response = self.client.get(reverse('base'))
+        product = response.context['products'].object_list[0]
+        self.assertIn('description', product.get_deferred_fields())
+
+
+class SearchTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(
+            name='Ноутбуки',
+            slug='notebooks',
+        )
+        cls.feature = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Процессор',
+            feature_filter_name='cpu',
+        )
+        cls.macbook = cls.create_product(
+            'macbook', 'Apple MacBook Pro', 'Ноутбук для работы',
+        )
+        cls.sleeve = cls.create_product(
+            'sleeve', 'Чехол для ноутбука', 'Подходит для MacBook',
+        )
+
+    @classmethod
+    def create_product(cls, slug, title, description):
+        return Product.objects.create(
+            category=cls.category,
+            title=title,
+            slug=slug,
+            image='macbook_pro.jpg',
+            description=description,
+        )
+
+    def search(self, query, **params):
+        response = self.client.get(reverse('search'), {'q': query, **params})
+        return [product.slug for product in response.context['products']]
+
+    def test_title_matches_rank_first(self):
+        self.assertEqual(self.search('macbook'), ['macbook', 'sleeve'])
+        self.assertEqual(self.search('MacB'), ['macbook', 'sleeve'])
+        self.assertEqual(self.search('чехол ноутбук'), ['sleeve'])
+        self.assertEqual(self.search(''), [])
+        self.assertEqual(self.search('"*) OR'), [])
+
+    def test_index_follows_changes(self):
+        self.macbook.title = 'Apple MacBook Air'
+        self.macbook.save()
+        self.assertEqual(self.search('air'), ['macbook'])
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductFeatures.objects.create(
+                product=self.sleeve,
+                feature=self.feature,
+                value='Universal',
+            )
+        self.assertEqual(self.search('universal'), ['sleeve'])
+        self.macbook.delete()
+        self.assertEqual(self.search('macbook'), ['sleeve'])
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM mainapp_product_search')
+        self.assertEqual(self.search('macbook'), [])
+        call_command('rebuild_search_index', verbosity=0)
+        self.assertEqual(self.search('macbook'), ['macbook', 'sleeve'])
+
+    def test_results_are_paginated(self):
+        for i in range(30):
+            self.create_product(f'case-{i}', f'Чехол {i}', '')
+        first = self.search('чехол')
+        second = self.search('чехол', page=2)
+        self.assertEqual(len(first), 24)
+        self.assertEqual(len(set(first + second)), 31)
+
+
+class ImageVariantTests(TestCase):
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.media_root = media.name
+        media_settings = override_settings(MEDIA_ROOT=media.name)
+        media_settings.enable()
+        self.addCleanup(media_settings.disable)
+        self.addCleanup(cache.clear)
+        self.category = Category.objects.create(
+            name='Ноутбуки',
+            slug='notebooks',
+        )
+
+    def jpeg(self, width=1000, height=500):
+        buffer = io.BytesIO()
+        Image.new('RGB', (width, height), 'red').save(buffer, 'JPEG')
+        return buffer.getvalue()
+
+    def variants(self):
+        path = os.path.join(self.media_root, IMAGE_VARIANTS_DIR)
+        return sorted(os.listdir(path)) if os.path.isdir(path) else []
+
+    def render(self, product):
+        return Template(
+            '{% load images %}{% responsive_image product.image %}'
+        ).render(Context({'product': product}))
+
+    def test_upload_generates_variants(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                category=self.category,
+                title='MacBook',
+                slug='macbook',
+                image=SimpleUploadedFile('macbook.jpg', self.jpeg()),
+            )
+        self.assertEqual(self.variants(), [
+            'macbook-1000.webp', 'macbook-200.jpg', 'macbook-200.webp',
+            'macbook-400.jpg', 'macbook-400.webp', 'macbook-800.jpg',
+            'macbook-800.webp', 'macbook.json',
+        ])
+        with Image.open(os.path.join(
+            self.media_root, IMAGE_VARIANTS_DIR, 'macbook-400.jpg',
+        )) as image:
+            self.assertEqual(image.size, (400, 200))
+        html = self.render(product)
+        self.assertIn('/media/thumbs/macbook-200.jpg 200w', html)
+        self.assertIn('/media/macbook.jpg 1000w', html)
+        self.assertIn('type="image/webp"', html)
+        self.assertIn('loading="lazy"', html)
+
+    def test_saves_without_upload_skip_generation(self):
+        with open(os.path.join(self.media_root, 'old.jpg'), 'wb') as image:
+            image.write(self.jpeg())
+        with self.captureOnCommitCallbacks(execute=True):
+            product = Product.objects.create(
+                category=self.category,
+                title='MacBook',
+                slug='macbook',
+                image='old.jpg',
+            )
+        self.assertEqual(self.variants(), [])
+        html = self.render(product)
+        self.assertNotIn('srcset', html)
+        self.assertIn('src="/media/old.jpg"', html)
+
+    def test_backfill_command(self):
+        for name, size in (('wide.jpg', 1000), ('small.jpg', 100)):
+            with open(os.path.join(self.media_root, name), 'wb') as image:
+                image.write(self.jpeg(size, size))
+        for slug, name in (('wide', 'wide.jpg'), ('small', 'small.jpg'),
+                           ('missing', 'missing.jpg')):
+            Product.objects.create(
+                category=self.category,
+                title=slug,
+                slug=slug,
+                image=name,
+            )
+        cache.set(cache_key('wide.jpg'), {})
+        stderr = io.StringIO()
+        call_command('generate_image_variants', workers=2, verbosity=0,
+                     stderr=stderr)
+        self.assertIn('"missing.jpg"', stderr.getvalue())
+        self.assertEqual(self.variants(), [
+            'small-100.webp', 'small.json', 'wide-1000.webp',
+            'wide-200.jpg', 'wide-200.webp', 'wide-400.jpg', 'wide-400.webp',
+            'wide-800.jpg', 'wide-800.webp', 'wide.json',
+        ])
+        html = self.render(Product.objects.get(slug='wide'))
+        self.assertIn('/media/thumbs/wide-800.webp 800w', html)
+        html = self.render(Product.objects.get(slug='small'))
+        self.assertIn('srcset="/media/small.jpg 100w"', html)
+
+
+class ProductDetailCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(
+            name='Ноутбуки',
+            slug='notebooks',
+        )
+        cls.feature = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Процессор',
+            feature_filter_name='cpu',
+        )
+        cls.product = Product.objects.create(
+            category=cls.category,
+            title='MacBook',
+            slug='macbook',
+            image='macbook_pro.jpg',
+            price=Decimal('1000.00'),
+        )
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.value = ProductFeatures.objects.create(
+                product=cls.product,
+                feature=cls.feature,
+                value='M1',
+            )
+        cls.url = reverse('product_detail', kwargs={'slug': 'macbook'})
+
+    def setUp(self):
+        self.addCleanup(cache.clear)
+
+    def test_fragment_is_reused(self):
+        first = self.client.get(self.url).content
+        with CaptureQueriesContext(connection) as queries:
+            second = self.client.get(self.url).content
+        self.assertEqual(first, second)
+        self.assertFalse(any(
+            'specs_productfeatures' in query['sql']
+            for query in queries.captured_queries
+        ))
+
+    def test_changes_invalidate_fragment(self):
+        self.client.get(self.url)
+        self.product.price = Decimal('900.00')
+        self.product.save()
+        self.assertContains(self.client.get(self.url), '900.00')
+        self.value.value = 'M2'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.value.save()
+        self.assertContains(self.client.get(self.url), 'M2')
+        self.feature.feature_name = 'Чип'
+        self.feature.save()
+        self.assertContains(self.client.get(self.url), 'Чип')
+
+    def test_cart_badge_stays_dynamic(self):
+        self.client.get(self.url)
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'macbook'}))
+        response = self.client.get(self.url)
+        self.assertEqual(response.context['cart'].total_products, 1)
+        self.assertContains(
+            response,
+            '<span class="badge badge-pill badge-danger">1</span>',
+        )
+
+
+class ConditionalGetTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(
+            name='Ноутбуки',
+            slug='notebooks',
+        )
+        cls.feature = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Процессор',
+            feature_filter_name='cpu',
+        )
+        cls.product = Product.objects.create(
+            category=cls.category,
+            title='MacBook',
+            slug='macbook',
+            image='macbook_pro.jpg',
+        )
+        cls.product_url = reverse('product_detail', kwargs={'slug': 'macbook'})
+        cls.category_url = reverse(
+            'category_detail',
+            kwargs={'slug': 'notebooks'},
+        )
+
+    def revalidate(self, url, response, **params):
+        return self.client.get(
+            url,
+            params,
+            HTTP_IF_NONE_MATCH=response['ETag'],
+        )
+
+    def test_unchanged_pages_are_not_rendered(self):
+        for url in (self.product_url, self.category_url):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertFalse(response.has_header('Last-Modified'))
+                repeated = self.revalidate(url, response)
+                self.assertEqual(repeated.status_code, 304)
+                self.assertEqual(repeated.templates, [])
+
+    def test_modified_since_alone_does_not_validate(self):
+        # The navigation counts change without any timestamp moving.
+        response = self.client.get(
+            self.product_url,
+            HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 3600),
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_changes_refresh_pages(self):
+        product_page = self.client.get(self.product_url)
+        category_page = self.client.get(self.category_url)
+        self.product.price = Decimal('900.00')
+        self.product.save()
+        self.assertEqual(
+            self.revalidate(self.product_url, product_page).status_code,
+            200,
+        )
+        self.assertEqual(
+            self.revalidate(self.category_url, category_page).status_code,
+            200,
+        )
+        product_page = self.client.get(self.product_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductFeatures.objects.create(
+                product=self.product,
+                feature=self.feature,
+                value='M1',
+            )
+        self.assertEqual(
+            self.revalidate(self.product_url, product_page).status_code,
+            200,
+        )
+
+    def test_query_string_and_cart_change_etag(self):
+        response = self.client.get(self.category_url)
+        filtered = self.revalidate(self.category_url, response, cpu='M1')
+        self.assertEqual(filtered.status_code, 200)
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'macbook'}))
+        with_cart = self.revalidate(self.category_url, response)
+        self.assertEqual(with_cart.status_code, 200)
+        self.assertEqual(
+            self.revalidate(self.category_url, with_cart).status_code,
+            304,
+        )
+
+
+class IndexUsageTests(TestCase):
+    """EXPLAIN QUERY PLAN of the hot lookups must not fall back to scans."""
+
+    def assertUsesIndex(self, queryset, index=None):
+        plan = queryset.explain()
+        self.assertNotIn('SCAN', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+        self.assertRegex(plan, r'USING (COVERING )?INDEX')
+        if index:
+            self.assertIn(index, plan)
+
+    def test_cart_lookups(self):
+        self.assertUsesIndex(
+            Cart.objects.filter(owner_id=1, in_order=False),
+            'cart_owner_open_idx',
+        )
+        self.assertUsesIndex(
+            Cart.objects.filter(
+                for_anonymous_user=True,
+                in_order=False,
+                updated_at__lt=timezone.now(),
+            ),
+            'cart_guest_updated_idx',
+        )
+        self.assertUsesIndex(
+            CartProduct.objects.filter(user_id=1, cart_id=1, product_id=1),
+        )
+        self.assertUsesIndex(CartProduct.objects.filter(cart_id=1))
+
+    def test_order_history(self):
+        self.assertUsesIndex(
+            Order.objects.filter(customer_id=1).order_by('-created_at', '-pk'),
+            'order_customer_created_idx',
+        )
+
+    def test_customer_by_user(self):
+        self.assertUsesIndex(Customer.objects.filter(user_id=1))
+
+    def test_cart_lines_are_unique(self):
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        product = Product.objects.create(
+            category=category,
+            title='MacBook',
+            slug='macbook',
+            image='macbook_pro.jpg',
+        )
+        cart = Cart.objects.create(for_anonymous_user=True)
+        CartProduct.objects.create(cart=cart, product=product)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            CartProduct.objects.create(cart=cart, product=product)
+        line, created = CartProduct.objects.get_or_create(
+            cart=cart,
+            product=product,
+        )
+        self.assertFalse(created)
+
+
+# The catalog served by the async views, for AsyncCatalogViewTests.
+urlpatterns = [
+    path('', async_views.base, name='base'),
+    path('products/<str:slug>/', async_views.product_detail,
+         name='product_detail'),
+    path('category/<str:slug>/', async_views.category_detail,
+         name='category_detail'),
+    path('search/', async_views.search, name='search'),
+    path('', include('mainapp.urls')),
+]
+
+
+class AsyncCatalogViewTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        Product.objects.create(
+            category=category,
+            title='Apple MacBook',
+            slug='macbook',
+            image='macbook_pro.jpg',
+        )
+        rebuild_search_index()
+        cls.urls = [
+            reverse('base'),
+            reverse('category_detail', kwargs={'slug': 'notebooks'}),
+            reverse('product_detail', kwargs={'slug': 'macbook'}),
+            reverse('search') + '?q=macbook',
+        ]
+
+    def test_pages_match_sync_views(self):
+        self.client.get(reverse('add_to_cart', kwargs={'slug': 'macbook'}))
+        # Consume the "added to cart" message before comparing pages.
+        self.client.get(reverse('cart'))
+        expected = [self.client.get(url).content for url in self.urls]
+        self.async_client.cookies = self.client.cookies
+
+        @async_to_sync
+        async def get(url):
+            return await self.async_client.get(url)
+
+        with override_settings(ROOT_URLCONF=__name__):
+            for url, content in zip(self.urls, expected):
+                with self.subTest(url=url):
+                    response = get(url)
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.content, content)
+
+    @override_settings(ROOT_URLCONF=__name__)
+    async def test_conditional_get(self):
+        url = self.urls[2]
+        response = await self.async_client.get(url)
+        repeated = await self.async_client.get(
+            url,
+            if_none_match=response['ETag'],
+        )
+        self.assertEqual(repeated.status_code, 304)
+
+
+class CatalogApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(
+            name='Ноутбуки',
+            slug='notebooks',
+        )
+        other = Category.objects.create(name='Смартфоны', slug='phones')
+        feature = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Процессор',
+            feature_filter_name='cpu',
+        )
+        for i in range(5):
+            Product.objects.create(
+                category=cls.category if i < 4 else other,
+                title=f'Товар {i}',
+                slug=f'product-{i}',
+                image='macbook_pro.jpg',
+                price=Decimal(10 * (i % 2) + i),
+            )
+        with cls.captureOnCommitCallbacks(execute=True):
+            ProductFeatures.objects.create(
+                product=Product.objects.get(slug='product-0'),
+                feature=feature,
+                value='M1',
+            )
+
+    def get(self, name, kwargs=None, **params):
+        response = self.client.get(reverse(name, kwargs=kwargs), params)
+        return response.status_code, response.json()
+
+    def walk(self, **params):
+        slugs = []
+        url = reverse('api_products') + '?' + urlencode(params)
+        while url:
+            data = self.client.get(url).json()
+            slugs.extend(item['slug'] for item in data['results'])
+            url = data['next']
+        return slugs
+
+    def test_products_are_paged_by_cursor(self):
+        self.assertEqual(
+            self.walk(limit=2, fields='slug'),
+            ['product-0', 'product-2', 'product-4', 'product-1',
+             'product-3'],
+        )
+        self.assertEqual(
+            self.walk(limit=2, sort='price_desc', category='notebooks'),
+            ['product-3', 'product-1', 'product-2', 'product-0'],
+        )
+        with self.assertNumQueries(1):
+            self.client.get(reverse('api_products'), {'limit': 2})
+
+    def test_field_selection(self):
+        status, data = self.get('api_products', fields='slug,price', limit=1)
+        self.assertEqual(data['results'], [
+            {'slug': 'product-0', 'price': '0.00'},
+        ])
+        status, data = self.get(
+            'api_product',
+            {'slug': 'product-0'},
+            fields='category,image,features',
+        )
+        self.assertEqual(data, {
+            'category': 'notebooks',
+            'image': '/media/macbook_pro.jpg',
+            'features': [{'name': 'Процессор', 'value': 'M1', 'unit': None}],
+        })
+        status, data = self.get('api_products', fields='slug,secret')
+        self.assertEqual(status, 400)
+        self.assertEqual(data['errors']['fields'], ['Unknown field "secret"'])
+
+    def test_categories_and_errors(self):
+        status, data = self.get('api_categories', fields='slug')
+        self.assertEqual(data, {
+            'results': [{'slug': 'notebooks'}, {'slug': 'phones'}],
+            'next': None,
+        })
+        self.assertEqual(
+            self.get('api_product', {'slug': 'missing'})[0],
+            404,
+        )
+        self.assertEqual(self.get('api_products', limit=1000)[0], 400)
+        self.assertEqual(self.get('api_products', sort='random')[0], 400)
+        response = self.client.post(reverse('api_products'))
+        self.assertEqual(response.status_code, 405)
+
+    def test_invalid_cursor(self):
+        cursors = [
+            ('api_products', 'broken'),
+            ('api_products', forge_cursor([10 ** 30, 1])),
+            ('api_products', forge_cursor([{'a': 1}, 1])),
+            ('api_products', forge_cursor([['y'], 1])),
+            ('api_products', forge_cursor(['1', '2', '3'])),
+            ('api_categories', forge_cursor([10 ** 30])),
+            ('api_categories', forge_cursor([{'a': 1}])),
+            ('api_categories', forge_cursor([['y']])),
+        ]
+        for name, cursor in cursors:
+            with self.subTest(name=name, cursor=cursor):
+                status, data = self.get(name, cursor=cursor)
+                self.assertEqual(status, 400)
+                self.assertEqual(
+                    data['errors'],
+                    {'cursor': ['Invalid cursor']},
+                )
+
+
+class SqliteProfileTests(TestCase):
+
+    def open_database(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        database = DatabaseWrapper({
+            **connection.settings_dict,
+            'NAME': os.path.join(directory.name, 'db.sqlite3'),
+        })
+        self.addCleanup(database.close)
+        database.connect()
+        return database
+
+    def pragma(self, database, name):
+        with database.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_production_pragmas(self):
+        with override_settings(
+            SQLITE_PRAGMAS=settings.SQLITE_PRODUCTION_PRAGMAS,
+        ):
+            database = self.open_database()
+        self.assertEqual(self.pragma(database, 'journal_mode'), 'wal')
+        self.assertEqual(self.pragma(database, 'synchronous'), 1)
+        self.assertEqual(self.pragma(database, 'busy_timeout'), 5000)
+        self.assertEqual(self.pragma(database, 'cache_size'), -64000)
+
+    def test_default_profile_keeps_sqlite_defaults(self):
+        with override_settings(SQLITE_PRAGMAS={}):
+            database = self.open_database()
+        self.assertEqual(self.pragma(database, 'journal_mode'), 'delete')
+
+    def test_benchmark_command(self):
+        stdout = io.StringIO()
+        call_command(
+            'benchmark_sqlite',
+            workers=2,
+            seconds=0.2,
+            rows=100,
+            stdout=stdout,
+        )
+        lines = stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith('default: '))
+        self.assertTrue(lines[1].startswith('production: '))
+
+
+class AutocompleteTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(
+            name='Ноутбуки',
+            slug='notebooks',
+        )
+        cls.macbook = Product.objects.create(
+            category=cls.category,
+            title='Apple MacBook Pro',
+            slug='macbook',
+            image='macbook_pro.jpg',
+        )
+
+    def setUp(self):
+        invalidate_autocomplete()
+
+    def titles(self, prefix):
+        response = self.client.get(reverse('autocomplete'), {'q': prefix})
+        return [item['title'] for item in response.json()['results']]
+
+    def test_matches_prefix_of_any_word(self):
+        self.assertEqual(self.titles('app'), ['Apple MacBook Pro'])
+        self.assertEqual(self.titles('MACB'), ['Apple MacBook Pro'])
+        self.assertEqual(self.titles('ноут'), ['Ноутбуки'])
+        self.assertEqual(self.titles('book'), [])
+        self.assertEqual(self.titles(''), [])
+        response = self.client.get(reverse('autocomplete'), {'q': 'ноут'})
+        self.assertEqual(response.json()['results'][0], {
+            'type': 'category',
+            'title': 'Ноутбуки',
+            'url': self.category.get_absolute_url(),
+        })
+
+    def test_lookups_do_not_query_database(self):
+        autocomplete('app')
+        with self.assertNumQueries(0):
+            autocomplete('pro')
+
+    def test_index_follows_changes(self):
+        autocomplete('app')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.macbook.title = 'Apple MacBook Air'
+            self.macbook.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                [item['title'] for item in autocomplete('air')],
+                ['Apple MacBook Air'],
+            )
+            self.assertEqual(autocomplete('pro'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.macbook.delete()
+        self.assertEqual(autocomplete('app'), [])
+
+    def test_unindexed_changes_keep_the_index(self):
+        autocomplete('app')
+        version = get_cache_version(AUTOCOMPLETE_VERSION_KEY)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.macbook.price = Decimal('900.00')
+            self.macbook.save()
+            self.category.save()
+        self.assertEqual(get_cache_version(AUTOCOMPLETE_VERSION_KEY), version)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.macbook.slug = 'macbook-pro'
+            self.macbook.save()
+        self.assertEqual(
+            get_cache_version(AUTOCOMPLETE_VERSION_KEY),
+            version + 1,
+        )
+        self.assertEqual(
+            autocomplete('app')[0]['url'],
+            self.macbook.get_absolute_url(),
+        )
+
+    def test_shared_version_is_checked_periodically(self):
+        autocomplete('app')
+        Product.objects.filter(pk=self.macbook.pk).update(title='Galaxy')
+        # Another process changed the catalog.
+        bump_cache_version(AUTOCOMPLETE_VERSION_KEY)
+        monotonic = time.monotonic()
+        with mock.patch(
+            'mainapp.autocomplete.get_cache_version',
+            wraps=get_cache_version,
+        ) as get_version, self.assertNumQueries(0):
+            for _ in range(100):
+                self.assertEqual(len(autocomplete('app')), 1)
+        self.assertEqual(get_version.call_count, 0)
+        with mock.patch('time.monotonic', return_value=monotonic
+                        + AUTOCOMPLETE_CHECK_INTERVAL):
+            self.assertEqual(autocomplete('app'), [])
+            self.assertEqual(len(autocomplete('gal')), 1)
+
+    def test_lookups_do_not_wait_for_a_rebuild(self):
+        autocomplete('app')
+        with mock.patch('time.monotonic', return_value=time.monotonic()
+                        + AUTOCOMPLETE_CHECK_INTERVAL):
+            with _build_lock, self.assertNumQueries(0):
+                self.assertEqual(len(autocomplete('app')), 1)
+
+    @skipUnless(BENCHMARK_TIMES, 'set BENCHMARK_TIMES=1 to check latency')
+    def test_p99_latency(self):
+        rng = random.Random(0)
+        words = ['apple', 'samsung', 'macbook', 'galaxy', 'pro', 'ultra',
+                 'ноутбук', 'смартфон', 'чехол', 'зарядка']
+        index = PrefixIndex(
+            ('product', pk, ' '.join(rng.choices(words, k=4)), f'p{pk}')
+            for pk in range(100000)
+        )
+        timings = []
+        for _ in range(2000):
+            word = rng.choice(words)
+            prefix = word[:rng.randint(1, len(word))]
+            started = time.perf_counter()
+            index.search(prefix)
+            timings.append(time.perf_counter() - started)
+        timings.sort()
+        p99 = timings[int(len(timings) * 0.99)]
+        self.assertLess(p99, 0.001 * BENCHMARK_TIME_FACTOR)
+
+
+class CategoryNavigationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(name='Ноутбуки', slug='notebooks')
+        Product.objects.create(
+            category=cls.category,
+            title='Товар',
+            slug='product',
+            image='macbook_pro.jpg',
+        )
+
+    def setUp(self):
+        invalidate_category_navigation()
+
+    def navigation(self):
+        response = self.client.get(reverse('login'))
+        return [
+            (category.name, category.product_count)
+            for category in response.context['categories']
+        ]
+
+    def test_navigation_is_cached(self):
+        self.assertEqual(self.navigation(), [('Ноутбуки', 1)])
+        with CaptureQueriesContext(connection) as context:
+            self.navigation()
+        self.assertFalse([
+            query for query in context.captured_queries
+            if 'mainapp_category' in query['sql']
+        ])
+
+    def test_navigation_is_invalidated(self):
+        self.navigation()
+        Category.objects.create(name='Смартфоны', slug='smartphones')
+        self.assertEqual(
+            self.navigation(),
+            [('Ноутбуки', 1), ('Смартфоны', 0)],
+        )
+        Product.objects.create(
+            category=self.category,
+            title='Товар 2',
+            slug='product-2',
+            image='macbook_pro.jpg',
+        )
+        self.assertEqual(
+            self.navigation(),
+            [('Ноутбуки', 2), ('Смартфоны', 0)],
+        )
+        self.category.delete()
+        self.assertEqual(self.navigation(), [('Смартфоны', 0)])
+
+    def test_product_edits_keep_navigation(self):
+        self.navigation()
+        product = Product.objects.get(slug='product')
+        product.price = Decimal('10.00')
+        product.save()
+        self.assertIsNotNone(cache.get(CATEGORY_NAVIGATION_KEY))
+        other = Category.objects.create(name='Смартфоны', slug='phones')
+        self.navigation()
+        product.category = other
+        product.save()
+        self.assertEqual(
+            self.navigation(),
+            [('Ноутбуки', 0), ('Смартфоны', 1)],
+        )
+        product.price = Decimal('20.00')
+        product.save()
+        self.assertIsNotNone(cache.get(CATEGORY_NAVIGATION_KEY))
@@ -1,33 +1,61 @@
+from django.conf import settings
 from django.urls import path
 from django.contrib.auth.views import LogoutView
 
+from . import async_views
+from .api import (
+    CategoryListApiView,
+    ProductDetailApiView,
+    ProductListApiView,
+)
 from .views import (
     BaseView,
     ProductDetailView,
     CategoryDetailView,
+    SearchView,
+    AutocompleteView,
     CartView,
     AddToCartView,
     DeleteFromCartView,
     ChangeQTYView,
+    UpdateCartView,
     CheckoutView,
     MakeOrderView,
     LoginView,
     RegistrationView,
     ProfileView,
+    ExportOrdersView,
 )
 
+if settings.ASYNC_CATALOG_VIEWS:
+    base_view = async_views.base
+    product_detail_view = async_views.product_detail
+    category_detail_view = async_views.category_detail
+    search_view = async_views.search
+else:
+    base_view = BaseView.as_view()
+    product_detail_view = ProductDetailView.as_view()
+    category_detail_view = CategoryDetailView.as_view()
+    search_view = SearchView.as_view()
+
 urlpatterns = [
-    path('', BaseView.as_view(), name='base'),
+    path('', base_view, name='base'),
     path(
         'products/<str:slug>/',
-        ProductDetailView.as_view(),
+        product_detail_view,
         name='product_detail'
     ),
     path(
         'category/<str:slug>/',
-        CategoryDetailView.as_view(),
+        category_detail_view,
         name='category_detail'
     ),
+    path('search/', search_view, name='search'),
+    path(
+        'search/autocomplete/',
+        AutocompleteView.as_view(),
+        name='autocomplete'
+    ),
     path('cart/', CartView.as_view(), name='cart'),
     path(
         'add-to-cart/<str:slug>/',
@@ -44,10 +72,31 @@ urlpatterns = [
         ChangeQTYView.as_view(),
         name='change_qty'
     ),
+    path('cart/update/', UpdateCartView.as_view(), name='update_cart'),
     path('checkout/', CheckoutView.as_view(), name='checkout'),
     path('make-order/', MakeOrderView.as_view(), name='make_order'),
     path('login/', LoginView.as_view(), name='login'),
     path('logout/', LogoutView.as_view(next_page='/'), name='logout'),
     path('registration/', RegistrationView.as_view(), name='registration'),
     path('profile/', ProfileView.as_view(), name='profile'),
+    path(
+        'orders/export/',
+        ExportOrdersView.as_view(),
+        name='export_orders'
+    ),
+    path(
+        'api/v1/categories/',
+        CategoryListApiView.as_view(),
+        name='api_categories'
+    ),
+    path(
+        'api/v1/products/',
+        ProductListApiView.as_view(),
+        name='api_products'
+    ),
+    path(
+        'api/v1/products/<str:slug>/',
+        ProductDetailApiView.as_view(),
+        name='api_product'
+    ),
 ]
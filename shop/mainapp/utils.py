@@ -1,4 +1,76 @@
-from django.db import models
+import itertools
+import time
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db import connection, models, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Cart, CartProduct, Category, Customer, OrderProduct
+
+
+CART_SESSION_KEY = 'cart'
+CATEGORY_NAVIGATION_KEY = 'category_navigation'
+PRODUCT_DETAIL_VERSION_KEY = 'product_detail:{}'
+CART_OPERATIONS = ('add', 'set', 'remove')
+MAX_CART_QTY = 9999
+
+
+def max_decimal(model, field_name):
+    field = model._meta.get_field(field_name)
+    return (
+        Decimal(10) ** (field.max_digits - field.decimal_places)
+        - Decimal(10) ** -field.decimal_places
+    )
+
+
+MAX_LINE_PRICE = max_decimal(CartProduct, 'final_price')
+MAX_CART_PRICE = max_decimal(Cart, 'final_price')
+
+
+class CartLimitError(ValueError):
+    pass
+
+
+def valid_line_qty(product, qty):
+    """Whether a line of `qty` items of `product` fits the cart fields."""
+    return 0 <= qty <= MAX_CART_QTY and qty * product.price <= MAX_LINE_PRICE
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def update_many(model, objects, fields):
+    """
+    Saves `fields` of many objects with one UPDATE per row run through
+    executemany(). Unlike bulk_update() it does not build a CASE over the
+    whole batch, which gets slow past a few hundred rows. Sends no
+    signals.
+    """
+    fields = [model._meta.get_field(name) for name in fields]
+    quote_name = connection.ops.quote_name
+    sql = 'UPDATE {} SET {} WHERE {} = %s'.format(
+        quote_name(model._meta.db_table),
+        ', '.join(f'{quote_name(field.column)} = %s' for field in fields),
+        quote_name(model._meta.pk.column),
+    )
+    with connection.cursor() as cursor:
+        cursor.executemany(sql, [
+            [
+                *(field.get_db_prep_save(getattr(obj, field.attname),
+                                         connection)
+                  for field in fields),
+                obj.pk,
+            ]
+            for obj in objects
+        ])
 
 
 def recalc_cart(cart):
@@ -12,3 +84,228 @@ def recalc_cart(cart):
         cart.final_price = 0
     cart.total_products = cart_data['id__count']
     cart.save()
+
+
+def update_cart_totals(cart, lines=0, price=0):
+    Cart.objects.filter(pk=cart.pk).update(
+        total_products=F('total_products') + lines,
+        final_price=F('final_price') + price,
+        updated_at=timezone.now(),
+    )
+
+
+@transaction.atomic
+def apply_cart_operations(cart, operations):
+    """
+    Applies a batch of (operation, product, qty) tuples to the cart, where
+    operation is one of CART_OPERATIONS, with a fixed number of queries.
+    Raises CartLimitError, before writing anything, when a line or the
+    cart total would not fit its column.
+    """
+    existing = {
+        line.product_id: line
+        for line in CartProduct.objects.select_for_update().filter(
+            cart=cart,
+            product_id__in={product.pk for _, product, _ in operations},
+        )
+    }
+    old_lines = {
+        product_id: (line.qty, line.final_price)
+        for product_id, line in existing.items()
+    }
+    lines = dict(existing)
+    for number, (operation, product, qty) in enumerate(operations, 1):
+        line = lines.get(product.pk)
+        if operation == 'add' and line:
+            qty += line.qty
+        if operation == 'remove' or qty <= 0:
+            lines.pop(product.pk, None)
+            continue
+        if not valid_line_qty(product, qty):
+            raise CartLimitError(f'Операция {number}: неверное кол-во')
+        if not line:
+            line = existing.get(product.pk) or CartProduct(
+                user_id=cart.owner_id,
+                cart=cart,
+                product=product,
+            )
+            lines[product.pk] = line
+        line.qty = qty
+        line.final_price = qty * product.price
+
+    created = [line for line in lines.values() if line.pk is None]
+    changed = [
+        line for line in lines.values()
+        if line.pk and (line.qty, line.final_price) != old_lines[line.product_id]
+    ]
+    removed = set(old_lines) - set(lines)
+    price_delta = (
+        sum(line.final_price for line in lines.values())
+        - sum(price for _, price in old_lines.values())
+    )
+    if cart.final_price + price_delta > MAX_CART_PRICE:
+        raise CartLimitError('Сумма корзины слишком велика')
+    if created:
+        CartProduct.objects.bulk_create(created)
+        Cart.products.through.objects.bulk_create([
+            Cart.products.through(cart_id=cart.pk, cartproduct_id=pk)
+            for pk in CartProduct.objects.filter(
+                cart=cart,
+                product_id__in=[line.product_id for line in created],
+            ).values_list('pk', flat=True)
+        ])
+    if changed:
+        CartProduct.objects.bulk_update(changed, ['qty', 'final_price'])
+    if removed:
+        CartProduct.objects.filter(cart=cart, product_id__in=removed).delete()
+    update_cart_totals(cart, len(created) - len(removed), price_delta)
+    cart.refresh_from_db(fields=['total_products', 'final_price'])
+    return lines
+
+
+def get_cart_items(cart):
+    if not cart:
+        return []
+    return list(
+        CartProduct.objects.filter(cart=cart).select_related('product').only(
+            'qty',
+            'final_price',
+            'product',
+            'product__title',
+            'product__slug',
+            'product__image',
+            'product__price',
+        ).order_by('pk')
+    )
+
+
+def create_order_products(order, items):
+    return OrderProduct.objects.bulk_create([
+        OrderProduct(
+            order=order,
+            product=item.product,
+            title=item.product.title,
+            image=item.product.image.name,
+            price=item.product.price,
+            qty=item.qty,
+            final_price=item.final_price,
+        )
+        for item in items
+    ])
+
+
+def get_or_create_customer(user):
+    customer = Customer.objects.filter(user=user).first()
+    if not customer:
+        customer = Customer.objects.create(user=user)
+    return customer
+
+
+def get_or_create_open_cart(customer):
+    cart = Cart.objects.filter(owner=customer, in_order=False).first()
+    if not cart:
+        cart = Cart.objects.create(owner=customer)
+    return cart
+
+
+@transaction.atomic
+def merge_carts(source, target):
+    source_lines = list(
+        CartProduct.objects.filter(cart=source).select_related('product')
+    )
+    target_lines = {
+        line.product_id: line
+        for line in CartProduct.objects.filter(
+            cart=target,
+            product_id__in=[line.product_id for line in source_lines],
+        ).select_related('product')
+    }
+    merged = []
+    moved = []
+    for line in source_lines:
+        existing = target_lines.get(line.product_id)
+        if existing:
+            existing.qty += line.qty
+            existing.final_price = existing.qty * existing.product.price
+            merged.append(existing)
+        else:
+            moved.append(line.pk)
+    CartProduct.objects.bulk_update(merged, ['qty', 'final_price'])
+    CartProduct.objects.filter(pk__in=moved).update(
+        cart=target,
+        user_id=target.owner_id,
+    )
+    Cart.products.through.objects.filter(
+        cart=source,
+        cartproduct_id__in=moved,
+    ).update(cart=target)
+    source.delete()
+    recalc_cart(target)
+
+
+def get_pinned_cart(session, user):
+    pinned = session.get(CART_SESSION_KEY) or {}
+    if pinned.get('user') != user.pk:
+        return {}
+    return pinned
+
+
+def pin_cart(session, user, cart):
+    session[CART_SESSION_KEY] = {
+        'user': user.pk,
+        'customer': cart.owner_id,
+        'cart': cart.pk,
+    }
+
+
+def unpin_cart(session):
+    pinned = session.get(CART_SESSION_KEY)
+    if pinned and 'cart' in pinned:
+        session[CART_SESSION_KEY] = {
+            key: value for key, value in pinned.items() if key != 'cart'
+        }
+
+
+def get_category_navigation():
+    categories = cache.get(CATEGORY_NAVIGATION_KEY)
+    if categories is None:
+        categories = list(
+            Category.objects.annotate(
+                product_count=models.Count('product'),
+            ).order_by('name')
+        )
+        cache.set(CATEGORY_NAVIGATION_KEY, categories, None)
+    return categories
+
+
+def invalidate_category_navigation():
+    cache.delete(CATEGORY_NAVIGATION_KEY)
+
+
+def invalidate_product_detail(product_id):
+    bump_cache_version(PRODUCT_DETAIL_VERSION_KEY.format(product_id))
+
+
+def get_cache_version(name):
+    """
+    Returns the current version of a cached structure. Versions start
+    from the clock so a counter lost from the cache never repeats.
+    """
+    version = cache.get(name)
+    if version is None:
+        cache.add(name, time.time_ns(), None)
+        version = cache.get(name)
+    return version
+
+
+def bump_cache_version(name):
+    try:
+        cache.incr(name)
+    except ValueError:
+        cache.set(name, time.time_ns(), None)
+
+
+def set_sqlite_pragmas(connection, pragmas):
+    """Applies {name: value} PRAGMAs to a raw sqlite3 connection."""
+    for name, value in pragmas.items():
+        connection.execute(f'PRAGMA {name} = {value}')
@@ -1,9 +1,26 @@
+import json
+
+from django.core.paginator import Paginator
 from django.db import transaction
 from django.shortcuts import render
 from django.views.generic import DetailView, View
-from django.http import HttpResponseRedirect
+from django.http import (
+    FileResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+)
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils.decorators import method_decorator
+
+from specs.facets import (
+    FACET_VERSION_KEY,
+    PRICE_MAX_PARAM,
+    PRICE_MIN_PARAM,
+    get_facet_index,
+)
+from specs.utils import PRODUCT_SPEC_VERSION_KEY
 
 from .models import (
     Product,
@@ -12,107 +29,348 @@ from .models import (
     Customer,
     Order,
 )
-from .mixins import CartMixin
-from .form import OrderForm, LoginForm, RegistrationForm
-from .utils import recalc_cart
+from .autocomplete import autocomplete
+from .images import IMAGE_VARIANTS_VERSION_KEY
+from .mixins import CartMixin, ConditionalGetMixin
+from .pagination import keyset_paginate
+from .search import search_products
+from .exports import filter_orders, spool_export
+from .form import OrderForm, LoginForm, RegistrationForm, OrderExportForm
+from .utils import (
+    CART_OPERATIONS,
+    PRODUCT_DETAIL_VERSION_KEY,
+    CartLimitError,
+    apply_cart_operations,
+    create_order_products,
+    get_cache_version,
+    get_cart_items,
+    unpin_cart,
+    update_cart_totals,
+    valid_line_qty,
+)
 
 
 class BaseView(CartMixin, View):
+    paginate_by = 24
+    orderings = {
+        'new': ('-pk',),
+        'price_asc': ('price', 'pk'),
+        'price_desc': ('-price', '-pk'),
+    }
 
     def get(self, request, *args, **kwargs):
-        categories = Category.objects.all()
-        products = Product.objects.all()
+        sort = request.GET.get('sort')
+        if sort not in self.orderings:
+            sort = 'new'
+        products = keyset_paginate(
+            Product.objects.only('title', 'slug', 'image', 'price'),
+            self.orderings[sort],
+            request.GET.get('after'),
+            self.paginate_by,
+        )
         context = {
-            'categories': categories,
             'products': products,
+            'sort': sort,
             'cart': self.cart
         }
         return render(request, 'base.html', context)
 
 
-class ProductDetailView(CartMixin, DetailView):
-
+class ProductDetailView(ConditionalGetMixin, CartMixin, DetailView):
+    model = Product
+    queryset = Product.objects.select_related('category')
     context_object_name = 'product'
     template_name = 'product_detail.html'
     slug_url_kwarg = 'slug'
 
+    def get_versions(self):
+        # The product body is a cached fragment keyed by these versions:
+        # saving the product or its features bumps the first, editing
+        # the category's feature definitions the second.
+        return (
+            get_cache_version(
+                PRODUCT_DETAIL_VERSION_KEY.format(self.object.pk)
+            ),
+            get_cache_version(
+                PRODUCT_SPEC_VERSION_KEY.format(self.object.category_id)
+            ),
+        )
+
+    def get_etag_parts(self):
+        product = self.object
+        return [
+            product.pk,
+            *self.get_versions(),
+            product.updated_at,
+            product.category.updated_at,
+            get_cache_version(IMAGE_VARIANTS_VERSION_KEY),
+        ]
+
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['cart'] = self.cart
+        context['product_version'], context['spec_version'] = (
+            self.get_versions()
+        )
         return context
 
 
-class CategoryDetailView(CartMixin, DetailView):
+class CategoryDetailView(ConditionalGetMixin, CartMixin, DetailView):
     model = Category
     queryset = Category.objects.all()
     context_object_name = 'category'
     template_name = 'category_detail.html'
     slug_url_kwarg = 'slug'
+    paginate_by = 24
+    sorts = ('price_asc', 'price_desc')
+
+    def get_etag_parts(self):
+        # The facet index version moves with every product, feature value
+        # or feature definition change in the category.
+        return [
+            self.object.pk,
+            self.object.updated_at,
+            get_cache_version(FACET_VERSION_KEY.format(self.object.pk)),
+            get_cache_version(IMAGE_VARIANTS_VERSION_KEY),
+        ]
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
+        params = self.request.GET
+        sort = params.get('sort')
+        if sort not in self.sorts:
+            sort = self.sorts[0]
+        result = get_facet_index(self.object).search(
+            params,
+            descending=sort == 'price_desc',
+        )
+        page = Paginator(result, self.paginate_by).get_page(params.get('page'))
+        products = Product.objects.only(
+            'title', 'slug', 'image', 'price', 'features',
+        ).in_bulk(page.object_list)
+        filter_query = params.copy()
+        filter_query.pop('page', None)
+        filter_query.pop('sort', None)
+        context['category_products'] = [
+            products[pk] for pk in page.object_list if pk in products
+        ]
+        context['page_obj'] = page
+        context['facets'] = result.facets
+        context['price_min'] = params.get(PRICE_MIN_PARAM, '')
+        context['price_max'] = params.get(PRICE_MAX_PARAM, '')
+        context['sort'] = sort
+        context['filter_query'] = filter_query.urlencode()
         context['cart'] = self.cart
         return context
 
 
+class SearchView(CartMixin, View):
+    paginate_by = 24
+
+    def get(self, request, *args, **kwargs):
+        query = request.GET.get('q', '').strip()
+        page = Paginator(search_products(query), self.paginate_by).get_page(
+            request.GET.get('page')
+        )
+        products = Product.objects.only(
+            'title', 'slug', 'image', 'price',
+        ).in_bulk(page.object_list)
+        context = {
+            'query': query,
+            'page_obj': page,
+            'products': [
+                products[pk] for pk in page.object_list if pk in products
+            ],
+            'cart': self.cart,
+        }
+        return render(request, 'search.html', context)
+
+
+class AutocompleteView(View):
+
+    def get(self, request, *args, **kwargs):
+        return JsonResponse({
+            'results': autocomplete(request.GET.get('q', '')),
+        })
+
+
 class AddToCartView(CartMixin, View):
 
+    @transaction.atomic
     def get(self, request, *args, **kwargs):
         product_slug = kwargs.get('slug')
         product = Product.objects.get(slug=product_slug)
+        cart = self.get_or_create_cart()
         cart_product, created = CartProduct.objects.get_or_create(
-            user=self.cart.owner,
-            cart=self.cart,
+            user_id=cart.owner_id,
+            cart=cart,
             product=product,
         )
         if created:
-            self.cart.products.add(cart_product)
-        recalc_cart(self.cart)
+            cart.products.add(cart_product)
+            update_cart_totals(cart, 1, cart_product.final_price)
         messages.add_message(request, messages.INFO, 'Товар успешно добавлен')
         return HttpResponseRedirect('/cart/')
 
 
 class DeleteFromCartView(CartMixin, View):
 
+    @transaction.atomic
     def get(self, request, *args, **kwargs):
+        if not self.cart:
+            return HttpResponseRedirect('/cart/')
         product_slug = kwargs.get('slug')
         product = Product.objects.get(slug=product_slug)
         cart_product = CartProduct.objects.get(
-            user=self.cart.owner,
+            user_id=self.cart.owner_id,
             cart=self.cart,
             product=product,
         )
         cart_product.delete()
-        recalc_cart(self.cart)
+        update_cart_totals(self.cart, -1, -cart_product.final_price)
         messages.add_message(request, messages.INFO, 'Товар успешно удален')
         return HttpResponseRedirect('/cart/')
 
 
 class ChangeQTYView(CartMixin, View):
 
+    @transaction.atomic
     def post(self, request, *args, **kwargs):
+        if not self.cart:
+            return HttpResponseRedirect('/cart/')
         product_slug = kwargs.get('slug')
         product = Product.objects.get(slug=product_slug)
-        cart_product = CartProduct.objects.get(
-            user=self.cart.owner,
+        cart_product = CartProduct.objects.select_for_update().get(
+            user_id=self.cart.owner_id,
             cart=self.cart,
             product=product,
         )
         qty = int(request.POST.get('qty'))
-        cart_product.qty = qty
-        cart_product.save()
-        recalc_cart(self.cart)
+        final_price = qty * product.price
+        CartProduct.objects.filter(pk=cart_product.pk).update(
+            qty=qty,
+            final_price=final_price,
+        )
+        update_cart_totals(
+            self.cart,
+            price=final_price - cart_product.final_price,
+        )
         messages.add_message(request, messages.INFO, 'Кол-во успешно изменено')
         return HttpResponseRedirect('/cart/')
 
 
+class UpdateCartView(CartMixin, View):
+    """
+    Applies several line operations in one request. Accepts a JSON body
+    {"operations": [{"op": "set", "slug": "...", "qty": 2}, ...]} and
+    answers with the new totals, or the cart form with qty-<slug> fields.
+    """
+
+    def get_operations(self, request):
+        if request.content_type != 'application/json':
+            return [
+                {'op': 'set', 'slug': key[len('qty-'):], 'qty': value}
+                for key, value in request.POST.items()
+                if key.startswith('qty-')
+            ]
+        try:
+            operations = json.loads(request.body)['operations']
+        except (ValueError, TypeError, KeyError):
+            return None
+        if not isinstance(operations, list):
+            return None
+        return operations
+
+    def clean_operations(self, operations):
+        products = Product.objects.only('id', 'slug', 'price').in_bulk(
+            {
+                operation.get('slug') for operation in operations
+                if isinstance(operation, dict)
+                and isinstance(operation.get('slug'), str)
+            },
+            field_name='slug',
+        )
+        cleaned = []
+        errors = []
+        for number, operation in enumerate(operations, 1):
+            if not isinstance(operation, dict):
+                errors.append(f'Операция {number}: неверный формат')
+                continue
+            op = operation.get('op')
+            slug = operation.get('slug')
+            product = products.get(slug) if isinstance(slug, str) else None
+            try:
+                qty = int(operation.get('qty', 1))
+            except (TypeError, ValueError, OverflowError):
+                qty = -1
+            if op not in CART_OPERATIONS:
+                errors.append(f'Операция {number}: неизвестная операция')
+            elif not isinstance(slug, str):
+                errors.append(f'Операция {number}: неверный товар')
+            elif product is None:
+                errors.append(f'Операция {number}: товар не найден')
+            elif not valid_line_qty(product, qty):
+                errors.append(f'Операция {number}: неверное кол-во')
+            else:
+                cleaned.append((op, product, qty))
+        return cleaned, errors
+
+    def errors_response(self, request, errors, is_json):
+        if is_json:
+            return JsonResponse({'errors': errors}, status=400)
+        for error in errors:
+            messages.add_message(request, messages.ERROR, error)
+        return HttpResponseRedirect('/cart/')
+
+    @transaction.atomic
+    def post(self, request, *args, **kwargs):
+        is_json = request.content_type == 'application/json'
+        operations = self.get_operations(request)
+        if operations is None:
+            errors = ['Неверный формат запроса']
+        else:
+            operations, errors = self.clean_operations(operations)
+        if errors:
+            return self.errors_response(request, errors, is_json)
+
+        lines = {}
+        adds = any(op != 'remove' and qty for op, _, qty in operations)
+        cart = self.get_or_create_cart() if adds else self.cart
+        if cart:
+            try:
+                lines = apply_cart_operations(cart, operations)
+            except CartLimitError as error:
+                errors = [str(error)]
+        if errors:
+            return self.errors_response(request, errors, is_json)
+        if not is_json:
+            messages.add_message(
+                request,
+                messages.INFO,
+                'Корзина успешно обновлена',
+            )
+            return HttpResponseRedirect('/cart/')
+        slugs = {product.pk: product.slug for _, product, _ in operations}
+        return JsonResponse({
+            'total_products': cart.total_products if cart else 0,
+            'final_price': str(cart.final_price if cart else 0),
+            'lines': [
+                {
+                    'slug': slugs[product_id],
+                    'qty': line.qty,
+                    'final_price': str(line.final_price),
+                }
+                for product_id, line in lines.items()
+            ],
+        })
+
+
 class CartView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
-        categories = Category.objects.all()
         context = {
             'cart': self.cart,
-            'categories': categories,
+            'cart_items': get_cart_items(self.cart),
         }
         return render(request, 'cart.html', context)
 
@@ -120,11 +378,10 @@ class CartView(CartMixin, View):
 class CheckoutView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
-        categories = Category.objects.all()
         form = OrderForm(request.POST or None)
         context = {
             'cart': self.cart,
-            'categories': categories,
+            'cart_items': get_cart_items(self.cart),
             'form': form,
         }
         return render(request, 'checkout.html', context)
@@ -135,7 +392,7 @@ class MakeOrderView(CartMixin, View):
     @transaction.atomic
     def post(self, request, *args, **kwargs):
         form = OrderForm(request.POST or None)
-        customer = Customer.objects.get(user=request.user)
+        customer = self.customer
         if form.is_valid():
             new_order = form.save(commit=False)
             new_order.customer = customer
@@ -146,12 +403,16 @@ class MakeOrderView(CartMixin, View):
             new_order.buying_type = form.cleaned_data['buying_type']
             new_order.order_data = form.cleaned_data['order_data']
             new_order.comment = form.cleaned_data['comment']
-            new_order.save()
-            self.cart.in_order = True
-            self.cart.save()
+            items = get_cart_items(self.cart)
             new_order.cart = self.cart
+            new_order.total_products = len(items)
+            new_order.final_price = sum(item.final_price for item in items)
             new_order.save()
+            create_order_products(new_order, items)
+            self.cart.in_order = True
+            self.cart.save(update_fields=['in_order', 'updated_at'])
             customer.orders.add(new_order)
+            unpin_cart(request.session)
             messages.add_message(request, messages.INFO, 'Спасибо за заказ!')
             return HttpResponseRedirect('/')
         return HttpResponseRedirect('/checkout/')
@@ -161,10 +422,8 @@ class LoginView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
         form = LoginForm(request.POST or None)
-        categories = Category.objects.all()
         context = {
             'form': form,
-            'categories': categories,
             'cart': self.cart,
         }
         return render(request, 'login.html', context)
@@ -192,10 +451,8 @@ class RegistrationView(CartMixin, View):
 
     def get(self, request, *args, **kwargs):
         form = RegistrationForm(request.POST or None)
-        categories = Category.objects.all()
         context = {
             'form': form,
-            'categories': categories,
             'cart': self.cart,
         }
         return render(request, 'registration.html', context)
@@ -230,16 +487,42 @@ class RegistrationView(CartMixin, View):
 
 
 class ProfileView(CartMixin, View):
+    paginate_by = 10
 
     def get(self, request, *args, **kwargs):
-        customer = Customer.objects.get(user=request.user)
         orders = Order.objects.filter(
-            customer=customer
-        ).order_by('-created_at')
-        categories = Category.objects.all()
+            customer=self.customer
+        ).prefetch_related('related_products').order_by('-created_at', '-pk')
+        page = Paginator(orders, self.paginate_by).get_page(
+            request.GET.get('page')
+        )
         context = {
-            'orders': orders,
-            'categories': categories,
+            'orders': page,
             'cart': self.cart,
         }
         return render(request, 'profile.html', context)
+
+
+@method_decorator(staff_member_required, name='dispatch')
+class ExportOrdersView(View):
+    content_types = {
+        'csv': 'text/csv; charset=utf-8',
+        'jsonl': 'application/x-ndjson; charset=utf-8',
+    }
+
+    def get(self, request, *args, **kwargs):
+        form = OrderExportForm(request.GET)
+        if not form.is_valid():
+            return JsonResponse({'errors': form.errors}, status=400)
+        export_format = form.cleaned_data['format']
+        orders = filter_orders(
+            form.cleaned_data['date_from'],
+            form.cleaned_data['date_to'],
+            form.cleaned_data['status'],
+        )
+        return FileResponse(
+            spool_export(orders, export_format),
+            as_attachment=True,
+            filename=f'orders.{export_format}',
+            content_type=self.content_types[export_format],
+        )
@@ -0,0 +1,17 @@
+"""
+ASGI config for shop project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+Set SHOP_ASYNC_VIEWS=1 to serve the catalog pages through async views.
+
+For more information on this file, see
+https://docs.djangoproject.com/en/3.2/howto/deployment/asgi/
+"""
+
+import os
+
+from django.core.asgi import get_asgi_application
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'shop.settings')
+
+application = get_asgi_application()
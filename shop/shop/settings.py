@@ -65,6 +65,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'mainapp.context_processors.categories',
             ],
         },
     },
@@ -72,6 +73,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'shop.wsgi.application'
 
+# Serve the read-only catalog pages through async views; meant for
+# deployments running shop.asgi under an ASGI server.
+ASYNC_CATALOG_VIEWS = os.environ.get('SHOP_ASYNC_VIEWS') == '1'
+
 
 # Database
 # https://docs.djangoproject.com/en/2.2/ref/settings/#databases
@@ -83,6 +88,38 @@ DATABASES = {
     }
 }
 
+# Set SHOP_DB_PROFILE=production to keep connections open between
+# requests and tune SQLite for concurrent readers and writers: WAL lets
+# readers run alongside the writer, and synchronous=NORMAL is still
+# crash safe in WAL mode. Pragmas are applied to every new connection.
+DB_PROFILE = os.environ.get('SHOP_DB_PROFILE', 'development')
+
+SQLITE_PRODUCTION_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64000,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
+}
+
+if DB_PROFILE == 'production':
+    DATABASES['default']['CONN_MAX_AGE'] = 600
+    SQLITE_PRAGMAS = SQLITE_PRODUCTION_PRAGMAS
+else:
+    SQLITE_PRAGMAS = {}
+
+
+# Cache
+# Catalog caches are invalidated by signals, so deployments with several
+# worker processes need a shared backend (Memcached, Redis).
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.2/ref/settings/#auth-password-validators
@@ -131,3 +168,7 @@ STATICFILES_DIRS = (
 )
 
 CRISPY_TEMPLATE_PACK = 'bootstrap4'
+
+# Guest carts untouched for longer than this are removed
+# by the clear_anonymous_carts command.
+ANONYMOUS_CART_AGE = 60 * 60 * 24 * 14
@@ -1,7 +1,19 @@
 from django.contrib import admin
 
+from .forms import ProductFeaturesForm, ProductFeaturesFormSet
 from .models import *
 
+
+class ProductFeaturesInline(admin.TabularInline):
+    model = ProductFeatures
+    formset = ProductFeaturesFormSet
+    extra = 0
+
+
+class ProductFeaturesAdmin(admin.ModelAdmin):
+    form = ProductFeaturesForm
+
+
 admin.site.register(CategoryFeature)
-admin.site.register(ProductFeatures)
+admin.site.register(ProductFeatures, ProductFeaturesAdmin)
 admin.site.register(FeatureValidator)
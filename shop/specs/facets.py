@@ -0,0 +1,192 @@
+import bisect
+from decimal import Decimal, InvalidOperation
+
+
+from mainapp.models import Product
+from mainapp.utils import bump_cache_version, get_cache_version
+
+from .models import CategoryFeature, ProductFeatures
+
+
+FACET_VERSION_KEY = 'facets:{}'
+PRICE_MIN_PARAM = 'price_min'
+PRICE_MAX_PARAM = 'price_max'
+
+# Built indexes are kept per process and rebuilt once the shared
+# version of their category moves on.
+_indexes = {}
+
+
+def popcount(mask):
+    return bin(mask).count('1')
+
+
+def parse_price(value):
+    try:
+        price = Decimal(value)
+    except (InvalidOperation, TypeError, ValueError):
+        return None
+    return price if price.is_finite() else None
+
+
+class FacetResult:
+    """
+    Products matching a filter, as a sequence of product ids ordered by
+    price, plus the facet counts to render next to every value.
+    """
+
+    def __init__(self, index, mask, facets, descending=False):
+        self.index = index
+        self.mask = mask
+        self.facets = facets
+        self.descending = descending
+        self.count = popcount(mask)
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            raise TypeError('FacetResult supports slicing only.')
+        start, stop, _ = item.indices(self.count)
+        if self.descending:
+            start, stop = self.count - stop, self.count - start
+        positions = self.index.positions(self.mask, start, stop - start)
+        pks = [self.index.pks[position] for position in positions]
+        return pks[::-1] if self.descending else pks
+
+
+class FacetIndex:
+    """
+    Per-category bitmap index. Products are numbered by (price, pk), so
+    every feature value is an int bitmask over those positions and a
+    price range is a contiguous run of bits; filtering and counting are
+    then a few big-int operations instead of one join per feature.
+    """
+
+    def __init__(self, products, features, product_features):
+        self.pks = []
+        self.prices = []
+        positions = {}
+        for position, (pk, price) in enumerate(products):
+            self.pks.append(pk)
+            self.prices.append(price)
+            positions[pk] = position
+        self.features = {
+            filter_name: {'name': name, 'unit': unit, 'values': {}}
+            for filter_name, name, unit in features
+        }
+        size = (len(self.pks) + 7) // 8
+        bitmaps = {}
+        for product_pk, filter_name, value in product_features:
+            position = positions.get(product_pk)
+            if position is None or filter_name not in self.features:
+                continue
+            bitmap = bitmaps.get((filter_name, value))
+            if bitmap is None:
+                bitmap = bitmaps[filter_name, value] = bytearray(size)
+            bitmap[position >> 3] |= 1 << (position & 7)
+        for (filter_name, value), bitmap in bitmaps.items():
+            self.features[filter_name]['values'][value] = int.from_bytes(
+                bitmap,
+                'little',
+            )
+
+    @classmethod
+    def build(cls, category):
+        products = Product.objects.filter(
+            category=category,
+        ).order_by('price', 'pk').values_list('pk', 'price')
+        features = CategoryFeature.objects.filter(
+            category=category,
+        ).order_by('pk').values_list(
+            'feature_filter_name',
+            'feature_name',
+            'unit',
+        )
+        product_features = ProductFeatures.objects.filter(
+            feature__category=category,
+        ).values_list('product_id', 'feature__feature_filter_name', 'value')
+        return cls(products, features, product_features.iterator())
+
+    def price_mask(self, price_min=None, price_max=None):
+        low, high = 0, len(self.prices)
+        if price_min is not None:
+            low = bisect.bisect_left(self.prices, price_min)
+        if price_max is not None:
+            high = bisect.bisect_right(self.prices, price_max)
+        if low >= high:
+            return 0
+        return (1 << high) - (1 << low)
+
+    def positions(self, mask, start, count):
+        bits = format(mask, 'b')[::-1]
+        found = []
+        position = bits.find('1')
+        while position != -1 and len(found) < count:
+            if start:
+                start -= 1
+            else:
+                found.append(position)
+            position = bits.find('1', position + 1)
+        return found
+
+    def search(self, params, descending=False):
+        """
+        Applies the filters in `params` (a QueryDict): values of one
+        feature are combined with OR, features and the price range with
+        AND. Each facet is counted against every filter but its own, so
+        a selected value never hides its alternatives.
+        """
+        base = self.price_mask(
+            parse_price(params.get(PRICE_MIN_PARAM)),
+            parse_price(params.get(PRICE_MAX_PARAM)),
+        )
+        selected = {}
+        masks = {}
+        for filter_name, feature in self.features.items():
+            values = params.getlist(filter_name)
+            if not values:
+                continue
+            selected[filter_name] = set(values)
+            mask = 0
+            for value in values:
+                mask |= feature['values'].get(value, 0)
+            masks[filter_name] = mask
+        result = base
+        for mask in masks.values():
+            result &= mask
+        facets = []
+        for filter_name, feature in self.features.items():
+            others = base
+            for other_name, mask in masks.items():
+                if other_name != filter_name:
+                    others &= mask
+            facets.append({
+                'filter_name': filter_name,
+                'name': feature['name'],
+                'unit': feature['unit'],
+                'values': [
+                    {
+                        'value': value,
+                        'count': popcount(others & mask),
+                        'selected': value in selected.get(filter_name, ()),
+                    }
+                    for value, mask in sorted(feature['values'].items())
+                ],
+            })
+        return FacetResult(self, result, facets, descending)
+
+
+def get_facet_index(category):
+    version = get_cache_version(FACET_VERSION_KEY.format(category.pk))
+    cached = _indexes.get(category.pk)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    index = FacetIndex.build(category)
+    _indexes[category.pk] = (version, index)
+    return index
+
+
+def invalidate_facet_index(category_id):
+    bump_cache_version(FACET_VERSION_KEY.format(category_id))
@@ -2,9 +2,51 @@ from django import forms
 
 from mainapp.models import Category
 
+from .models import ProductFeatures
+from .validation import validate_product_features
+
 
 class NewCategoryForm(forms.Form):
 
     class Meta:
         model = Category
         fields = '__all__'
+
+
+class ProductFeaturesForm(forms.ModelForm):
+
+    class Meta:
+        model = ProductFeatures
+        fields = '__all__'
+
+    def clean(self):
+        cleaned_data = super().clean()
+        if not self.errors:
+            errors = validate_product_features([ProductFeatures(
+                product=cleaned_data['product'],
+                feature=cleaned_data['feature'],
+                value=cleaned_data['value'],
+            )])
+            if errors:
+                self.add_error('value', errors[0])
+        return cleaned_data
+
+
+class ProductFeaturesFormSet(forms.BaseInlineFormSet):
+    """
+    Validates the features of a product with one batch check instead of
+    one per form.
+    """
+
+    def clean(self):
+        super().clean()
+        forms_to_check = [
+            form for form in self.forms
+            if form.is_valid() and form.has_changed()
+            and not self._should_delete_form(form)
+        ]
+        errors = validate_product_features(
+            form.instance for form in forms_to_check
+        )
+        for number, error in errors.items():
+            forms_to_check[number].add_error('value', error)
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from mainapp.models import Product
+from specs.utils import refresh_feature_documents
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuilds the denormalized Product.features documents of the whole '
+        'catalog from ProductFeatures.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        started = time.perf_counter()
+        last_pk = 0
+        rebuilt = 0
+        while True:
+            pks = list(
+                Product.objects.filter(pk__gt=last_pk).order_by(
+                    'pk',
+                ).values_list('pk', flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            with transaction.atomic():
+                refresh_feature_documents(pks, batch_size)
+            rebuilt += len(pks)
+            last_pk = pks[-1]
+        if options['verbosity']:
+            self.stdout.write(
+                f'Rebuilt {rebuilt} products '
+                f'in {time.perf_counter() - started:.1f}s'
+            )
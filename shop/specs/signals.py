@@ -0,0 +1,74 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from mainapp.models import Product
+
+from .facets import invalidate_facet_index
+from .models import CategoryFeature, FeatureValidator, ProductFeatures
+from .utils import (
+    invalidate_category_specs,
+    refresh_feature_documents,
+    schedule_feature_refresh,
+)
+from .validation import invalidate_validator_index
+
+
+@receiver(pre_save, sender=Product)
+def reset_previous_product_facets(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    previous = Product.objects.filter(pk=instance.pk).values_list(
+        'category_id',
+        flat=True,
+    ).first()
+    if previous is not None and previous != instance.category_id:
+        invalidate_facet_index(previous)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=CategoryFeature)
+@receiver(post_delete, sender=CategoryFeature)
+def reset_category_facets(sender, instance, **kwargs):
+    invalidate_facet_index(instance.category_id)
+
+
+@receiver(post_save, sender=ProductFeatures)
+@receiver(post_delete, sender=ProductFeatures)
+def reset_product_feature_facets(sender, instance, **kwargs):
+    category_id = CategoryFeature.objects.filter(
+        pk=instance.feature_id,
+    ).values_list('category_id', flat=True).first()
+    if category_id is not None:
+        invalidate_facet_index(category_id)
+
+
+@receiver(post_save, sender=ProductFeatures)
+@receiver(post_delete, sender=ProductFeatures)
+def refresh_product_feature_document(sender, instance, **kwargs):
+    schedule_feature_refresh(instance.product_id)
+
+
+@receiver(post_save, sender=CategoryFeature)
+@receiver(post_delete, sender=CategoryFeature)
+def reset_category_specs(sender, instance, **kwargs):
+    invalidate_category_specs(instance.category_id)
+
+
+@receiver(post_save, sender=CategoryFeature)
+def refresh_category_feature_documents(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    refresh_feature_documents(
+        ProductFeatures.objects.filter(
+            feature=instance,
+        ).values_list('product_id', flat=True).distinct()
+    )
+
+
+@receiver(post_save, sender=FeatureValidator)
+@receiver(post_delete, sender=FeatureValidator)
+@receiver(post_save, sender=CategoryFeature)
+@receiver(post_delete, sender=CategoryFeature)
+def reset_feature_validators(sender, instance, **kwargs):
+    invalidate_validator_index(instance.category_id)
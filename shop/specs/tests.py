@@ -1,3 +1,499 @@
+from decimal import Decimal
+from unittest import mock
+
+from django.core.management import call_command
+from django.db import connection
+from django.forms import inlineformset_factory
+from django.template import Context, Template
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from mainapp.models import Category, Product
+
+from .facets import invalidate_facet_index
+from .forms import ProductFeaturesForm, ProductFeaturesFormSet
+from .models import CategoryFeature, FeatureValidator, ProductFeatures
+from .utils import invalidate_product_spec, refresh_feature_documents
+from .validation import invalidate_validator_index, validate_product_features
+
+
+BRANDS = ('Apple', 'Samsung', 'Xiaomi')
+MEMORY = ('64', '128')
+
+
+class FacetFilterTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(
+            name='Смартфоны',
+            slug='phones',
+        )
+        cls.brand = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Бренд',
+            feature_filter_name='brand',
+        )
+        cls.memory = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Память',
+            feature_filter_name='memory',
+            unit='ГБ',
+        )
+        Product.objects.bulk_create([
+            Product(
+                category=cls.category,
+                title=f'Телефон {i}',
+                slug=f'phone-{i}',
+                image='macbook_pro.jpg',
+                price=Decimal(100 * (i + 1)),
+            )
+            for i in range(30)
+        ])
+        cls.products = list(Product.objects.order_by('price'))
+        ProductFeatures.objects.bulk_create([
+            ProductFeatures(
+                product=product,
+                feature=feature,
+                value=value,
+            )
+            for i, product in enumerate(cls.products)
+            for feature, value in (
+                (cls.brand, BRANDS[i % 3]),
+                (cls.memory, MEMORY[i % 2]),
+            )
+        ])
+
+    def setUp(self):
+        invalidate_facet_index(self.category.pk)
+
+    def get(self, **params):
+        return self.client.get(self.category.get_absolute_url(), params)
+
+    def pks(self, response):
+        products = response.context['category_products']
+        return [product.pk for product in products]
+
+    def expected(self, brands=BRANDS, memory=MEMORY, low=0, high=10 ** 6):
+        return [
+            product.pk for i, product in enumerate(self.products)
+            if BRANDS[i % 3] in brands and MEMORY[i % 2] in memory
+            and low <= product.price <= high
+        ]
+
+    def counts(self, response, filter_name):
+        for facet in response.context['facets']:
+            if facet['filter_name'] == filter_name:
+                return {
+                    item['value']: item['count'] for item in facet['values']
+                }
+
+    def test_unfiltered_page(self):
+        response = self.get()
+        self.assertEqual(response.context['page_obj'].paginator.count, 30)
+        self.assertEqual(self.pks(response), self.expected()[:24])
+        self.assertEqual(
+            self.counts(response, 'brand'),
+            {'Apple': 10, 'Samsung': 10, 'Xiaomi': 10},
+        )
+
+    def test_filters_combine(self):
+        response = self.get(
+            brand=['Apple', 'Xiaomi'],
+            memory='64',
+            price_min='500',
+            price_max='2500',
+        )
+        self.assertEqual(
+            self.pks(response),
+            self.expected({'Apple', 'Xiaomi'}, {'64'}, 500, 2500),
+        )
+        # A facet is counted against every filter except its own.
+        self.assertEqual(
+            self.counts(response, 'brand'),
+            {
+                brand: len(self.expected({brand}, {'64'}, 500, 2500))
+                for brand in BRANDS
+            },
+        )
+        self.assertEqual(
+            self.counts(response, 'memory'),
+            {
+                memory: len(
+                    self.expected({'Apple', 'Xiaomi'}, {memory}, 500, 2500)
+                )
+                for memory in MEMORY
+            },
+        )
+
+    def test_descending_pages(self):
+        first = self.get(sort='price_desc')
+        second = self.get(sort='price_desc', page=2)
+        self.assertEqual(
+            self.pks(first) + self.pks(second),
+            self.expected()[::-1],
+        )
+
+    def test_unknown_filters(self):
+        response = self.get(color='red', price_min='cheap')
+        self.assertEqual(response.context['page_obj'].paginator.count, 30)
+        response = self.get(brand='Nokia')
+        self.assertEqual(response.context['page_obj'].paginator.count, 0)
+
+    def test_filtered_page_query_count(self):
+        self.get()
+        with CaptureQueriesContext(connection) as context:
+            self.get(brand='Apple', memory='128', price_max='2000')
+        self.assertFalse([
+            query for query in context.captured_queries
+            if 'specs_productfeatures' in query['sql']
+        ])
+        with self.assertNumQueries(2):
+            self.get(brand=['Apple', 'Samsung'], memory='64')
+
+    def test_index_follows_changes(self):
+        self.get()
+        product = self.products[0]
+        ProductFeatures.objects.filter(
+            product=product,
+            feature=self.brand,
+        ).get().delete()
+        ProductFeatures.objects.create(
+            product=product,
+            feature=self.brand,
+            value='Nokia',
+        )
+        response = self.get(brand='Nokia')
+        self.assertEqual(self.pks(response), [product.pk])
+        product.price = Decimal(5000)
+        product.save()
+        response = self.get(brand='Nokia', price_min='4000')
+        self.assertEqual(response.context['page_obj'].paginator.count, 1)
+        other = Category.objects.create(name='Планшеты', slug='tablets')
+        product.category = other
+        product.save()
+        response = self.get(brand='Nokia')
+        self.assertEqual(response.context['page_obj'].paginator.count, 0)
+
+
+class FeatureDocumentTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(
+            name='Ноутбуки',
+            slug='notebooks',
+        )
+        cls.diagonal = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Диагональ',
+            feature_filter_name='diagonal',
+            unit='дюйм',
+        )
+        cls.ram = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Оперативная память',
+            feature_filter_name='ram',
+        )
+        cls.product = Product.objects.create(
+            category=cls.category,
+            title='Ноутбук',
+            slug='notebook',
+            image='macbook_pro.jpg',
+        )
+
+    def features(self):
+        return Product.objects.get(pk=self.product.pk).features
+
+    def test_document_follows_product_features(self):
+        self.assertEqual(self.features(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            ram = ProductFeatures.objects.create(
+                product=self.product,
+                feature=self.ram,
+                value='16 ГБ',
+            )
+            ProductFeatures.objects.create(
+                product=self.product,
+                feature=self.diagonal,
+                value='15.6',
+            )
+        self.assertEqual(self.features(), [
+            {'name': 'Диагональ', 'value': '15.6', 'unit': 'дюйм'},
+            {'name': 'Оперативная память', 'value': '16 ГБ', 'unit': None},
+        ])
+        with self.captureOnCommitCallbacks(execute=True):
+            ram.delete()
+        self.assertEqual(len(self.features()), 1)
+
+    def test_document_follows_feature_definitions(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductFeatures.objects.create(
+                product=self.product,
+                feature=self.diagonal,
+                value='15.6',
+            )
+        self.diagonal.unit = '"'
+        self.diagonal.save()
+        self.assertEqual(self.features()[0]['unit'], '"')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.diagonal.delete()
+        self.assertEqual(self.features(), [])
+
+    def test_cascades_refresh_documents_in_one_batch(self):
+        products = [self.product, *(
+            Product.objects.create(
+                category=self.category,
+                title=f'Ноутбук {i}',
+                slug=f'notebook-{i}',
+                image='macbook_pro.jpg',
+            )
+            for i in range(3)
+        )]
+        with self.captureOnCommitCallbacks(execute=True):
+            for product in products:
+                ProductFeatures.objects.create(
+                    product=product,
+                    feature=self.ram,
+                    value='8 ГБ',
+                )
+        with mock.patch(
+            'specs.utils.refresh_feature_documents',
+            wraps=refresh_feature_documents,
+        ) as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.ram.delete()
+        refresh.assert_called_once()
+        self.assertEqual(
+            set(refresh.call_args[0][0]),
+            {product.pk for product in products},
+        )
+        self.assertEqual(self.features(), [])
+
+    def test_rebuild_command(self):
+        ProductFeatures.objects.create(
+            product=self.product,
+            feature=self.ram,
+            value='16 ГБ',
+        )
+        Product.objects.update(features=[])
+        call_command('rebuild_feature_documents', verbosity=0)
+        self.assertEqual(self.features(), [
+            {'name': 'Оперативная память', 'value': '16 ГБ', 'unit': None},
+        ])
+
+    def test_listing_reads_document(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductFeatures.objects.create(
+                product=self.product,
+                feature=self.ram,
+                value='16 ГБ',
+            )
+        # The first request builds the facet index.
+        self.client.get(self.category.get_absolute_url())
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.category.get_absolute_url())
+        self.assertContains(response, 'Оперативная память: 16 ГБ')
+        self.assertFalse([
+            query for query in context.captured_queries
+            if 'specs_' in query['sql']
+        ])
+
+    def test_product_page_reads_document(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductFeatures.objects.create(
+                product=self.product,
+                feature=self.ram,
+                value='16 ГБ',
+            )
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(self.product.get_absolute_url())
+        self.assertContains(response, 'Оперативная память')
+        self.assertFalse([
+            query for query in context.captured_queries
+            if 'specs_' in query['sql']
+        ])
+
+
+class ProductSpecTagTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(
+            name='Смартфоны',
+            slug='phones',
+        )
+        cls.screen = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Экран',
+            feature_filter_name='screen',
+            unit='дюйм',
+        )
+        cls.product = Product.objects.create(
+            category=cls.category,
+            title='Телефон',
+            slug='phone',
+            image='macbook_pro.jpg',
+        )
+        with cls.captureOnCommitCallbacks(execute=True):
+            cls.feature = ProductFeatures.objects.create(
+                product=cls.product,
+                feature=cls.screen,
+                value='6.1',
+            )
+
+    def setUp(self):
+        invalidate_product_spec(self.product.pk)
+
+    def render(self):
+        # Views render a freshly loaded product.
+        product = Product.objects.get(pk=self.product.pk)
+        return Template(
+            '{% load specifications %}{% product_spec product %}'
+        ).render(Context({'product': product}))
+
+    def test_fragment_is_cached(self):
+        product = Product.objects.get(pk=self.product.pk)
+        template = Template(
+            '{% load specifications %}{% product_spec product %}'
+        )
+        with self.assertNumQueries(0):
+            html = template.render(Context({'product': product}))
+        self.assertInHTML('<td>6.1 дюйм</td>', html)
+        product.features = []
+        self.assertEqual(
+            template.render(Context({'product': product})),
+            html,
+        )
+
+    def test_fragment_follows_product_features(self):
+        self.render()
+        self.feature.value = '6.7'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.feature.save()
+        self.assertInHTML('<td>6.7 дюйм</td>', self.render())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.feature.delete()
+        self.assertNotIn('<table', self.render())
+
+    def test_fragment_follows_feature_definitions(self):
+        self.render()
+        self.screen.feature_name = 'Диагональ экрана'
+        self.screen.save()
+        self.assertInHTML('<td>Диагональ экрана</td>', self.render())
+
+
+class FeatureValidationTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.category = Category.objects.create(
+            name='Ноутбуки',
+            slug='notebooks',
+        )
+        cls.other_category = Category.objects.create(
+            name='Смартфоны',
+            slug='phones',
+        )
+        cls.ram = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Оперативная память',
+            feature_filter_name='ram',
+        )
+        cls.color = CategoryFeature.objects.create(
+            category=cls.category,
+            feature_name='Цвет',
+            feature_filter_name='color',
+        )
+        cls.screen = CategoryFeature.objects.create(
+            category=cls.other_category,
+            feature_name='Экран',
+            feature_filter_name='screen',
+        )
+        FeatureValidator.objects.bulk_create([
+            FeatureValidator(
+                category=cls.category,
+                feature_key=cls.ram,
+                valid_feature_value=value,
+            )
+            for value in ('8 ГБ', '16 ГБ')
+        ])
+        cls.product = Product.objects.create(
+            category=cls.category,
+            title='Ноутбук',
+            slug='notebook',
+            image='macbook_pro.jpg',
+        )
+
+    def setUp(self):
+        invalidate_validator_index(self.category.pk)
+        invalidate_validator_index(self.other_category.pk)
+
+    def row(self, feature, value):
+        return ProductFeatures(
+            product=self.product,
+            feature=feature,
+            value=value,
+        )
+
+    def test_batch_reports_every_error(self):
+        rows = [
+            self.row(self.ram, '16 ГБ'),
+            self.row(self.ram, '32 ГБ'),
+            self.row(self.color, 'Любой'),
+            self.row(self.screen, '6.1'),
+            self.row(self.ram, '4 ГБ'),
+        ]
+        errors = validate_product_features(rows)
+        self.assertEqual(sorted(errors), [1, 3, 4])
+        self.assertIn('32 ГБ', errors[1])
+        # The index is built once and reused for the next batches.
+        with self.assertNumQueries(0):
+            validate_product_features(rows * 100)
+
+    def test_rows_without_loaded_relations(self):
+        rows = [
+            ProductFeatures(feature_id=self.ram.pk, value='8 ГБ'),
+            ProductFeatures(feature_id=self.ram.pk, value='1 ТБ'),
+            ProductFeatures(feature_id=0, value='8 ГБ'),
+        ]
+        self.assertEqual(sorted(validate_product_features(rows)), [1, 2])
+
+    def test_index_follows_validators(self):
+        rows = [self.row(self.ram, '32 ГБ')]
+        self.assertEqual(len(validate_product_features(rows)), 1)
+        FeatureValidator.objects.create(
+            category=self.category,
+            feature_key=self.ram,
+            valid_feature_value='32 ГБ',
+        )
+        self.assertEqual(validate_product_features(rows), {})
+
+    def test_form(self):
+        form = ProductFeaturesForm({
+            'product': self.product.pk,
+            'feature': self.ram.pk,
+            'value': '32 ГБ',
+        })
+        self.assertFalse(form.is_valid())
+        self.assertIn('value', form.errors)
 
-# Create your tests here.
+    def test_inline_formset(self):
+        FormSet = inlineformset_factory(
+            Product,
+            ProductFeatures,
+            formset=ProductFeaturesFormSet,
+            fields='__all__',
+            extra=2,
+        )
+        formset = FormSet({
+            'productfeatures_set-TOTAL_FORMS': '2',
+            'productfeatures_set-INITIAL_FORMS': '0',
+            'productfeatures_set-0-feature': self.ram.pk,
+            'productfeatures_set-0-value': '64 ГБ',
+            'productfeatures_set-1-feature': self.color.pk,
+            'productfeatures_set-1-value': 'Серый',
+        }, instance=self.product)
+        self.assertFalse(formset.is_valid())
+        self.assertIn('value', formset.forms[0].errors)
+        self.assertFalse(formset.forms[1].errors)
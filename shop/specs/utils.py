@@ -0,0 +1,97 @@
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from mainapp.models import Product
+from mainapp.search import index_products
+from mainapp.utils import (
+    bump_cache_version,
+    invalidate_product_detail,
+    update_many,
+)
+
+from .models import ProductFeatures
+
+
+PRODUCT_SPEC_KEY = 'product_spec:{}'
+PRODUCT_SPEC_VERSION_KEY = 'product_spec_category:{}'
+
+
+def build_feature_documents(product_ids):
+    """
+    Returns {product_id: [{'name', 'value', 'unit'}, ...]} with features
+    in the order they were defined for the category.
+    """
+    documents = {product_id: [] for product_id in product_ids}
+    rows = ProductFeatures.objects.filter(
+        product_id__in=documents,
+    ).order_by('product_id', 'feature_id', 'pk').values_list(
+        'product_id', 'feature__feature_name', 'value', 'feature__unit',
+    )
+    for product_id, name, value, unit in rows:
+        documents[product_id].append(
+            {'name': name, 'value': value, 'unit': unit}
+        )
+    return documents
+
+
+def refresh_feature_documents(product_ids, batch_size=1000):
+    """
+    Rewrites Product.features for the given products, marks them as
+    updated and reindexes them for search. Uses UPDATE only, so no
+    Product signals are sent.
+    """
+    product_ids = list(product_ids)
+    now = timezone.now()
+    for start in range(0, len(product_ids), batch_size):
+        documents = build_feature_documents(
+            product_ids[start:start + batch_size]
+        )
+        update_many(
+            Product,
+            [
+                Product(pk=product_id, features=features, updated_at=now)
+                for product_id, features in documents.items()
+            ],
+            ['features', 'updated_at'],
+        )
+        index_products(documents)
+
+
+def invalidate_product_spec(product_id):
+    cache.delete(PRODUCT_SPEC_KEY.format(product_id))
+
+
+def invalidate_category_specs(category_id):
+    bump_cache_version(PRODUCT_SPEC_VERSION_KEY.format(category_id))
+
+
+_pending = threading.local()
+
+
+def schedule_feature_refresh(product_id):
+    """
+    Queues a product whose feature values changed. The queue is flushed
+    once the transaction commits, so deleting a CategoryFeature or a
+    product with many values refreshes each document once, in a batch.
+    """
+    product_ids = getattr(_pending, 'product_ids', None)
+    if product_ids is None:
+        product_ids = _pending.product_ids = set()
+    product_ids.add(product_id)
+    # Every change registers a flush: callbacks of a rolled back
+    # transaction never run, and the first flush empties the queue.
+    transaction.on_commit(flush_feature_refresh)
+
+
+def flush_feature_refresh():
+    product_ids = getattr(_pending, 'product_ids', None)
+    if not product_ids:
+        return
+    _pending.product_ids = set()
+    refresh_feature_documents(product_ids)
+    for product_id in product_ids:
+        invalidate_product_spec(product_id)
+        invalidate_product_detail(product_id)
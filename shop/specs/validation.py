@@ -0,0 +1,98 @@
+from mainapp.utils import bump_cache_version, get_cache_version
+
+from .models import CategoryFeature, FeatureValidator, ProductFeatures
+
+
+VALIDATOR_VERSION_KEY = 'feature_validators:{}'
+
+# Like the facet indexes, validator indexes live in the process and are
+# rebuilt when the shared version of their category changes.
+_indexes = {}
+
+
+class ValidatorIndex:
+    """
+    Allowed values of every feature of a category. A feature without
+    validators accepts any value.
+    """
+
+    def __init__(self, features, validators):
+        self.features = dict(features)
+        self.allowed = {}
+        for feature_id, value in validators:
+            self.allowed.setdefault(feature_id, set()).add(value)
+
+    @classmethod
+    def build(cls, category_id):
+        features = CategoryFeature.objects.filter(
+            category_id=category_id,
+        ).values_list('pk', 'feature_name')
+        validators = FeatureValidator.objects.filter(
+            category_id=category_id,
+        ).values_list('feature_key_id', 'valid_feature_value')
+        return cls(features, validators)
+
+    def error(self, feature_id, value):
+        if feature_id not in self.features:
+            return 'Характеристика не относится к категории товара'
+        allowed = self.allowed.get(feature_id)
+        if allowed is not None and value not in allowed:
+            return (
+                f'Недопустимое значение «{value}» '
+                f'для характеристики «{self.features[feature_id]}»'
+            )
+        return None
+
+
+def get_validator_index(category_id):
+    version = get_cache_version(VALIDATOR_VERSION_KEY.format(category_id))
+    cached = _indexes.get(category_id)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    index = ValidatorIndex.build(category_id)
+    _indexes[category_id] = (version, index)
+    return index
+
+
+def invalidate_validator_index(category_id):
+    bump_cache_version(VALIDATOR_VERSION_KEY.format(category_id))
+
+
+def validate_product_features(rows):
+    """
+    Checks a batch of ProductFeatures rows (saved or not) and returns
+    {row number: message} for every invalid one. A row is checked
+    against the category of its product when the product is loaded,
+    otherwise against the category of its feature. Costs at most one
+    query for the features plus the index builds of unseen categories.
+    """
+    rows = list(rows)
+    categories = {}
+    missing = set()
+    for row in rows:
+        if ProductFeatures.feature.is_cached(row) and row.feature:
+            categories[row.feature_id] = row.feature.category_id
+        else:
+            missing.add(row.feature_id)
+    missing.difference_update(categories)
+    missing.discard(None)
+    if missing:
+        categories.update(CategoryFeature.objects.filter(
+            pk__in=missing,
+        ).values_list('pk', 'category_id'))
+    errors = {}
+    for number, row in enumerate(rows):
+        if ProductFeatures.product.is_cached(row) and row.product:
+            category_id = row.product.category_id
+        else:
+            category_id = categories.get(row.feature_id)
+        if category_id is None:
+            errors[number] = 'Неизвестная характеристика'
+            continue
+        error = get_validator_index(category_id).error(
+            row.feature_id,
+            row.value,
+        )
+        if error:
+            errors[number] = error
+    return errors